@@ -0,0 +1,189 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementations'))
+
+from batch import SOLVER_MODULES, peak_rss
+from instances import instance_kind, load_instance
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# The instances of every tier and the time budget (in seconds) of each of their solves
+TIERS = {
+    'small': {
+        'time_limit': 10,
+        'instances': ['ks_30_0', 'ks_50_0', 'gc_50_3', 'gc_70_7', 'tsp_51_1', 'tsp_100_3',
+                      'vrp_16_3_1', 'vrp_26_8_1', 'fl_16_1', 'fl_25_2'],
+    },
+    'medium': {
+        'time_limit': 60,
+        'instances': ['ks_200_0', 'ks_400_0', 'gc_250_5', 'gc_500_1', 'tsp_574_1', 'tsp_1889_1',
+                      'vrp_101_10_1', 'vrp_200_16_1', 'fl_100_1', 'fl_200_8'],
+    },
+    'large': {
+        'time_limit': 300,
+        'instances': ['ks_1000_0', 'ks_10000_0', 'gc_1000_5', 'gc_1000_9', 'tsp_33810_1', 'tsp_85900_1',
+                      'vrp_421_41_1', 'fl_1000_2', 'fl_2000_2', 'fl_4000_1'],
+    },
+}
+
+# Relative slowdown or memory growth reported as a regression
+DEFAULT_TOLERANCE = 0.1
+
+# Relative objective loss reported as a regression
+DEFAULT_OBJECTIVE_TOLERANCE = 0.01
+
+# Extra time (in seconds) a case gets beyond its budget before it is reported as hung
+HANG_SECONDS = 60
+
+# Timings below this many seconds are too noisy to compare
+MIN_COMPARED_SECONDS = 0.5
+
+
+def run_case(name, time_limit, results):
+    """
+        Solve one instance in a fresh process, recording when each improving solution was found
+    """
+    path = os.path.join(DATA_DIRECTORY, name)
+    kind = instance_kind(path)
+    measurement = {'instance': name, 'problem': kind, 'found': False, 'objective': None, 'optimal': 0}
+    improvements = list()
+    start = time.time()
+    try:
+        solver = importlib.import_module(SOLVER_MODULES[kind])
+        instance = load_instance(path, kind)
+        start = time.time()
+        result = solver.solve(instance, time_limit=time_limit,
+                              on_solution=lambda objective: improvements.append((time.time() - start, objective)))
+        measurement.update(found=result.found, objective=result.objective, optimal=result.optimal,
+                           phases=result.statistics.get('phases'))
+    except Exception as error:
+        measurement['error'] = f'{type(error).__name__}: {error}'
+    total_time = time.time() - start
+    measurement.update({
+        # Solvers that report no earlier solution found their only one when they returned
+        'first_solution_time': improvements[0][0] if improvements else total_time,
+        'final_solution_time': improvements[-1][0] if improvements else total_time,
+        'total_time': total_time,
+        'peak_rss': peak_rss(),
+    })
+    results.put(measurement)
+
+
+def run_tier(tier, time_limit=None):
+    """
+        Run every instance of a tier, one at a time so that timings and memory do not interfere
+    :param tier: The tier name
+    :param time_limit: The time budget (in seconds), None for the tier's default
+    :return: The measurement of every instance
+    """
+    time_limit = time_limit or TIERS[tier]['time_limit']
+    measurements = list()
+    for name in TIERS[tier]['instances']:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_case, args=(name, time_limit, results))
+        process.start()
+        try:
+            measurement = results.get(timeout=2 * time_limit + HANG_SECONDS)
+        except queue.Empty:
+            measurement = {'instance': name, 'problem': instance_kind(name), 'found': False, 'objective': None,
+                           'optimal': 0, 'error': 'no result (hung or crashed)', 'first_solution_time': None,
+                           'final_solution_time': None, 'total_time': None, 'peak_rss': None}
+            process.terminate()
+        process.join()
+        measurement['tier'] = tier
+        measurement['time_limit'] = time_limit
+        print(json.dumps(measurement), file=sys.stderr)
+        measurements.append(measurement)
+    return measurements
+
+
+def better(problem, objective, reference):
+    # The knapsack maximizes its value, the other problems minimize their cost
+    return objective > reference if problem == 'knapsack' else objective < reference
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE, objective_tolerance=DEFAULT_OBJECTIVE_TOLERANCE):
+    """
+        Find the regressions of a run against a baseline
+    :param baseline: The baseline measurements
+    :param current: The current measurements
+    :param tolerance: The relative slowdown or memory growth tolerated
+    :param objective_tolerance: The relative objective loss tolerated
+    :return: The regression messages
+    """
+    reference = {measurement['instance']: measurement for measurement in baseline['measurements']}
+    regressions = list()
+    for measurement in current['measurements']:
+        name = measurement['instance']
+        if name not in reference:
+            continue
+        base = reference[name]
+        if base['found'] and not measurement['found']:
+            regressions.append(f'{name}: no solution found (baseline {base["objective"]})')
+            continue
+        if base['found']:
+            limit = abs(base['objective']) * objective_tolerance
+            worse = better(measurement['problem'], base['objective'], measurement['objective'])
+            if worse and abs(measurement['objective'] - base['objective']) > limit:
+                regressions.append(f'{name}: objective {measurement["objective"]} vs {base["objective"]}')
+        if base['optimal'] and not measurement['optimal']:
+            regressions.append(f'{name}: optimality no longer proven')
+        for key in ('first_solution_time', 'final_solution_time', 'total_time'):
+            if base[key] is None or measurement[key] is None:
+                continue
+            if max(base[key], measurement[key]) >= MIN_COMPARED_SECONDS and \
+                    measurement[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{name}: {key} {measurement[key]:.2f}s vs {base[key]:.2f}s')
+        if base['peak_rss'] and measurement['peak_rss'] and \
+                measurement['peak_rss'] > base['peak_rss'] * (1 + tolerance):
+            regressions.append(f'{name}: peak memory {measurement["peak_rss"] / 1024 ** 2:.0f} MiB vs '
+                               f'{base["peak_rss"] / 1024 ** 2:.0f} MiB')
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the solvers and compare runs against a baseline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Run the benchmark tiers and save the measurements')
+    run.add_argument('--tier', choices=list(TIERS) + ['all'], default='small')
+    run.add_argument('--time-limit', type=float, default=None, help='Override the time budget of the tiers')
+    run.add_argument('--output', default=DEFAULT_BASELINE, help='The measurements file')
+
+    check = commands.add_parser('compare', help='Flag the regressions of a run against a baseline')
+    check.add_argument('current', help='The measurements of the run')
+    check.add_argument('--baseline', default=DEFAULT_BASELINE, help='The baseline measurements')
+    check.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                       help='The relative slowdown or memory growth tolerated')
+    check.add_argument('--objective-tolerance', type=float, default=DEFAULT_OBJECTIVE_TOLERANCE,
+                       help='The relative objective loss tolerated')
+    options = parser.parse_args(arguments)
+
+    if options.command == 'run':
+        tiers = list(TIERS) if options.tier == 'all' else [options.tier]
+        measurements = [measurement for tier in tiers for measurement in run_tier(tier, options.time_limit)]
+        with open(options.output, 'w') as output:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'cores': os.cpu_count(), 'measurements': measurements}, output, indent=2)
+        return 0
+
+    with open(options.baseline) as baseline_file, open(options.current) as current_file:
+        regressions = compare(json.load(baseline_file), json.load(current_file), options.tolerance,
+                              options.objective_tolerance)
+    for regression in regressions:
+        print(regression)
+    print(f'{len(regressions)} regression(s)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
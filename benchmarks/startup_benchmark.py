@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+IMPLEMENTATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementations')
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+# The small instance every solver module is started on, and its problem
+CASES = {
+    'knapsack': ('ks_30_0', 'knapsack'),
+    'graph_coloring': ('gc_50_3', 'coloring'),
+    'graph_coloring_tabu': ('gc_50_3', 'coloring'),
+    'tsp': ('tsp_51_1', 'tsp'),
+    'vrp': ('vrp_16_3_1', 'vrp'),
+    'vrp_alns': ('vrp_16_3_1', 'vrp'),
+    'facility': ('fl_25_2', 'facility'),
+}
+
+# Time budget (in seconds) of every solve, only the first result is waited for
+TIME_LIMIT = 2
+
+# Heavy libraries reported when a module import loads them
+HEAVY_MODULES = ('matplotlib', 'networkx', 'pandas', 'scipy.spatial', 'scipy.sparse.csgraph',
+                 'ortools.sat.python.cp_model', 'ortools.constraint_solver.pywrapcp', 'ortools.linear_solver.pywraplp')
+
+# Run in a fresh interpreter: import the module, then solve twice, the second time warm
+MEASURE = '''
+import json, sys, time
+start = time.time()
+sys.path.insert(0, {directory!r})
+import importlib
+solver = importlib.import_module({module!r})
+imported = time.time()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+from instances import load_instance
+instance = load_instance({path!r}, {problem!r})
+
+def first_result():
+    begin = time.time()
+    first = []
+    result = solver.solve(instance, time_limit={time_limit!r},
+                          on_solution=lambda objective: first or first.append(time.time()))
+    return (first[0] if first else time.time()) - begin, result.objective
+
+cold, objective = first_result()
+warm, _ = first_result()
+print(json.dumps({{'import_time': imported - start, 'heavy_modules': heavy, 'cold_first_result': cold,
+                  'warm_first_result': warm, 'objective': objective}}))
+'''
+
+
+def measure(module):
+    """
+        Measure the startup of a solver module in a fresh interpreter
+    :param module: The solver module
+    :return: The interpreter start time, the import time, the heavy libraries the import loaded, and the
+             time to the first result of a cold and of a warm solve (in seconds)
+    """
+    name, problem = CASES[module]
+    code = MEASURE.format(directory=IMPLEMENTATIONS_DIRECTORY, module=module, heavy=HEAVY_MODULES,
+                          path=os.path.join(DATA_DIRECTORY, name), problem=problem, time_limit=TIME_LIMIT)
+    start = time.time()
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    total = time.time() - start
+    measurement = json.loads(process.stdout.strip().splitlines()[-1])
+    measurement.update(module=module, instance=name, process_time=total)
+    return measurement
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Measure the import time and the time to the first result of '
+                                                 'every solver module')
+    parser.add_argument('modules', nargs='*', help=f'Solver modules (default: all of {", ".join(CASES)})')
+    parser.add_argument('--output', default=None, help='JSON file receiving the measurements')
+    options = parser.parse_args(arguments)
+    unknown = set(options.modules).difference(CASES)
+    if unknown:
+        parser.error(f'Unknown modules: {", ".join(sorted(unknown))}')
+
+    measurements = list()
+    print(f'{"module":<22}{"import":>9}{"cold":>9}{"warm":>9}  heavy modules loaded by the import')
+    for module in options.modules or list(CASES):
+        measurement = measure(module)
+        measurements.append(measurement)
+        print(f'{module:<22}{measurement["import_time"]:>8.3f}s{measurement["cold_first_result"]:>8.3f}s'
+              f'{measurement["warm_first_result"]:>8.3f}s  {", ".join(measurement["heavy_modules"]) or "-"}')
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(measurements, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
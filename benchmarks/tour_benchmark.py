@@ -0,0 +1,85 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementations'))
+
+from tour import ArrayTour, TwoLevelTour
+from tsp import read_points
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+INSTANCES = ['tsp_1000_1', 'tsp_5915_1', 'tsp_14051_1', 'tsp_33810_1', 'tsp_85900_1']
+MOVE_COUNT = 2000
+QUERY_COUNT = 200000
+
+
+class ListTour:
+    """
+        The plain Python list route, as returned by extract_route_from_solution
+    """
+    def __init__(self, order):
+        self.order = list(order)
+        self.size = len(self.order)
+
+    def next(self, city):
+        return self.order[(self.order.index(city) + 1) % self.size]
+
+    def two_opt_move(self, a, b, c, d):
+        i, j = self.order.index(b), self.order.index(c)
+        if self.order[(self.order.index(a) + 1) % self.size] != b:
+            i, j = j, i
+        if i <= j:
+            self.order[i:j + 1] = self.order[i:j + 1][::-1]
+        else:
+            # The path wraps around the end of the list
+            rotated = self.order[i:] + self.order[:i]
+            length = (j - i) % self.size + 1
+            rotated[:length] = rotated[:length][::-1]
+            self.order = rotated
+
+
+def benchmark(tour_class, order, moves, queries):
+    """
+        Time random 2-opt moves and next queries on a tour representation
+    :param tour_class: The tour class
+    :param order: The initial tour
+    :param moves: The 2-opt moves as (a, c) city pairs
+    :param queries: The cities to query
+    :return: The seconds per move and per query
+    """
+    tour = tour_class(order)
+    start = time.perf_counter()
+    for a, c in moves:
+        b, d = tour.next(a), tour.next(c)
+        if len({a, b, c, d}) == 4:
+            tour.two_opt_move(a, b, c, d)
+    move_time = (time.perf_counter() - start) / len(moves)
+
+    start = time.perf_counter()
+    for city in queries:
+        tour.next(city)
+    query_time = (time.perf_counter() - start) / len(queries)
+    return move_time, query_time
+
+
+def main(instances):
+    rng = random.Random(0)
+    print(f"{'instance':<14}{'tour':<14}{'move (us)':>12}{'next (us)':>12}")
+    for instance in instances:
+        with open(os.path.join(DATA_DIRECTORY, instance), 'r') as input_data_file:
+            points = read_points(input_data_file.read())
+        size = len(points)
+        order = list(range(size))
+        rng.shuffle(order)
+        moves = [(rng.randrange(size), rng.randrange(size)) for _ in range(MOVE_COUNT)]
+        queries = [rng.randrange(size) for _ in range(QUERY_COUNT)]
+        for tour_class in (ListTour, ArrayTour, TwoLevelTour):
+            # Plain list lookups are O(n), so query them less often
+            class_queries = queries[:QUERY_COUNT // 100] if tour_class is ListTour else queries
+            move_time, query_time = benchmark(tour_class, order, moves, class_queries)
+            print(f'{instance:<14}{tour_class.__name__:<14}{move_time * 1e6:>12.1f}{query_time * 1e6:>12.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or INSTANCES)
@@ -0,0 +1,66 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'implementations'))
+
+import vrp
+import vrp_alns
+
+from instances import load_instance
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+# Engines compared, by name
+ENGINES = {
+    'ortools': lambda instance, time_limit: vrp.solve(instance, time_limit=time_limit),
+    'alns': lambda instance, time_limit: vrp_alns.solve(instance, time_limit=time_limit),
+}
+
+
+def run(paths, time_limit, engines=tuple(ENGINES), output=sys.stdout):
+    """
+        Solve every instance with every engine under the same budget and write one JSON line per run
+    :param paths: The instance file paths
+    :param time_limit: The time budget (in seconds) of every run
+    :param engines: The engine names
+    :param output: The stream receiving the JSON lines
+    :return: The records
+    """
+    records = list()
+    for path in paths:
+        instance = load_instance(path, 'vrp')
+        record = {'instance': os.path.basename(path), 'time_limit': time_limit}
+        for engine in engines:
+            start = time.time()
+            result = ENGINES[engine](instance, time_limit)
+            record[engine] = result.objective
+            record[engine + '_time'] = time.time() - start
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+        records.append(record)
+    return records
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Compare the OR-Tools and the native ALNS VRP engines')
+    parser.add_argument('patterns', nargs='*', default=[os.path.join(DATA_DIRECTORY, 'vrp_*')],
+                        help='Instance file globs (default: every VRP instance)')
+    parser.add_argument('--time-limit', type=float, default=30, help='Time budget (in seconds) of every run')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    options = parser.parse_args(arguments)
+
+    paths = sorted({path for pattern in options.patterns for path in glob.glob(pattern) if os.path.isfile(path)})
+    records = run(paths, options.time_limit, options.engines)
+    if len(options.engines) == 2:
+        first, second = options.engines
+        wins = sum(1 for record in records if record[second] is not None and
+                   (record[first] is None or record[second] < record[first] - 1e-6))
+        print(f'{second} better than {first} on {wins} of {len(records)} instances', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import argparse
+import glob
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import sys
+import time
+
+from instances import instance_kind, load_instance
+from solution_cache import SolutionCache
+
+# Solver module of every problem
+SOLVER_MODULES = {
+    'knapsack': 'knapsack',
+    'coloring': 'graph_coloring',
+    'tsp': 'tsp',
+    'vrp': 'vrp',
+    'facility': 'facility',
+}
+
+# Backends the solver of every problem imports on first use, preloaded along with it
+SOLVER_BACKENDS = {
+    'knapsack': (),
+    'coloring': ('ortools.sat.python.cp_model', 'scipy.sparse.csgraph'),
+    'tsp': ('ortools.constraint_solver.pywrapcp', 'routing_portfolio', 'scipy.spatial'),
+    'vrp': ('ortools.constraint_solver.pywrapcp', 'routing_portfolio'),
+    'facility': ('ortools.linear_solver.pywraplp', 'scipy.spatial'),
+}
+
+# Time budget (in seconds) of every instance
+DEFAULT_TIME_LIMIT = 60
+
+# Extra time (in seconds) a solver gets to return after its budget before it is cancelled
+GRACE_SECONDS = 10
+
+# Memory (in bytes) reserved for every worker when sizing the pool
+DEFAULT_WORKER_MEMORY = 2 * 1024 ** 3
+
+
+def available_memory():
+    """
+        The memory (in bytes) available to new processes, None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        return None
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def pool_size(workers=None, worker_memory=DEFAULT_WORKER_MEMORY):
+    """
+        The number of worker processes fitting the cores and the available memory
+    :param workers: The requested number of workers, None for as many as fit
+    :param worker_memory: The memory (in bytes) reserved for every worker
+    :return: The pool size
+    """
+    size = workers or available_cores()
+    memory = available_memory()
+    if memory is not None:
+        size = min(size, max(1, memory // worker_memory))
+    return max(1, size)
+
+
+def peak_rss(pid=None):
+    """
+        The peak resident set size (in bytes) of a process, read from /proc when available
+    :param pid: The process id, None for the current process
+    :return: The peak RSS, None if unknown
+    """
+    try:
+        with open(f'/proc/{pid or "self"}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def kill_group(process):
+    """
+        Kill a worker process along with the processes its solver started (e.g. a pool of parallel
+        searches), which share the process group the worker leads
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # The worker has not made its process group yet, or every process of the group has exited
+        process.kill()
+
+
+def run_instance(path, time_limit, cache, results, solution_cache=None):
+    """
+        Solve one instance in a worker process and send its record
+    :param path: The instance file path
+    :param time_limit: The time budget (in seconds)
+    :param cache: Whether to use the binary instance sidecar
+    :param results: The queue receiving the record
+    :param solution_cache: The solution cache directory, None for none
+    """
+    os.setsid()
+    start = time.time()
+    record = {'instance': os.path.basename(path), 'path': path}
+    try:
+        kind = instance_kind(path)
+        record['problem'] = kind
+        solver = importlib.import_module(SOLVER_MODULES[kind])
+        result = solver.solve(load_instance(path, kind, cache), time_limit=time_limit,
+                              cache=solution_cache and SolutionCache(solution_cache))
+        record.update(status='solved' if result.found else 'no_solution', objective=result.objective,
+                      optimal=result.optimal, phases=result.statistics.get('phases'),
+                      cached=result.statistics.get('cached', False))
+    except Exception as error:
+        record.update(status='error', error=f'{type(error).__name__}: {error}')
+    record.update(wall_time=time.time() - start, peak_rss=peak_rss())
+    results.put(record)
+
+
+def run_batch(paths, time_limit=DEFAULT_TIME_LIMIT, workers=None, worker_memory=DEFAULT_WORKER_MEMORY,
+              grace=GRACE_SECONDS, cache=True, output=sys.stdout, solution_cache=None, preload=True):
+    """
+        Solve instances in parallel worker processes, one process per instance, and stream a JSON line
+        per instance as soon as it finishes. Workers that overrun their budget plus the grace period are
+        cancelled, with the processes they started, and reported with a timeout status.
+    :param paths: The instance file paths
+    :param time_limit: The time budget (in seconds) of every instance
+    :param workers: The number of parallel workers, None to fit the cores and the available memory
+    :param worker_memory: The memory (in bytes) reserved for every worker
+    :param grace: The extra time (in seconds) before an overrunning worker is cancelled
+    :param cache: Whether to use the binary instance sidecars
+    :param output: The stream receiving the JSON lines
+    :param solution_cache: The solution cache directory answering repeated solves, None for none
+    :param preload: Whether to import the needed solvers once before forking the workers, which then start
+                    with them loaded
+    :return: The records
+    """
+    size = pool_size(workers, worker_memory)
+    problems = dict()
+    for path in paths:
+        try:
+            problems[path] = instance_kind(path)
+        except ValueError:
+            # Not an instance file, its worker reports the error
+            problems[path] = None
+    if preload and multiprocessing.get_start_method() == 'fork':
+        for kind in set(problems.values()).difference([None]):
+            for module in (SOLVER_MODULES[kind],) + SOLVER_BACKENDS[kind]:
+                importlib.import_module(module)
+    pending = list(reversed(paths))
+    running = dict()
+    results = multiprocessing.Queue()
+    records = list()
+
+    def emit(record):
+        records.append(record)
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+
+    try:
+        while pending or running:
+            while pending and len(running) < size:
+                path = pending.pop()
+                # Not a daemon, so that parallel solvers can start their own processes
+                process = multiprocessing.Process(target=run_instance,
+                                                  args=(path, time_limit, cache, results, solution_cache))
+                process.start()
+                running[path] = (process, time.time())
+
+            # Take every record sent so far before looking for overrunning workers
+            received = list()
+            try:
+                received.append(results.get(timeout=0.5))
+                while True:
+                    received.append(results.get_nowait())
+            except queue.Empty:
+                pass
+            for record in received:
+                # A worker killed right after sending its record has been reported already
+                entry = running.pop(record['path'], None)
+                if entry is not None:
+                    entry[0].join()
+                    emit(record)
+
+            # Cancel the workers past their budget, and report the ones killed before sending a record (a
+            # worker that sent its record exits cleanly)
+            for path, (process, start) in list(running.items()):
+                elapsed = time.time() - start
+                status = None
+                if elapsed > time_limit + grace:
+                    rss = peak_rss(process.pid)
+                    kill_group(process)
+                    status = 'timeout'
+                elif not process.is_alive() and process.exitcode != 0:
+                    rss = None
+                    kill_group(process)
+                    status = 'crashed'
+                if status is not None:
+                    process.join()
+                    del running[path]
+                    emit({'instance': os.path.basename(path), 'path': path, 'problem': problems[path],
+                          'status': status, 'exit_code': process.exitcode, 'objective': None, 'optimal': 0,
+                          'wall_time': elapsed, 'peak_rss': rss})
+    finally:
+        # Interrupted: the workers are not daemons, stop them with everything they started
+        for process, _ in running.values():
+            kill_group(process)
+            process.join()
+    return records
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Solve every instance matching the patterns in parallel and '
+                                                 'write one JSON line per instance')
+    parser.add_argument('patterns', nargs='+', help='Instance file globs, e.g. data/vrp_*')
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT,
+                        help='Time budget (in seconds) of every instance')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of parallel workers (default: fit the cores and the available memory)')
+    parser.add_argument('--worker-memory', type=float, default=DEFAULT_WORKER_MEMORY / 1024 ** 3,
+                        help='Memory (in GiB) reserved for every worker when sizing the pool')
+    parser.add_argument('--grace', type=float, default=GRACE_SECONDS,
+                        help='Extra time (in seconds) before an overrunning worker is cancelled')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the binary instance sidecars')
+    parser.add_argument('--output', default=None, help='JSON Lines output file (default: standard output)')
+    parser.add_argument('--solution-cache', default=None,
+                        help='Directory of the solution cache reused across runs (default: no cache)')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='Let every worker import its solver instead of forking them with the solvers loaded')
+    options = parser.parse_args(arguments)
+
+    paths = sorted({path for pattern in options.patterns for path in glob.glob(pattern) if os.path.isfile(path)})
+    output = open(options.output, 'a') if options.output else sys.stdout
+    try:
+        run_batch(paths, options.time_limit, options.workers, int(options.worker_memory * 1024 ** 3),
+                  options.grace, not options.no_cache, output, options.solution_cache, not options.no_preload)
+    finally:
+        if options.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
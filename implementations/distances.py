@@ -0,0 +1,210 @@
+import numpy as np
+
+# Memory (in bytes) a stored distance matrix may take before distances are evaluated on the fly
+DEFAULT_MEMORY_LIMIT = 1024 ** 3
+
+# Memory (in bytes) of a single block of the blocked matrix computation
+BLOCK_MEMORY = 64 * 1024 ** 2
+
+
+def as_coordinates(points):
+    """
+        Convert points to a coordinate array
+    :param points: The points as (x, y) pairs
+    :return: The (n, 2) float64 coordinate array
+    """
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def cast_distances(distances, dtype, scale):
+    """
+        Cast float64 distances to the storage type
+    :param distances: The float64 distances
+    :param dtype: The storage type, integer types are scaled and rounded
+    :param scale: The scale factor applied before rounding to integers
+    :return: The cast distances
+    """
+    if np.issubdtype(dtype, np.integer):
+        return np.rint(distances * scale).astype(dtype)
+    return distances.astype(dtype)
+
+
+def pairwise_distances(sources, targets, dtype=np.float32, scale=1, block_memory=BLOCK_MEMORY):
+    """
+        Compute the Euclidean distances between two point sets with NumPy broadcasting,
+        one block of source rows at a time
+    :param sources: The source coordinates
+    :param targets: The target coordinates
+    :param dtype: The storage type of the distances
+    :param scale: The scale factor of integer storage types
+    :param block_memory: The memory (in bytes) of one block of float64 intermediates
+    :return: The (len(sources), len(targets)) distance matrix
+    """
+    sources = as_coordinates(sources)
+    targets = as_coordinates(targets)
+    matrix = np.empty((len(sources), len(targets)), dtype=dtype)
+    block_rows = max(1, block_memory // (3 * 8 * max(1, len(targets))))
+    for start in range(0, len(sources), block_rows):
+        block = sources[start:start + block_rows]
+        delta_x = block[:, 0, None] - targets[None, :, 0]
+        delta_y = block[:, 1, None] - targets[None, :, 1]
+        matrix[start:start + len(block)] = cast_distances(np.hypot(delta_x, delta_y), dtype, scale)
+    return matrix
+
+
+class DenseDistances:
+    """
+        A full distance matrix
+    """
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def __call__(self, i, j):
+        return self.matrix[i, j].item()
+
+    def row(self, i):
+        return self.matrix[i]
+
+    def to_dense(self):
+        return self.matrix
+
+
+class CondensedDistances:
+    """
+        A symmetric distance matrix storing only the upper triangle (without the diagonal),
+        row by row as in scipy's condensed form
+    """
+    def __init__(self, size, condensed):
+        self.size = size
+        self.condensed = condensed
+
+    def __len__(self):
+        return self.size
+
+    def offset(self, i):
+        # Position of the (i, i + 1) entry in the condensed array
+        return i * self.size - i * (i + 1) // 2
+
+    def __call__(self, i, j):
+        if i == j:
+            return self.condensed.dtype.type(0).item()
+        if i > j:
+            i, j = j, i
+        return self.condensed[self.offset(i) + j - i - 1].item()
+
+    def row(self, i):
+        row = np.zeros(self.size, dtype=self.condensed.dtype)
+        # Entries (j, i) with j < i are scattered over the earlier rows of the triangle
+        lower = np.arange(i)
+        row[:i] = self.condensed[lower * self.size - lower * (lower + 1) // 2 + i - lower - 1]
+        # Entries (i, j) with j > i are contiguous
+        start = self.offset(i)
+        row[i + 1:] = self.condensed[start:start + self.size - i - 1]
+        return row
+
+    def to_dense(self):
+        return np.stack([self.row(i) for i in range(self.size)])
+
+
+class LazyDistances:
+    """
+        Distances evaluated on the fly from coordinate arrays, for matrices that do not fit in memory
+    """
+    def __init__(self, sources, targets=None, dtype=np.float32, scale=1):
+        self.sources = as_coordinates(sources)
+        self.targets = self.sources if targets is None else as_coordinates(targets)
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __call__(self, i, j):
+        distance = float(np.hypot(*(self.sources[i] - self.targets[j])))
+        if np.issubdtype(self.dtype, np.integer):
+            return int(round(distance * self.scale))
+        return float(self.dtype.type(distance))
+
+    def row(self, i):
+        distances = np.hypot(self.targets[:, 0] - self.sources[i, 0], self.targets[:, 1] - self.sources[i, 1])
+        return cast_distances(distances, self.dtype, self.scale)
+
+    def to_dense(self):
+        return pairwise_distances(self.sources, self.targets, self.dtype, self.scale)
+
+
+def condensed_distances(points, dtype=np.float32, scale=1):
+    """
+        Compute the upper triangle of the distance matrix of a point set, one row at a time
+    :param points: The coordinates
+    :param dtype: The storage type of the distances
+    :param scale: The scale factor of integer storage types
+    :return: The condensed distances
+    """
+    points = as_coordinates(points)
+    size = len(points)
+    condensed = np.empty(size * (size - 1) // 2, dtype=dtype)
+    position = 0
+    for i in range(size):
+        # Each row only needs the points after it
+        tail = points[i + 1:]
+        distances = np.hypot(tail[:, 0] - points[i, 0], tail[:, 1] - points[i, 1])
+        condensed[position:position + len(tail)] = cast_distances(distances, dtype, scale)
+        position += len(tail)
+    return CondensedDistances(size, condensed)
+
+
+def distance_matrix(points, targets=None, dtype=np.float32, scale=1, layout='auto',
+                    memory_limit=DEFAULT_MEMORY_LIMIT, block_memory=BLOCK_MEMORY):
+    """
+        Build the distance matrix of a point set (or between two point sets)
+    :param points: The (source) coordinates
+    :param targets: The target coordinates, None for the symmetric matrix of the points
+    :param dtype: The storage type of the distances (e.g. np.float32 or np.int32)
+    :param scale: The scale factor of integer storage types
+    :param layout: 'dense', 'condensed', 'lazy' or 'auto' to store the upper triangle of symmetric
+                   matrices and fall back to on-the-fly evaluation above the memory limit
+    :param memory_limit: The memory (in bytes) a stored matrix may take
+    :param block_memory: The memory (in bytes) of one block of the blocked computation
+    :return: The distances, callable as distances(i, j)
+    """
+    symmetric = targets is None
+    source_count = len(points)
+    target_count = source_count if symmetric else len(targets)
+    itemsize = np.dtype(dtype).itemsize
+
+    if layout == 'auto':
+        if symmetric and source_count * (source_count - 1) // 2 * itemsize <= memory_limit:
+            layout = 'condensed'
+        elif not symmetric and source_count * target_count * itemsize <= memory_limit:
+            layout = 'dense'
+        else:
+            layout = 'lazy'
+
+    if layout == 'dense':
+        return DenseDistances(pairwise_distances(points, points if symmetric else targets, dtype, scale,
+                                                 block_memory))
+    if layout == 'condensed':
+        if not symmetric:
+            raise ValueError('Only symmetric distance matrices can be condensed')
+        return condensed_distances(points, dtype, scale)
+    if layout == 'lazy':
+        return LazyDistances(points, targets, dtype, scale)
+    raise ValueError(f'Unknown distance matrix layout: {layout}')
+
+
+def route_length(points, route, closed=True):
+    """
+        Compute the exact (float64) length of a route
+    :param points: The coordinates
+    :param route: The node sequence
+    :param closed: Whether the route returns to its first node
+    :return: The route length
+    """
+    path = as_coordinates(points)[np.asarray(route, dtype=np.int64)]
+    if closed and len(path):
+        path = np.vstack([path, path[:1]])
+    return float(np.hypot(*np.diff(path, axis=0).T).sum())
@@ -1,10 +1,26 @@
-import matplotlib.pyplot as plt
+import time
+
 import numpy as np
 
-from ortools.linear_solver import pywraplp
+from distances import distance_matrix
+from facility_heuristic import HEURISTIC_TIME_SECONDS, solve as heuristic_solve
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import SolveResult, improving, no_solution
+from solution_cache import cached_solve
+from stopping import watch
 
 MAX_TIME_SECONDS = 7200
 
+# Number of nearest facilities each customer may be assigned to in the sparse model
+NEAREST_FACILITIES = 20
+
+# Instances with more facility-customer pairs than this use the sparse model
+DENSE_MODEL_PAIRS = 100000
+
+# Instances with more facility-customer pairs than this are solved by the local search heuristic
+HEURISTIC_MODEL_PAIRS = 1000000
+
 
 class Facility:
     def __init__(self, index, setup_cost, capacity, location):
@@ -21,80 +37,214 @@ class Customer:
         self.location = location
 
 
-class Point:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+def nearest_facilities(facility_points, customer_points, k):
+    """
+        Find the k nearest facilities of every customer with a KD-tree
+    :param facility_points: The (n, 2) facility coordinates
+    :param customer_points: The (m, 2) customer coordinates
+    :param k: The number of facilities per customer
+    :return: The (m, k) facility indices and distances
+    """
+    from scipy.spatial import cKDTree
+    distances, indices = cKDTree(facility_points).query(customer_points, k=k)
+    return indices.reshape(len(customer_points), k), distances.reshape(len(customer_points), k)
 
 
-def visualize_solution(facilities, locations, solution):
+def add_row(model, var_index, coefficient, lower_bound, upper_bound):
     """
-        Visualize the graph coloring solution
-    :param facilities: The input facilities
-    :param locations: The input locations
-    :param solution: The selected solution
+        Append a linear constraint given by its coefficient arrays to a model proto
     """
-    # Extract facility locations
-    facility_locations = [(facility[2], facility[3]) for facility in facilities]
+    constraint = model.constraint.add()
+    constraint.var_index.extend(var_index.tolist())
+    constraint.coefficient.extend(coefficient.tolist())
+    constraint.lower_bound = lower_bound
+    constraint.upper_bound = upper_bound
 
-    # Extract locations
-    locations = [(location[1], location[2]) for location in locations]
 
-    # Plot facilities
-    used_facilities = list()
-    unused_facilities = list()
-    for i, facility_location in enumerate(facility_locations):
-        if i in solution:
-            used_facilities.append(facility_location)
-        else:
-            unused_facilities.append(facility_location)
-
-    print(len(facility_locations), len(used_facilities), len(unused_facilities), len(locations))
-    plt.plot([facility[0] for facility in used_facilities], [facility[1] for facility in used_facilities], 'gs',
-             label='Utilized Facilities')
-    plt.plot([facility[0] for facility in unused_facilities], [facility[1] for facility in unused_facilities], 'rs',
-             label='Unutilized Facilities')
-
-    # Plot locations and their assigned facilities
-    for i, location in enumerate(locations):
-        plt.plot(location[0], location[1], 'bo')
-        facility_index = solution[i]  # Facility index assigned to the customer
-        if facility_index != -1:
-            # Location of the assigned facility
-            facility_location = facility_locations[facility_index]
-            # Black line connecting customer to facility
-            plt.plot([location[0], facility_location[0]], [location[1], facility_location[1]],'k-')
-
-    plt.xlabel('X-coordinate')
-    plt.ylabel('Y-coordinate')
-    plt.title('Facility Location Problem Solution')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
-
-
-def distance(point1, point2):
-    return np.sqrt((point1.x - point2.x) ** 2 + (point1.y - point2.y) ** 2)
-
-
-def solve_it(input_data):
-    lines = input_data.split('\n')
-    parts = lines[0].split()
-    facility_count = int(parts[0])
-    customer_count = int(parts[1])
-
-    facilities = list()
-    for i in range(1, facility_count + 1):
-        parts = lines[i].split()
-        facilities.append([float(parts[0]), float(parts[1]), float(parts[2]), float(parts[3])])
-
-    customers = list()
-    for i in range(facility_count + 1, facility_count + 1 + customer_count):
-        parts = lines[i].split()
-        customers.append([int(parts[0]), float(parts[1]), float(parts[2])])
+def build_sparse_model(setup_costs, capacities, demands, neighbors, costs, aggregate_links):
+    """
+        Build the facility location MIP over the candidate facilities of every customer, directly as a
+        model proto from coefficient arrays. Variable i is x[i] (facility i is open) and variable
+        facility_count + j * k + r is y[j, r] (customer j is served by its r-th nearest facility).
+    :param setup_costs: The facility setup costs
+    :param capacities: The facility capacities
+    :param demands: The customer demands
+    :param neighbors: The (m, k) candidate facilities of every customer
+    :param costs: The (m, k) assignment costs
+    :param aggregate_links: Whether to link each facility to its customers with one aggregated
+                            constraint instead of one constraint per customer
+    :return: The model proto
+    """
+    from ortools.linear_solver import linear_solver_pb2
+    facility_count = len(setup_costs)
+    customer_count, k = neighbors.shape
+    model = linear_solver_pb2.MPModelProto()
+    for objective_coefficient in np.concatenate([setup_costs, costs.ravel()]).tolist():
+        variable = model.variable.add()
+        variable.lower_bound = 0
+        variable.upper_bound = 1
+        variable.is_integer = True
+        variable.objective_coefficient = objective_coefficient
+
+    # Each customer is served by exactly one of its candidate facilities
+    assignment = facility_count + np.arange(customer_count * k).reshape(customer_count, k)
+    ones = np.ones(k)
+    for j in range(customer_count):
+        add_row(model, assignment[j], ones, 1, 1)
+
+    # Facility capacity constraints, which also close the facilities serving no demand
+    pair_facilities = neighbors.ravel()
+    order = np.argsort(pair_facilities, kind='stable')
+    bounds = np.searchsorted(pair_facilities[order], np.arange(facility_count + 1))
+    pair_demands = np.repeat(demands, k)
+    for i in range(facility_count):
+        pairs = order[bounds[i]:bounds[i + 1]]
+        add_row(model, np.append(facility_count + pairs, i),
+                np.append(pair_demands[pairs], -capacities[i]), -np.inf, 0)
+        if aggregate_links:
+            # Facilities can only serve if they are opened, for all of their customers at once
+            add_row(model, np.append(facility_count + pairs, i), np.append(np.ones(len(pairs)), -len(pairs)),
+                    -np.inf, 0)
+
+    if not aggregate_links:
+        # Facilities can only serve if they are opened
+        link = np.array([1.0, -1.0])
+        for pair, facility in enumerate(pair_facilities.tolist()):
+            add_row(model, np.array([facility_count + pair, facility]), link, -np.inf, 0)
+    return model
+
+
+def add_sparse_hint(model, neighbors, assignment, facility_count):
+    """
+        Hint a known assignment to the sparse model, leaving out the customers whose facility is not
+        one of their candidates
+    :param model: The model proto
+    :param neighbors: The (m, k) candidate facilities of every customer
+    :param assignment: The facility of every customer
+    :param facility_count: The number of facilities
+    """
+    customer_count, k = neighbors.shape
+    matches = neighbors == np.asarray(assignment)[:, None]
+    hinted = np.flatnonzero(matches.any(axis=1))
+    opened = np.unique(np.asarray(assignment))
+    model.solution_hint.var_index.extend(opened.tolist())
+    model.solution_hint.var_value.extend([1.0] * len(opened))
+    pairs = facility_count + hinted * k + matches[hinted].argmax(axis=1)
+    model.solution_hint.var_index.extend(pairs.tolist())
+    model.solution_hint.var_value.extend([1.0] * len(pairs))
+
+
+def sparse_mip(facilities, customers, k=NEAREST_FACILITIES, aggregate_links=False, time_limit=MAX_TIME_SECONDS,
+               instrumentation=None, initial=None):
+    """
+        Solve the facility location MIP restricted to the k nearest facilities of every customer,
+        doubling k while the restricted model is infeasible
+    :param facilities: The facilities as [setup cost, capacity, x, y]
+    :param customers: The customers as [demand, x, y]
+    :param k: The number of candidate facilities per customer
+    :param aggregate_links: Whether to aggregate the facility opening constraints
+    :param time_limit: The time limit (in seconds) of all the rounds together
+    :param instrumentation: The instrumentation timing the build, solve and extract phases, which add up
+                            over the models rebuilt with more candidates
+    :param initial: A known assignment given to the solver as a hint
+    :return: The total cost, the optimality flag and the assignment
+    """
+    from ortools.linear_solver import linear_solver_pb2
+    from ortools.linear_solver import pywraplp
+    instrumentation = instrumentation or Instrumentation()
+    facilities = np.asarray(facilities, dtype=np.float64)
+    customers = np.asarray(customers, dtype=np.float64)
+    k = min(k, len(facilities))
+    # The rounds with more candidates share the time limit
+    deadline = time.time() + time_limit
+    while True:
+        with instrumentation.phase('build'):
+            neighbors, costs = nearest_facilities(facilities[:, 2:4], customers[:, 1:3], k)
+            model = build_sparse_model(facilities[:, 0], facilities[:, 1], customers[:, 0], neighbors, costs,
+                                       aggregate_links)
+            if initial is not None:
+                add_sparse_hint(model, neighbors, initial, len(facilities))
+            solver = pywraplp.Solver.CreateSolver('SCIP')
+            solver.LoadModelFromProto(model)
+            solver.SetTimeLimit(max(1, int((deadline - time.time()) * 1000)))
+
+        with instrumentation.phase('solve'), watch(solver.InterruptSolve):
+            status = solver.Solve()
+        if status != pywraplp.Solver.INFEASIBLE or k == len(facilities) or time.time() >= deadline:
+            break
+        # Some customers need facilities further away than their candidates
+        k = min(2 * k, len(facilities))
+
+    if status not in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+        return None, 0, None
+
+    with instrumentation.phase('extract'):
+        response = linear_solver_pb2.MPSolutionResponse()
+        solver.FillSolutionResponseProto(response)
+        values = np.array(response.variable_value[len(facilities):]).reshape(neighbors.shape)
+        solution = neighbors[np.arange(len(customers)), values.argmax(axis=1)].tolist()
+    optimal = 1 if status == pywraplp.Solver.OPTIMAL and k == len(facilities) else 0
+    return response.objective_value, optimal, solution
+
+
+def dense_mip(facilities, customers, time_limit=MAX_TIME_SECONDS, instrumentation=None, initial=None):
+    """
+        Solve the facility location MIP over every facility-customer pair
+    :param facilities: The facilities as [setup cost, capacity, x, y]
+    :param customers: The customers as [demand, x, y]
+    :param time_limit: The time limit (in seconds)
+    :param instrumentation: The instrumentation timing the build, solve and extract phases
+    :param initial: A known assignment given to the solver as a hint
+    :return: The total cost, the optimality flag and the assignment, None if no solution was found
+    """
+    from ortools.linear_solver import pywraplp
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('build'):
+        solver, x, y = build_dense_model(facilities, customers, time_limit)
+        if initial is not None:
+            opened = set(initial)
+            solver.SetHint([x[i] for i in range(len(facilities))] + [y[i, j] for j, i in enumerate(initial)],
+                           [float(i in opened) for i in range(len(facilities))] + [1.0] * len(initial))
+
+    # Solve the problem
+    with instrumentation.phase('solve'), watch(solver.InterruptSolve):
+        status = solver.Solve()
+
+    if status not in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
+        return None, 0, None
+    optimal = 1 if status == pywraplp.Solver.OPTIMAL else 0
+
+    with instrumentation.phase('extract'):
+        total_cost = solver.Objective().Value()
+        solution = [-1] * len(customers)
+        for j in range(len(customers)):
+            for i in range(len(facilities)):
+                if y[i, j].solution_value() == 1:
+                    solution[j] = i
+                    break
+    return total_cost, optimal, solution
+
+
+def build_dense_model(facilities, customers, time_limit):
+    """
+        Build the facility location MIP over every facility-customer pair
+    :param facilities: The facilities as [setup cost, capacity, x, y]
+    :param customers: The customers as [demand, x, y]
+    :param time_limit: The time limit (in seconds)
+    :return: The solver holding the model, the facility variables and the assignment variables
+    """
+    from ortools.linear_solver import pywraplp
+    facility_count = len(facilities)
+    customer_count = len(customers)
+
+    # Facility to customer distances, evaluated on the fly if the matrix does not fit in memory
+    distances = distance_matrix([(facility[2], facility[3]) for facility in facilities],
+                                [(customer[1], customer[2]) for customer in customers], dtype=np.float64)
+
     # Create a solver
     solver = pywraplp.Solver.CreateSolver('SCIP')
-    solver.set_time_limit(MAX_TIME_SECONDS * 60000)
+    # A zero limit would mean no limit to the solver
+    solver.set_time_limit(max(1, int(time_limit * 1000)))
 
     # Define variables
     x = dict()
@@ -129,34 +279,95 @@ def solve_it(input_data):
     for i in range(facility_count):
         objective.SetCoefficient(x[i], facilities[i][0])
         for j in range(customer_count):
-            objective.SetCoefficient(y[i, j], distance(Point(customers[j][1], customers[j][2]),
-                                                       Point(facilities[i][2], facilities[i][3])))
+            objective.SetCoefficient(y[i, j], distances(i, j))
 
     objective.SetMinimization()
+    return solver, x, y
 
-    # Solve the problem
-    status = solver.Solve()
 
-    if status == pywraplp.Solver.OPTIMAL:
-        optimal = 1
+def solve(input_data, method='auto', k=NEAREST_FACILITIES, aggregate_links=False, time_limit=None,
+          on_solution=None, instrumentation=None, cache=None, initial=None):
+    """
+        Solve the facility location problem
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param method: The model, 'dense' (every facility-customer pair), 'sparse' (the k nearest facilities
+                   of every customer), 'heuristic' (local search) or 'auto' to pick by the number of pairs
+    :param k: The number of candidate facilities per customer of the sparse model
+    :param aggregate_links: Whether the sparse model aggregates the facility opening constraints
+    :param time_limit: The time limit (in seconds), None for the default of the method
+    :param on_solution: The callback receiving the objective of every improving solution (the MIP models
+                        only report their final solution, pywraplp has no progress callback)
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param cache: The solution cache answering repeated solves and warm-starting the search
+    :param initial: A known assignment, a hint for the MIP models and the starting point of the heuristic
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'facility')
+    facility_count = len(instance['setup_costs'])
+    customer_count = len(instance['demands'])
+
+    if method == 'auto':
+        pairs = facility_count * customer_count
+        if pairs > HEURISTIC_MODEL_PAIRS:
+            method = 'heuristic'
+        else:
+            method = 'sparse' if pairs > DENSE_MODEL_PAIRS else 'dense'
+    if time_limit is None:
+        time_limit = HEURISTIC_TIME_SECONDS if method == 'heuristic' else MAX_TIME_SECONDS
+    if cache is not None:
+        config = {'method': method, 'k': k, 'aggregate_links': aggregate_links}
+        return cached_solve(cache, 'facility', instance, config, time_limit, on_solution, lambda initial: solve(
+            instance, method, k, aggregate_links, time_limit, on_solution, instrumentation, initial=initial))
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+
+    facilities = np.column_stack([instance['setup_costs'], instance['capacities'],
+                                  instance['facility_points']]).tolist()
+    customers = [[demand, x, y] for demand, (x, y) in zip(instance['demands'].tolist(),
+                                                          instance['customer_points'].tolist())]
+
+    statistics = dict()
+    if method == 'dense':
+        total_cost, optimal, solution = dense_mip(facilities, customers, time_limit, instrumentation, initial)
+    elif method == 'sparse':
+        total_cost, optimal, solution = sparse_mip(facilities, customers, k, aggregate_links, time_limit,
+                                                   instrumentation, initial)
+    elif method == 'heuristic':
+        with instrumentation.phase('solve'):
+            total_cost, solution, lower_bound = heuristic_solve(facilities, customers, time_limit,
+                                                                on_solution=on_solution, initial=initial)
+        if solution is not None:
+            # The heuristic proves optimality only when the Lagrangian bound closes the gap
+            optimal = int(total_cost - lower_bound <= 1e-6 * total_cost)
+            statistics['lower_bound'] = lower_bound
+            statistics['gap'] = (total_cost - lower_bound) / total_cost
     else:
-        optimal = 0
+        raise ValueError(f'Unknown facility location method: {method}')
+    if solution is None:
+        return no_solution('facility', instance, instrumentation.statistics())
 
-    total_cost = solver.Objective().Value()
-    solution = [-1] * customer_count
-    for j in range(customer_count):
-        for i in range(facility_count):
-            if y[i, j].solution_value() == 1:
-                solution[j] = i
-                break
+    on_solution(total_cost)
 
     # Prepare the solution in the specified output format
-    output_data = '%.2f' % total_cost + ' ' + str(optimal) + '\n'
-    output_data += ' '.join(map(str, solution))
+    with instrumentation.phase('output'):
+        output_data = '%.2f' % total_cost + ' ' + str(optimal) + '\n'
+        output_data += ' '.join(map(str, solution))
+    statistics.update(instrumentation.statistics())
+    return SolveResult('facility', total_cost, optimal, solution, output_data, instance, statistics)
 
-    visualize_solution(facilities, customers, solution)
 
-    return output_data
+def solve_it(input_data, method='auto', k=NEAREST_FACILITIES, aggregate_links=False, time_limit=None):
+    """
+        Solve the facility location problem
+    :param input_data: The input data
+    :param method: The model, 'dense', 'sparse', 'heuristic' or 'auto' to pick by the number of pairs
+    :param k: The number of candidate facilities per customer of the sparse model
+    :param aggregate_links: Whether the sparse model aggregates the facility opening constraints
+    :param time_limit: The time limit (in seconds), None for the default of the method
+    :return: The formatted solution
+    """
+    return solve(input_data, method, k, aggregate_links, time_limit).output
 
 
 if __name__ == '__main__':
@@ -0,0 +1,439 @@
+import math
+import random
+import time
+import numpy as np
+
+from stopping import expired
+
+# Time budget (in seconds) of the heuristic
+HEURISTIC_TIME_SECONDS = 60
+
+# Number of nearest facilities considered for every customer
+CANDIDATE_COUNT = 32
+
+# Share of the time budget spent on the Lagrangian lower bound
+BOUND_TIME_SHARE = 0.2
+
+# Number of nearest closed facilities tried as the replacement of a facility being closed
+SWAP_COUNT = 4
+
+# Smallest improvement accepted by the local search
+EPSILON = 1e-7
+
+
+class Instance:
+    """
+        A facility location instance with the candidate facilities of every customer
+    """
+    def __init__(self, facilities, customers, k=CANDIDATE_COUNT):
+        from scipy.spatial import cKDTree
+        facilities = np.asarray(facilities, dtype=np.float64)
+        customers = np.asarray(customers, dtype=np.float64)
+        self.setup_costs = facilities[:, 0]
+        self.capacities = facilities[:, 1]
+        self.facility_points = facilities[:, 2:4]
+        self.demands = customers[:, 0]
+        self.customer_points = customers[:, 1:3]
+        self.facility_count = len(facilities)
+        self.customer_count = len(customers)
+
+        # Candidate facilities of every customer, nearest first
+        self.k = min(k, self.facility_count)
+        distances, neighbors = cKDTree(self.facility_points).query(self.customer_points, k=self.k)
+        self.neighbors = neighbors.reshape(self.customer_count, self.k)
+        self.distances = distances.reshape(self.customer_count, self.k)
+
+        # Customers listing every facility as a candidate
+        pair_facilities = self.neighbors.ravel()
+        order = np.argsort(pair_facilities, kind='stable')
+        bounds = np.searchsorted(pair_facilities[order], np.arange(self.facility_count + 1))
+        self.facility_customers = [order[bounds[i]:bounds[i + 1]] // self.k for i in range(self.facility_count)]
+        self.facility_distances = [self.distances.ravel()[order[bounds[i]:bounds[i + 1]]]
+                                   for i in range(self.facility_count)]
+
+        # Nearest other facilities of every facility, the replacements tried by swap moves
+        _, nearby = cKDTree(self.facility_points).query(self.facility_points, k=min(self.k, self.facility_count))
+        self.nearby_facilities = nearby.reshape(self.facility_count, -1)[:, 1:]
+
+        # Plain lists for the scalar lookups of the exchange moves
+        self.facility_xy = self.facility_points.tolist()
+        self.customer_xy = self.customer_points.tolist()
+
+    def distance(self, facility, customer):
+        (x1, y1), (x2, y2) = self.facility_xy[facility], self.customer_xy[customer]
+        return math.hypot(x1 - x2, y1 - y2)
+
+
+class Solution:
+    """
+        An assignment of customers to facilities with its loads, facility sizes and cost, updated
+        incrementally by every move
+    """
+    def __init__(self, instance, assignment):
+        self.instance = instance
+        self.assignment = np.asarray(assignment, dtype=np.int64)
+        self.loads = np.bincount(self.assignment, weights=instance.demands, minlength=instance.facility_count)
+        self.sizes = np.bincount(self.assignment, minlength=instance.facility_count)
+        self.members = [set() for _ in range(instance.facility_count)]
+        for customer, facility in enumerate(self.assignment.tolist()):
+            self.members[facility].add(customer)
+        self.costs = np.hypot(*(instance.facility_points[self.assignment] - instance.customer_points).T)
+        self.cost = float(self.costs.sum() + instance.setup_costs[self.sizes > 0].sum())
+
+    def move(self, customer, facility, distance):
+        """
+            Reassign a customer, keeping the cost up to date
+        """
+        instance = self.instance
+        previous = int(self.assignment[customer])
+        demand = instance.demands[customer]
+        self.cost += distance - self.costs[customer]
+        if self.sizes[previous] == 1:
+            self.cost -= instance.setup_costs[previous]
+        if self.sizes[facility] == 0:
+            self.cost += instance.setup_costs[facility]
+        self.assignment[customer] = facility
+        self.costs[customer] = distance
+        self.loads[previous] -= demand
+        self.loads[facility] += demand
+        self.sizes[previous] -= 1
+        self.sizes[facility] += 1
+        self.members[previous].discard(customer)
+        self.members[facility].add(customer)
+
+    def copy(self):
+        solution = Solution.__new__(Solution)
+        solution.instance = self.instance
+        solution.assignment = self.assignment.copy()
+        solution.loads = self.loads.copy()
+        solution.sizes = self.sizes.copy()
+        solution.members = [set(members) for members in self.members]
+        solution.costs = self.costs.copy()
+        solution.cost = self.cost
+        return solution
+
+
+def greedy_construction(instance):
+    """
+        Assign the customers by decreasing demand to the facility with the lowest distance plus setup
+        cost (for closed facilities) that still has room
+    :param instance: The instance
+    :return: The assignment, None if a customer fits in no facility
+    """
+    loads = np.zeros(instance.facility_count)
+    opened = np.zeros(instance.facility_count, dtype=bool)
+    assignment = np.zeros(instance.customer_count, dtype=np.int64)
+    for customer in np.argsort(-instance.demands, kind='stable').tolist():
+        demand = instance.demands[customer]
+        facilities = instance.neighbors[customer]
+        costs = instance.distances[customer] + np.where(opened[facilities], 0, instance.setup_costs[facilities])
+        costs[loads[facilities] + demand > instance.capacities[facilities]] = np.inf
+        if np.isfinite(costs.min()):
+            facility = int(facilities[costs.argmin()])
+        else:
+            # None of the candidates has room left, look at every facility
+            distances = np.hypot(*(instance.facility_points - instance.customer_points[customer]).T)
+            costs = distances + np.where(opened, 0, instance.setup_costs)
+            costs[loads + demand > instance.capacities] = np.inf
+            if not np.isfinite(costs.min()):
+                return None
+            facility = int(costs.argmin())
+        assignment[customer] = facility
+        loads[facility] += demand
+        opened[facility] = True
+    return assignment
+
+
+def shift_moves(solution, order, deadline):
+    """
+        Move every customer to the candidate facility that lowers the cost the most
+    :return: Whether the cost decreased
+    """
+    instance = solution.instance
+    improved = False
+    for customer in order:
+        if expired(deadline):
+            break
+        current = int(solution.assignment[customer])
+        demand = instance.demands[customer]
+        facilities = instance.neighbors[customer]
+        deltas = instance.distances[customer] - solution.costs[customer]
+        deltas = deltas + np.where(solution.sizes[facilities] == 0, instance.setup_costs[facilities], 0)
+        if solution.sizes[current] == 1:
+            deltas -= instance.setup_costs[current]
+        deltas[(solution.loads[facilities] + demand > instance.capacities[facilities])
+               | (facilities == current)] = np.inf
+        best = int(deltas.argmin())
+        if deltas[best] < -EPSILON:
+            solution.move(customer, int(facilities[best]), float(instance.distances[customer, best]))
+            improved = True
+    return improved
+
+
+def exchange_moves(solution, order, deadline):
+    """
+        Exchange customers between two open facilities, which frees the moves that capacity blocks
+    :return: Whether the cost decreased
+    """
+    instance = solution.instance
+    demands, capacities = instance.demands, instance.capacities
+    improved = False
+    for first in order:
+        if expired(deadline):
+            break
+        a = int(solution.assignment[first])
+        first_demand = demands[first]
+        for rank, b in enumerate(instance.neighbors[first].tolist()):
+            if b == a or solution.sizes[b] == 0:
+                continue
+            first_delta = instance.distances[first, rank] - solution.costs[first]
+            room_a = capacities[a] - solution.loads[a] + first_demand
+            room_b = capacities[b] - solution.loads[b]
+            for second in solution.members[b]:
+                second_demand = demands[second]
+                if second_demand > room_a or first_demand - second_demand > room_b:
+                    continue
+                distance = instance.distance(a, second)
+                if first_delta + distance - solution.costs[second] < -EPSILON:
+                    solution.move(first, b, float(instance.distances[first, rank]))
+                    solution.move(second, a, distance)
+                    improved = True
+                    break
+            if solution.assignment[first] != a:
+                break
+    return improved
+
+
+def close_move(solution, facility, replacement=None):
+    """
+        Close a facility, reassigning each of its customers to its nearest other open candidate with room;
+        a swap move also opens a replacement facility, which the customers may use too
+    :return: Whether the move was applied (the cost decreased)
+    """
+    instance = solution.instance
+    extra_loads = dict()
+    plan = list()
+    delta = -instance.setup_costs[facility]
+    if replacement is not None:
+        delta += instance.setup_costs[replacement]
+    for customer in sorted(solution.members[facility], key=lambda c: -instance.demands[c]):
+        demand = instance.demands[customer]
+        target = None
+        for rank, candidate in enumerate(instance.neighbors[customer].tolist()):
+            if candidate == facility or (solution.sizes[candidate] == 0 and candidate != replacement):
+                continue
+            if solution.loads[candidate] + extra_loads.get(candidate, 0) + demand <= instance.capacities[candidate]:
+                target = (candidate, float(instance.distances[customer, rank]))
+                break
+        if target is None:
+            return False
+        extra_loads[target[0]] = extra_loads.get(target[0], 0) + demand
+        delta += target[1] - solution.costs[customer]
+        plan.append((customer, target))
+    if replacement is not None and replacement not in extra_loads:
+        return False
+    if delta >= -EPSILON:
+        return False
+    for customer, (candidate, distance) in plan:
+        solution.move(customer, candidate, distance)
+    return True
+
+
+def swap_move(solution, facility):
+    """
+        Close an open facility and open one of its nearest closed facilities instead
+    :return: Whether a swap was applied (the cost decreased)
+    """
+    instance = solution.instance
+    nearby = instance.nearby_facilities[facility]
+    replacements = nearby[solution.sizes[nearby] == 0][:SWAP_COUNT]
+    for replacement in replacements.tolist():
+        if close_move(solution, facility, replacement):
+            return True
+    return False
+
+
+def open_move(solution, facility):
+    """
+        Open a facility and move to it the customers that save the most, as long as it has room
+    :return: Whether the facility was opened (the cost decreased)
+    """
+    instance = solution.instance
+    customers = instance.facility_customers[facility]
+    distances = instance.facility_distances[facility]
+    savings = solution.costs[customers] - distances
+    positive = savings > EPSILON
+    if not positive.any():
+        return False
+    order = np.argsort(-savings[positive], kind='stable')
+    customers, distances, savings = customers[positive][order], distances[positive][order], savings[positive][order]
+
+    room = instance.capacities[facility]
+    chosen = list()
+    for i, customer in enumerate(customers.tolist()):
+        if instance.demands[customer] <= room:
+            room -= instance.demands[customer]
+            chosen.append(i)
+    if not chosen:
+        return False
+
+    # Facilities left without customers no longer pay their setup cost
+    moved = customers[chosen]
+    left = solution.sizes - np.bincount(solution.assignment[moved], minlength=instance.facility_count)
+    emptied = (left == 0) & (solution.sizes > 0)
+    delta = instance.setup_costs[facility] - savings[chosen].sum() - instance.setup_costs[emptied].sum()
+    if delta >= -EPSILON:
+        return False
+    for i in chosen:
+        solution.move(int(customers[i]), facility, float(distances[i]))
+    return True
+
+
+def local_search(solution, rng, deadline):
+    """
+        Apply shift, exchange, close, swap and open moves until none improves the cost or the deadline passes
+    """
+    instance = solution.instance
+    improved = True
+    while improved and not expired(deadline):
+        order = list(range(instance.customer_count))
+        rng.shuffle(order)
+        improved = shift_moves(solution, order, deadline)
+        improved = exchange_moves(solution, order, deadline) or improved
+        facilities = list(range(instance.facility_count))
+        rng.shuffle(facilities)
+        for facility in facilities:
+            if expired(deadline):
+                break
+            if solution.sizes[facility] > 0:
+                improved = close_move(solution, facility) or swap_move(solution, facility) or improved
+            else:
+                improved = open_move(solution, facility) or improved
+
+
+def perturb(solution, rng, strength=3):
+    """
+        Force a few random facilities closed, moving their customers to the cheapest candidate with room
+    """
+    instance = solution.instance
+    opened = np.flatnonzero(solution.sizes > 0).tolist()
+    for facility in rng.sample(opened, min(strength, len(opened) - 1)):
+        for customer in list(solution.members[facility]):
+            demand = instance.demands[customer]
+            facilities = instance.neighbors[customer]
+            costs = instance.distances[customer] + np.where(solution.sizes[facilities] == 0,
+                                                            instance.setup_costs[facilities], 0)
+            costs[(solution.loads[facilities] + demand > instance.capacities[facilities])
+                  | (facilities == facility)] = np.inf
+            best = int(costs.argmin())
+            if np.isfinite(costs[best]):
+                solution.move(customer, int(facilities[best]), float(instance.distances[customer, best]))
+
+
+def lagrangian_bound(instance, upper_bound, deadline, iterations=500):
+    """
+        Compute a lower bound by relaxing the assignment constraints with subgradient optimization;
+        each facility then solves the LP relaxation of a knapsack over its candidate customers
+    :param instance: The instance
+    :param upper_bound: The cost of the best known solution
+    :param deadline: The wall-clock deadline
+    :param iterations: The largest number of subgradient iterations
+    :return: The best lower bound, finite since the first iteration runs whatever the deadline
+    """
+    customer_count, k = instance.neighbors.shape
+    pair_facilities = instance.neighbors.ravel()
+    pair_customers = np.repeat(np.arange(customer_count), k)
+    pair_demands = instance.demands[pair_customers]
+    pair_distances = instance.distances.ravel()
+
+    # With multipliers at most the distance to the farthest candidate, no other pair has a negative
+    # reduced cost, so the bound over the candidates holds for the whole instance
+    ceiling = instance.distances[:, -1] if k < instance.facility_count else np.full(customer_count, np.inf)
+    multipliers = instance.distances[:, 0].copy()
+    best_bound = -np.inf
+    step = 2.0
+    stalled = 0
+    for iteration in range(max(iterations, 1)):
+        if iteration and expired(deadline):
+            break
+        reduced = pair_distances - multipliers[pair_customers]
+        negative = np.flatnonzero(reduced < 0)
+        facilities, demands, costs = pair_facilities[negative], pair_demands[negative], reduced[negative]
+
+        # Fractional knapsack per facility: best cost per unit of demand first
+        ratios = np.where(demands > 0, costs / np.maximum(demands, 1e-12), -np.inf)
+        order = np.lexsort((ratios, facilities))
+        facilities, demands, costs, negative = facilities[order], demands[order], costs[order], negative[order]
+        filled = np.cumsum(demands)
+        starts = np.searchsorted(facilities, np.arange(instance.facility_count))
+        before = filled - demands - np.concatenate([[0], filled])[starts[facilities]]
+        fractions = np.clip((instance.capacities[facilities] - before) / np.maximum(demands, 1e-12), 0, 1)
+        fractions[demands == 0] = 1
+        values = instance.setup_costs + np.bincount(facilities, weights=fractions * costs,
+                                                    minlength=instance.facility_count)
+        opened = values < 0
+        bound = multipliers.sum() + values[opened].sum()
+
+        if bound > best_bound + EPSILON:
+            best_bound = bound
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled >= 20:
+                step /= 2
+                stalled = 0
+
+        served = np.bincount(pair_customers[negative], weights=fractions * opened[facilities],
+                             minlength=customer_count)
+        subgradient = 1 - served
+        norm = float(subgradient @ subgradient)
+        if norm < EPSILON or step < 1e-6:
+            break
+        multipliers = np.minimum(multipliers + step * (upper_bound - bound) / norm * subgradient, ceiling)
+    return best_bound
+
+
+def solve(facilities, customers, time_limit=HEURISTIC_TIME_SECONDS, bound=True, seed=0, on_solution=None,
+          initial=None):
+    """
+        Solve the capacitated facility location problem with greedy construction and iterated local
+        search over shift, open, close and swap moves
+    :param facilities: The facilities as [setup cost, capacity, x, y]
+    :param customers: The customers as [demand, x, y]
+    :param time_limit: The time budget (in seconds)
+    :param bound: Whether to compute a Lagrangian lower bound
+    :param seed: The random seed
+    :param on_solution: The callback receiving the cost of every new best solution
+    :param initial: A known feasible assignment to start from instead of the greedy construction
+    :return: The best cost, its assignment and the lower bound (None if not computed), all None if the
+             greedy construction finds no feasible assignment
+    """
+    start = time.time()
+    deadline = start + time_limit * (1 - BOUND_TIME_SHARE if bound else 1)
+    rng = random.Random(seed)
+    instance = Instance(facilities, customers)
+
+    assignment = greedy_construction(instance) if initial is None else initial
+    if assignment is None:
+        return None, None, None
+    current = Solution(instance, assignment)
+    if on_solution:
+        on_solution(current.cost)
+    local_search(current, rng, deadline)
+    best = current.copy()
+    if on_solution:
+        on_solution(best.cost)
+    while not expired(deadline):
+        perturb(current, rng)
+        local_search(current, rng, deadline)
+        if current.cost < best.cost - EPSILON:
+            best = current.copy()
+            if on_solution:
+                on_solution(best.cost)
+        else:
+            current = best.copy()
+
+    lower_bound = None
+    if bound:
+        lower_bound = lagrangian_bound(instance, best.cost, start + time_limit)
+    return best.cost, best.assignment.tolist(), lower_bound
@@ -1,98 +1,412 @@
+import heapq
+import math
+import os
+import numpy as np
 
-import matplotlib.pyplot as plt
-import networkx as nx
-import matplotlib.cm as cm
-
-from ortools.sat.python import cp_model
+from concurrent.futures import ProcessPoolExecutor
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import SolveResult, improving
+from solution_cache import cached_solve
+from stopping import watch
 
 MAX_TIME_SECONDS = 1500
 
-def visualize_graph(graph, coloring):
+def pair_adjacency(num_nodes, sources, targets):
+    """
+        Build the compressed sparse row adjacency of directed node pairs, without duplicates or self-loops
+    :param num_nodes: The number of nodes
+    :param sources: The source node of every pair
+    :param targets: The target node of every pair
+    :return: The offsets (node i's neighbors are targets[offsets[i]:offsets[i + 1]]) and the targets
+    """
+    keys = np.unique((sources * num_nodes + targets)[sources != targets])
+    offsets = np.searchsorted(keys, np.arange(num_nodes + 1) * num_nodes)
+    return offsets, keys % num_nodes
+
+
+def compact_adjacency(graph):
     """
-        Visualize the graph coloring solution
+        Build the compressed sparse row adjacency of the graph, without duplicate edges or self-loops
     :param graph: The input graph
-    :param coloring: The coloring for each node
+    :return: The offsets (node i's neighbors are targets[offsets[i]:offsets[i + 1]]) and the targets
     """
-    nx_graph = nx.Graph()
-    nx_graph.add_nodes_from(graph.keys())
-    for node, neighbors in graph.items():
-        for neighbor in neighbors:
-            if (neighbor, node) not in nx_graph.edges():  # Avoid adding duplicate edges
-                nx_graph.add_edge(node, neighbor)
+    num_nodes = len(graph)
+    sources = np.repeat(np.arange(num_nodes), [len(graph[node]) for node in range(num_nodes)])
+    targets = np.fromiter((neighbor for node in range(num_nodes) for neighbor in graph[node]),
+                          dtype=np.int64, count=len(sources))
+    return pair_adjacency(num_nodes, sources, targets)
 
-    # Define positions for the nodes (random positions for simplicity)
-    pos = nx.spring_layout(nx_graph)
 
-    # Calculate the number of colors used
-    num_colors = len(set(coloring))
+def edge_adjacency(num_nodes, edges):
+    """
+        Build the compressed sparse row adjacency straight from the edge array of an instance
+    :param num_nodes: The number of nodes
+    :param edges: The (edge count, 2) array of undirected edges
+    :return: The offsets and the targets, as compact_adjacency
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    sources = np.concatenate((edges[:, 0], edges[:, 1]))
+    targets = np.concatenate((edges[:, 1], edges[:, 0]))
+    return pair_adjacency(num_nodes, sources, targets)
 
-    # Create a list of colors for each node based on the coloring
-    color_map = cm.get_cmap('rainbow', num_colors)
-    colors = [color_map(color / (num_colors - 1)) for color in coloring]
 
-    # Draw the graph
-    nx.draw(nx_graph, pos, with_labels=True, node_color=colors, cmap=cm.rainbow)
+def neighbor_lists(offsets, targets):
+    targets = targets.tolist()
+    return [targets[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
 
-    # Show the plot
-    plt.show()
 
-def cp_algorithm(graph):
+def dsatur(neighbors):
     """
-        The constraint programming algorithm
-    :param graph: The input graph
+        Greedy DSatur coloring: repeatedly color the uncolored node seeing the most distinct colors
+        (ties broken by degree) with the smallest color none of its neighbors uses
+    :param neighbors: The neighbor list of every node
+    :return: The color of every node
+    """
+    num_nodes = len(neighbors)
+    coloring = [-1] * num_nodes
+    neighbor_colors = [set() for _ in range(num_nodes)]
+    heap = [(0, -len(neighbors[node]), node) for node in range(num_nodes)]
+    heapq.heapify(heap)
+    while heap:
+        saturation, _, node = heapq.heappop(heap)
+        # Skip the stale entries left behind when a node's saturation grew
+        if coloring[node] >= 0 or -saturation != len(neighbor_colors[node]):
+            continue
+        used = neighbor_colors[node]
+        color = 0
+        while color in used:
+            color += 1
+        coloring[node] = color
+        for neighbor in neighbors[node]:
+            if coloring[neighbor] < 0 and color not in neighbor_colors[neighbor]:
+                neighbor_colors[neighbor].add(color)
+                heapq.heappush(heap, (-len(neighbor_colors[neighbor]), -len(neighbors[neighbor]), neighbor))
+    return coloring
+
+
+def greedy_clique(neighbors):
+    """
+        Grow a clique from the highest-degree node, adding the candidate adjacent to the most other
+        candidates each time
+    :param neighbors: The neighbor list of every node
+    :return: The clique nodes
+    """
+    if not neighbors:
+        return []
+    node = max(range(len(neighbors)), key=lambda i: len(neighbors[i]))
+    clique = [node]
+    candidates = set(neighbors[node])
+    while candidates:
+        node = max(candidates, key=lambda i: len(candidates.intersection(neighbors[i])))
+        clique.append(node)
+        candidates.intersection_update(neighbors[node])
+    return clique
+
+
+def relabel_coloring(coloring, clique):
+    """
+        Renumber the colors so that the i-th clique node has color i
     """
+    mapping = {coloring[node]: i for i, node in enumerate(clique)}
+    for color in sorted(set(coloring)):
+        if color not in mapping:
+            mapping[color] = len(mapping)
+    return [mapping[color] for color in coloring]
+
+
+def objective_callback(on_solution):
+    """
+        Build the CP-SAT callback reporting the number of colors of every solution it finds
+    """
+    from ortools.sat.python import cp_model
+
+    class ObjectiveCallback(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self):
+            on_solution(int(self.ObjectiveValue()) + 1)
+    return ObjectiveCallback()
+
+
+def build_model(neighbors, clique, greedy):
+    """
+        Build the CP-SAT model of the coloring, bounded and hinted by the greedy coloring
+    :param neighbors: The neighbor list of every node
+    :param clique: The clique whose colors are fixed
+    :param greedy: The greedy coloring, relabelled to match the clique
+    :return: The model, the node color variables and the maximum color variable
+    """
+    from ortools.sat.python import cp_model
+    num_nodes = len(neighbors)
+    max_color_bound = max(greedy, default=0)
     model = cp_model.CpModel()
-    num_nodes = len(graph)
-    max_degree = max(len(neighbors) for neighbors in graph.values())
 
-    # Define variables for node colors
-    node_colors = [model.NewIntVar(0, max_degree, f'node_{i}') for i in range(num_nodes)]
+    # Define variables for node colors, no better coloring needs more colors than the greedy one
+    node_colors = [model.NewIntVar(0, max_color_bound, f'node_{i}') for i in range(num_nodes)]
 
-    # Add constraints to ensure no adjacent nodes have the same color
-    for node, neighbors in graph.items():
-        for neighbor in neighbors:
-            model.Add(node_colors[node] != node_colors[neighbor])
+    # Add constraints to ensure no adjacent nodes have the same color, once per edge; they are written
+    # to the model proto directly since model.Add costs ten times more per constraint
+    proto = model.Proto()
+    different = (-max_color_bound, -1, 1, max_color_bound)
+    for node, node_neighbors in enumerate(neighbors):
+        for neighbor in node_neighbors:
+            if node < neighbor:
+                constraint = proto.constraints.add().linear
+                constraint.vars.extend((node_colors[node].Index(), node_colors[neighbor].Index()))
+                constraint.coeffs.extend((1, -1))
+                constraint.domain.extend(different)
+
+    # Break the color symmetry by fixing the colors of the clique
+    for i, node in enumerate(clique):
+        model.Add(node_colors[node] == i)
 
     # Define the objective to minimize the maximum color
-    max_color = model.NewIntVar(0, max_degree, 'max_color')
+    max_color = model.NewIntVar(len(clique) - 1, max_color_bound, 'max_color')
     model.AddMaxEquality(max_color, node_colors)
     model.Minimize(max_color)
 
+    # Start the search from the greedy coloring
+    for i in range(num_nodes):
+        model.AddHint(node_colors[i], greedy[i])
+    model.AddHint(max_color, max_color_bound)
+    return model, node_colors, max_color
+
+
+def cp_algorithm(graph, time_limit=MAX_TIME_SECONDS, on_solution=None, instrumentation=None, initial=None):
+    """
+        The constraint programming algorithm, bounded and warm-started by a greedy DSatur coloring
+    :param graph: The input graph
+    :param time_limit: The time limit (in seconds)
+    :param on_solution: The callback receiving the number of colors of every solution
+    :param instrumentation: The instrumentation timing the build, solve and extract phases
+    :param initial: A known coloring, which bounds and hints the model instead of the greedy one if it
+                    uses fewer colors
+    :return: The coloring and whether it is proven optimal
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('build'):
+        neighbors = neighbor_lists(*compact_adjacency(graph))
+    return cp_coloring(neighbors, time_limit, on_solution, instrumentation, initial)
+
+
+def cp_coloring(neighbors, time_limit=MAX_TIME_SECONDS, on_solution=None, instrumentation=None, initial=None):
+    """
+        The constraint programming algorithm on neighbor lists, see cp_algorithm
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('solve'):
+        clique = greedy_clique(neighbors)
+        greedy = relabel_coloring(dsatur(neighbors), clique)
+        if initial is not None:
+            known = relabel_coloring(initial, clique)
+            if max(known, default=0) < max(greedy, default=0):
+                greedy = known
+    num_nodes = len(neighbors)
+    max_color_bound = max(greedy, default=0)
+    if on_solution:
+        on_solution(max_color_bound + 1)
+    if len(clique) == max_color_bound + 1:
+        # The greedy coloring uses as many colors as there are clique nodes, so it is optimal
+        return greedy, 1
+
+    # Loaded only once the greedy coloring is reported and turns out not to be optimal
+    from ortools.sat.python import cp_model
+
+    with instrumentation.phase('build'):
+        model, node_colors, max_color = build_model(neighbors, clique, greedy)
+
     # Create solver and solve the model
     solver = cp_model.CpSolver()
-    solver.parameters.log_search_progress = False  # Enable logging for debugging
-    # Set search strategy
-    solver.parameters.search_branching = cp_model.FIXED_SEARCH
+    if instrumentation.solver_logs:
+        # Send the search log to the instrumentation sinks instead of standard output
+        solver.parameters.log_search_progress = True
+        solver.parameters.log_to_stdout = False
+        solver.log_callback = instrumentation.log_line
 
     # Set time limit (in seconds)
-    solver.parameters.max_time_in_seconds = MAX_TIME_SECONDS
+    solver.parameters.max_time_in_seconds = time_limit
 
     # Set solution limit
     solver.parameters.enumerate_all_solutions = False
-    solver.Solve(model)
-    return [solver.Value(node_colors[i]) for i in range(num_nodes)]
+    with instrumentation.phase('solve'):
+        with watch(solver.StopSearch):
+            status = solver.Solve(model, objective_callback(on_solution) if on_solution else None)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return greedy, 0
+    with instrumentation.phase('extract'):
+        coloring = [solver.Value(node_colors[i]) for i in range(num_nodes)]
+    return coloring, int(status == cp_model.OPTIMAL)
 
-def solve_it(input_data):
-    lines = input_data.strip().split('\n')
-    node_count, edge_count = map(int, lines[0].split())
 
-    # Build the adjacency list representation of the graph
-    graph = {i: [] for i in range(node_count)}
-    for line in lines[1:]:
-        u, v = map(int, line.split())
-        graph[u].append(v)
-        graph[v].append(u)
+def peel(neighbors, lower_bound):
+    """
+        Set aside, repeatedly, the nodes with fewer remaining neighbors than the lower bound on the
+        number of colors: colored last, in reverse order, each of them sees fewer colors than any
+        coloring uses, so it never needs a new one
+    :param neighbors: The neighbor list of every node
+    :param lower_bound: The lower bound on the number of colors, e.g. the size of a clique
+    :return: Whether every node remains, and the nodes set aside in the order they were set aside
+    """
+    degrees = [len(node_neighbors) for node_neighbors in neighbors]
+    remaining = [degree >= lower_bound for degree in degrees]
+    removed = [node for node in range(len(neighbors)) if not remaining[node]]
+    stack = list(removed)
+    while stack:
+        for neighbor in neighbors[stack.pop()]:
+            degrees[neighbor] -= 1
+            if remaining[neighbor] and degrees[neighbor] < lower_bound:
+                remaining[neighbor] = False
+                removed.append(neighbor)
+                stack.append(neighbor)
+    return remaining, removed
+
+
+def color_peeled(neighbors, coloring, removed):
+    """
+        Give the nodes set aside by peel, last removed first, the smallest color none of their
+        neighbors uses
+    :param neighbors: The neighbor list of every node
+    :param coloring: The coloring of the remaining nodes, -1 for the removed ones, colored in place
+    :param removed: The removed nodes in the order they were removed
+    """
+    for node in reversed(removed):
+        used = {coloring[neighbor] for neighbor in neighbors[node]}
+        color = 0
+        while color in used:
+            color += 1
+        coloring[node] = color
+
+
+def components(offsets, targets, nodes):
+    """
+        Split the subgraph induced by the nodes into its connected components
+    :param offsets: The offsets of the compressed sparse row adjacency
+    :param targets: The targets of the compressed sparse row adjacency
+    :param nodes: The nodes of the subgraph
+    :return: The nodes and the neighbor lists (in component node indices) of every component,
+             largest first
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    num_nodes = len(offsets) - 1
+    adjacency = csr_matrix((np.ones(len(targets), dtype=np.int8), targets, offsets), shape=(num_nodes, num_nodes))
+    subgraph = adjacency[nodes][:, nodes]
+    count, labels = connected_components(subgraph, directed=False)
+    result = list()
+    for label in np.argsort(-np.bincount(labels, minlength=count), kind='stable').tolist():
+        members = np.flatnonzero(labels == label)
+        component = subgraph[members][:, members]
+        result.append((nodes[members], neighbor_lists(component.indptr, component.indices)))
+    return result
+
+
+def solve_component(neighbors, time_limit, initial):
+    """
+        Color one connected component in a worker process
+    :return: The coloring of the component and whether it is proven optimal
+    """
+    return cp_coloring(neighbors, time_limit, initial=initial)
+
+
+def decomposed_coloring(offsets, targets, time_limit=MAX_TIME_SECONDS, on_solution=None, instrumentation=None,
+                        initial=None, workers=None):
+    """
+        Shrink the graph before the constraint programming algorithm: set aside the nodes whose degree
+        falls below the clique size, color every connected component of the rest on its own, in a
+        process pool when there are several, then color the nodes set aside greedily
+    :param offsets: The offsets of the compressed sparse row adjacency
+    :param targets: The targets of the compressed sparse row adjacency
+    :param time_limit: The time limit (in seconds)
+    :param on_solution: The callback receiving the number of colors of every solution
+    :param instrumentation: The instrumentation timing the build, solve and extract phases
+    :param initial: A known coloring to hint the components with
+    :param workers: The number of worker processes, None for the number of cores
+    :return: The coloring and whether it is proven optimal
+    """
+    instrumentation = instrumentation or Instrumentation()
+    workers = workers or os.cpu_count()
+    with instrumentation.phase('build'):
+        neighbors = neighbor_lists(offsets, targets)
+        lower_bound = len(greedy_clique(neighbors))
+        remaining, removed = peel(neighbors, lower_bound)
+        parts = components(offsets, targets, np.flatnonzero(remaining))
+
+    # The nodes set aside use fewer colors than the clique, so the graph needs as many colors as the
+    # clique or the most colorful component
+    def report(colors):
+        on_solution(max(colors, lower_bound))
+
+    coloring = [-1] * len(neighbors)
+    optimal = True
+    if len(parts) == 1:
+        nodes, part_neighbors = parts[0]
+        part_initial = None if initial is None else [initial[node] for node in nodes.tolist()]
+        part_coloring, optimal = cp_coloring(part_neighbors, time_limit, on_solution and report, instrumentation,
+                                             part_initial)
+        for node, color in zip(nodes.tolist(), part_coloring):
+            coloring[node] = color
+    elif parts:
+        # Components beyond the pool size wait for a free worker, so every wave gets its share of the budget
+        part_time = time_limit / math.ceil(len(parts) / workers)
+        with instrumentation.phase('solve'):
+            with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as pool:
+                futures = [pool.submit(solve_component, part_neighbors, part_time,
+                                       None if initial is None else [initial[node] for node in nodes.tolist()])
+                           for nodes, part_neighbors in parts]
+                for (nodes, _), future in zip(parts, futures):
+                    part_coloring, part_optimal = future.result()
+                    optimal = optimal and part_optimal
+                    for node, color in zip(nodes.tolist(), part_coloring):
+                        coloring[node] = color
+
+    with instrumentation.phase('extract'):
+        color_peeled(neighbors, coloring, removed)
+    colors = max(coloring, default=-1) + 1
+    if on_solution and len(parts) != 1:
+        report(colors)
+    return coloring, int(bool(optimal) or colors == lower_bound)
+
+
+def solve(input_data, time_limit=MAX_TIME_SECONDS, on_solution=None, instrumentation=None, cache=None,
+          initial=None, workers=None):
+    """
+        Solve the graph coloring problem
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param time_limit: The time limit (in seconds)
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param cache: The solution cache answering repeated solves and warm-starting CP-SAT
+    :param initial: A known coloring to start the search from
+    :param workers: The number of worker processes coloring the connected components, None for the
+                    number of cores
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'coloring')
+    if cache is not None:
+        return cached_solve(cache, 'coloring', instance, {}, time_limit, on_solution, lambda initial: solve(
+            instance, time_limit, on_solution, instrumentation, initial=initial, workers=workers))
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+
+    # Build the compressed sparse row adjacency of the graph, without duplicate edges or self-loops
+    with instrumentation.phase('build'):
+        offsets, targets = edge_adjacency(instance['node_count'], instance['edges'])
 
-    # Perform graph coloring using constraint programming
-    coloring = cp_algorithm(graph)
+    # Perform graph coloring using constraint programming on the reduced graph
+    coloring, optimal = decomposed_coloring(offsets, targets, time_limit, on_solution, instrumentation, initial,
+                                            workers)
 
-    visualize_graph(graph, coloring)
+    with instrumentation.phase('output'):
+        output_data = format_output(coloring, optimal)
+    return SolveResult('coloring', max(coloring) + 1, optimal, coloring, output_data, instance,
+                       instrumentation.statistics())
 
-    return format_output(coloring)
+def solve_it(input_data, time_limit=MAX_TIME_SECONDS):
+    return solve(input_data, time_limit).output
 
-def format_output(coloring):
+def format_output(coloring, optimal=0):
     num_colors = max(coloring) + 1
-    output_data = f"{num_colors} {0}\n"
+    output_data = f"{num_colors} {optimal}\n"
     output_data += ' '.join(map(str, coloring))
     return output_data
 
@@ -0,0 +1,177 @@
+import time
+import numpy as np
+
+from graph_coloring import dsatur, edge_adjacency, format_output, greedy_clique, neighbor_lists, relabel_coloring
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import SolveResult, improving
+from stopping import expired
+
+# Time budget (in seconds) of the search
+TABU_TIME_SECONDS = 60
+
+# Tabu tenure of a (node, old color) pair: a random number of iterations below TENURE_RANDOM plus
+# TENURE_SHARE of the number of conflicting nodes
+TENURE_RANDOM = 10
+TENURE_SHARE = 0.6
+
+
+class TabuColoring:
+    """
+        Tabu search for a conflict-free coloring with a fixed number of colors. The conflict table
+        holds, for every node and color, the number of neighbors with that color, so that the conflict
+        change of every move is read from it and a move updates it in time linear in the node degree
+    """
+    def __init__(self, offsets, targets, coloring, seed=0):
+        """
+        :param offsets: The offsets of the compressed sparse row adjacency
+        :param targets: The targets of the compressed sparse row adjacency
+        :param coloring: The starting coloring, its colors set the number of colors
+        :param seed: The random seed
+        """
+        self.offsets = offsets
+        self.targets = targets
+        self.node_count = len(offsets) - 1
+        self.nodes = np.arange(self.node_count)
+        self.colors = np.array(coloring, dtype=np.int64)
+        self.color_count = int(self.colors.max()) + 1 if self.node_count else 0
+        sources = np.repeat(self.nodes, np.diff(offsets))
+        self.table = np.zeros((self.node_count, self.color_count), dtype=np.int64)
+        np.add.at(self.table, (sources, self.colors[targets]), 1)
+        # The iteration until which moving a node back to a color is tabu
+        self.tabu = np.zeros((self.node_count, self.color_count), dtype=np.int64)
+        self.iteration = 0
+        self.rng = np.random.default_rng(seed)
+
+    def move(self, node, color):
+        """
+            Recolor a node, updating the conflict table of its neighbors
+        """
+        neighbors = self.targets[self.offsets[node]:self.offsets[node + 1]]
+        self.table[neighbors, self.colors[node]] -= 1
+        self.table[neighbors, color] += 1
+        self.colors[node] = color
+
+    def conflicts(self):
+        """
+            The number of edges whose nodes have the same color
+        """
+        return int(self.table[self.nodes, self.colors].sum()) // 2
+
+    def remove_color(self):
+        """
+            Drop the highest color, moving each of its nodes to its least conflicting remaining color
+        """
+        self.color_count -= 1
+        for node in np.flatnonzero(self.colors == self.color_count).tolist():
+            self.move(node, int(self.table[node, :self.color_count].argmin()))
+
+    def search(self, deadline):
+        """
+            Move conflicting nodes to the non-tabu color that removes the most conflicts (ties broken at
+            random, tabu moves allowed when they reach a new best) until no conflict is left
+        :param deadline: The time at which the search gives up
+        :return: Whether a conflict-free coloring was found
+        """
+        count = self.color_count
+        table = self.table[:, :count]
+        tabu = self.tabu[:, :count]
+        # No move changes the conflicts by this much, so it marks the excluded moves
+        excluded = self.node_count + 1
+        conflicts = self.conflicts()
+        best = conflicts
+        while conflicts:
+            if expired(deadline):
+                return False
+            self.iteration += 1
+            conflicting = np.flatnonzero(table[self.nodes, self.colors] > 0)
+            colors = self.colors[conflicting]
+            rows = np.arange(len(conflicting))
+            deltas = table[conflicting] - table[conflicting, colors][:, None]
+            allowed = (tabu[conflicting] <= self.iteration) | (conflicts + deltas < best)
+            deltas = np.where(allowed, deltas, excluded)
+            deltas[rows, colors] = excluded
+            lowest = deltas.min()
+            if lowest == excluded:
+                # Every move is tabu, wait for the tenures to expire
+                continue
+            candidates = np.flatnonzero(deltas == lowest)
+            row, color = divmod(int(candidates[self.rng.integers(len(candidates))]), count)
+            node = int(conflicting[row])
+            tabu[node, colors[row]] = (self.iteration + int(self.rng.integers(TENURE_RANDOM))
+                                       + int(TENURE_SHARE * len(conflicting)))
+            self.move(node, color)
+            conflicts += int(lowest)
+            best = min(best, conflicts)
+        return True
+
+
+def tabu_coloring(offsets, targets, time_limit=TABU_TIME_SECONDS, seed=0, on_solution=None, initial=None):
+    """
+        Start from the DSatur coloring and remove one color at a time, repairing the conflicts with tabu
+        search, until the time runs out or the number of colors reaches the greedy clique size
+    :param offsets: The offsets of the compressed sparse row adjacency
+    :param targets: The targets of the compressed sparse row adjacency
+    :param time_limit: The time budget (in seconds)
+    :param seed: The random seed
+    :param on_solution: The callback receiving the number of colors of every conflict-free coloring
+    :param initial: A known coloring to start from if it uses fewer colors than the DSatur one
+    :return: The coloring and whether it is proven optimal
+    """
+    deadline = time.time() + time_limit
+    neighbors = neighbor_lists(offsets, targets)
+    clique = greedy_clique(neighbors)
+    best = relabel_coloring(dsatur(neighbors), clique)
+    if initial is not None:
+        known = relabel_coloring(initial, clique)
+        if max(known, default=0) < max(best, default=0):
+            best = known
+    if on_solution and best:
+        on_solution(max(best) + 1)
+
+    search = TabuColoring(offsets, targets, best, seed)
+    while search.color_count > len(clique):
+        search.remove_color()
+        if not search.search(deadline):
+            break
+        best = search.colors.tolist()
+        if on_solution:
+            on_solution(search.color_count)
+    return best, int(max(best, default=-1) + 1 == len(clique))
+
+
+def solve(input_data, time_limit=TABU_TIME_SECONDS, seed=0, on_solution=None, instrumentation=None, initial=None):
+    """
+        Solve the graph coloring problem with the native tabu search engine
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param time_limit: The time limit (in seconds)
+    :param seed: The random seed
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param initial: A known coloring to start the search from
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'coloring')
+    with instrumentation.phase('build'):
+        offsets, targets = edge_adjacency(instance['node_count'], instance['edges'])
+    with instrumentation.phase('solve'):
+        coloring, optimal = tabu_coloring(offsets, targets, time_limit - instrumentation.elapsed(), seed,
+                                          on_solution, initial)
+    with instrumentation.phase('output'):
+        output_data = format_output(coloring, optimal)
+    return SolveResult('coloring', max(coloring) + 1, optimal, coloring, output_data, instance,
+                       instrumentation.statistics())
+
+
+def solve_it(input_data, time_limit=TABU_TIME_SECONDS):
+    return solve(input_data, time_limit).output
+
+
+if __name__ == '__main__':
+    file_location = f'../data/gc_X_X'
+    with open(file_location, 'r') as input_data_file:
+        coloring_input = input_data_file.read()
+    print(solve_it(coloring_input))
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Directory (next to the instance files) holding the binary sidecars
+CACHE_DIRECTORY_NAME = '.instance_cache'
+
+# File name prefix of every instance format
+KINDS = {'ks': 'knapsack', 'gc': 'coloring', 'tsp': 'tsp', 'vrp': 'vrp', 'fl': 'facility'}
+
+
+def tokens(input_data):
+    """
+        Parse every number of an instance text at once
+    """
+    return np.fromstring(input_data, sep=' ')
+
+
+def parse_knapsack(input_data):
+    numbers = tokens(input_data)
+    item_count = int(numbers[0])
+    items = numbers[2:2 + 2 * item_count].astype(np.int64).reshape(item_count, 2)
+    return {'capacity': int(numbers[1]), 'values': items[:, 0].copy(), 'weights': items[:, 1].copy()}
+
+
+def parse_coloring(input_data):
+    numbers = tokens(input_data)
+    node_count, edge_count = int(numbers[0]), int(numbers[1])
+    return {'node_count': node_count, 'edges': numbers[2:2 + 2 * edge_count].astype(np.int64).reshape(edge_count, 2)}
+
+
+def parse_tsp(input_data):
+    numbers = tokens(input_data)
+    node_count = int(numbers[0])
+    return {'points': numbers[1:1 + 2 * node_count].reshape(node_count, 2).copy()}
+
+
+def parse_vrp(input_data):
+    numbers = tokens(input_data)
+    customer_count = int(numbers[0])
+    customers = numbers[3:3 + 3 * customer_count].reshape(customer_count, 3)
+    return {'vehicle_count': int(numbers[1]), 'capacity': int(numbers[2]),
+            'demands': customers[:, 0].astype(np.int64), 'points': customers[:, 1:].copy()}
+
+
+def parse_facility(input_data):
+    numbers = tokens(input_data)
+    facility_count, customer_count = int(numbers[0]), int(numbers[1])
+    end = 2 + 4 * facility_count
+    facilities = numbers[2:end].reshape(facility_count, 4)
+    customers = numbers[end:end + 3 * customer_count].reshape(customer_count, 3)
+    return {'setup_costs': facilities[:, 0].copy(), 'capacities': facilities[:, 1].copy(),
+            'facility_points': facilities[:, 2:].copy(), 'demands': customers[:, 0].astype(np.int64),
+            'customer_points': customers[:, 1:].copy()}
+
+
+PARSERS = {
+    'knapsack': parse_knapsack,
+    'coloring': parse_coloring,
+    'tsp': parse_tsp,
+    'vrp': parse_vrp,
+    'facility': parse_facility,
+}
+
+
+def instance_kind(path):
+    """
+        The problem of an instance file, from its name prefix (e.g. tsp_51_1)
+    """
+    prefix = os.path.basename(path).split('_')[0]
+    if prefix not in KINDS:
+        raise ValueError(f'Unknown instance format: {path}')
+    return KINDS[prefix]
+
+
+def as_instance(input_data, kind):
+    """
+        Parse the input data, unless it is an already loaded instance
+    :param input_data: The instance text, or the dict of arrays returned by a parser or load_instance
+    :param kind: The problem, 'knapsack', 'coloring', 'tsp', 'vrp' or 'facility'
+    :return: The instance arrays and sizes
+    """
+    if isinstance(input_data, dict):
+        return input_data
+    return PARSERS[kind](input_data)
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as instance_file:
+        for block in iter(lambda: instance_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_directory(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIRECTORY_NAME, name)
+
+
+def read_sidecar(directory, path, status):
+    """
+        Memory-map the arrays of a sidecar, if it matches the instance file
+    :return: The instance, or None if there is no valid sidecar
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    if meta['size'] != status.st_size:
+        return None
+    if meta['mtime_ns'] != status.st_mtime_ns:
+        # Touched but maybe unchanged, the content hash decides
+        if meta['sha1'] != file_hash(path):
+            return None
+        meta['mtime_ns'] = status.st_mtime_ns
+        write_meta(directory, meta)
+    instance = dict(meta['scalars'])
+    for name in meta['arrays']:
+        instance[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+    return instance
+
+
+def temporary_path(path):
+    # Next to the target, so that os.replace stays on one file system, and per process, so that concurrent
+    # writers of the same sidecar do not share it
+    return f'{path}.{os.getpid()}.tmp'
+
+
+def write_meta(directory, meta):
+    # Written last and atomically, so a sidecar without a complete meta file is never read
+    target = os.path.join(directory, 'meta.json')
+    temporary = temporary_path(target)
+    with open(temporary, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temporary, target)
+
+
+def save_array(path, array):
+    """
+        Write a .npy file atomically, since other processes may have the previous one memory-mapped
+    """
+    temporary = temporary_path(path)
+    # Saved through the open file, np.save would append .npy to the name
+    with open(temporary, 'wb') as array_file:
+        np.save(array_file, array)
+    os.replace(temporary, path)
+
+
+def write_sidecar(directory, path, status, instance):
+    os.makedirs(directory, exist_ok=True)
+    arrays = [name for name, value in instance.items() if isinstance(value, np.ndarray)]
+    for name in arrays:
+        save_array(os.path.join(directory, name + '.npy'), instance[name])
+    write_meta(directory, {
+        'size': status.st_size,
+        'mtime_ns': status.st_mtime_ns,
+        'sha1': file_hash(path),
+        'arrays': arrays,
+        'scalars': {name: value for name, value in instance.items() if name not in arrays},
+    })
+
+
+def load_instance(path, kind=None, cache=True):
+    """
+        Load an instance file into NumPy arrays. The first load writes a binary sidecar of .npy files,
+        later loads memory-map it instead of parsing the text again
+    :param path: The instance file path
+    :param kind: The problem, None to infer it from the file name
+    :param cache: Whether to read and write the sidecar
+    :return: The instance arrays and sizes (the arrays are read-only when memory-mapped)
+    """
+    kind = kind or instance_kind(path)
+    if not cache:
+        with open(path) as instance_file:
+            return PARSERS[kind](instance_file.read())
+
+    directory = cache_directory(path)
+    status = os.stat(path)
+    instance = read_sidecar(directory, path, status)
+    if instance is None:
+        with open(path) as instance_file:
+            instance = PARSERS[kind](instance_file.read())
+        try:
+            write_sidecar(directory, path, status, instance)
+        except OSError:
+            # A read-only data directory only loses the cache
+            pass
+    return instance
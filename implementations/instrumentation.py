@@ -0,0 +1,153 @@
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+# The phases of a solve, in order
+PHASES = ['parse', 'build', 'solve', 'extract', 'output']
+
+
+class MemorySink:
+    """
+        Keep every event in a list
+    """
+    def __init__(self):
+        self.events = list()
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def close(self):
+        pass
+
+
+class LoggingSink:
+    """
+        Write every event to a logger
+    """
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('discrete_optimization')
+        self.level = level
+
+    def emit(self, event):
+        self.logger.log(self.level, '%s', json.dumps(event))
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+        Append every event as a JSON line to a file
+    """
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def emit(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Instrumentation:
+    """
+        Time the phases of a solve and record its anytime curve (the elapsed time and objective of every
+        improving solution), sending each measurement to the sinks as it happens. Phases can also be
+        profiled with cProfile or traced with tracemalloc.
+    """
+    def __init__(self, sinks=(), label=None, profile=(), trace_memory=(), profile_directory='.',
+                 solver_logs=False):
+        """
+        :param sinks: The sinks receiving the events
+        :param label: The name added to every event, e.g. the instance name
+        :param profile: The phases run under cProfile, their statistics are dumped to .prof files
+        :param trace_memory: The phases whose peak Python allocations are traced
+        :param profile_directory: The directory of the .prof files
+        :param solver_logs: Whether the solvers that support it send their search log as events
+        """
+        self.sinks = list(sinks)
+        self.label = label
+        self.profile = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.profile_directory = profile_directory
+        self.solver_logs = solver_logs
+        self.start = time.time()
+        self.phases = dict()
+        self.curve = list()
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def emit(self, event, **fields):
+        if not self.sinks:
+            return
+        fields['event'] = event
+        if self.label is not None:
+            fields['label'] = self.label
+        for sink in self.sinks:
+            sink.emit(fields)
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Time a phase; repeated phases (e.g. models rebuilt with more candidates) add up
+        """
+        profiler = cProfile.Profile() if name in self.profile else None
+        tracing = name in self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            self.phases[name] = self.phases.get(name, 0) + seconds
+            fields = {'phase': name, 'seconds': seconds}
+            if profiler:
+                profiler.disable()
+                path = os.path.join(self.profile_directory, f'{self.label or "solve"}-{name}.prof')
+                profiler.dump_stats(path)
+                fields['profile'] = path
+            if tracing:
+                fields['traced_peak'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.emit('phase', **fields)
+
+    def solution(self, objective):
+        """
+            Record an improving solution
+        """
+        point = (self.elapsed(), objective)
+        self.curve.append(point)
+        self.emit('solution', elapsed=point[0], objective=objective)
+
+    def solution_callback(self, on_solution=None):
+        """
+            A solution callback recording the anytime curve before calling on_solution
+        """
+        def report(objective):
+            self.solution(objective)
+            if on_solution:
+                on_solution(objective)
+        return report
+
+    def log_line(self, message):
+        self.emit('log', message=message.rstrip())
+
+    def statistics(self):
+        """
+            The phase times and the anytime curve, for the statistics of a solve result
+        """
+        return {'phases': dict(self.phases), 'anytime': list(self.curve)}
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -1,5 +1,22 @@
+import math
 import time
-import matplotlib.pyplot as plt
+import numpy as np
+
+from bisect import bisect_right
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import SolveResult, improving
+from solution_cache import cached_solve
+from stopping import expired
+
+# Memory (in bytes) the dynamic programming engine may spend on its decision matrix
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+# Instances with more DP cells (items x capacity) than this are solved with branch and bound
+DP_CELL_LIMIT = 10 ** 9
+
+# Time limit (in seconds) of the branch and bound search
+BRANCH_AND_BOUND_TIME_SECONDS = 60
 
 
 class Item(object):
@@ -9,103 +26,470 @@ class Item(object):
         self.weight = weight
 
 
-def visualize_knapsack(input_data, taken):
+def dp_update(row, value, weight):
     """
-        Visualize the knapsack solution
-    :param input_data: The input data
-    :param taken: The taken items
+        Apply one item to a dynamic programming value row (in place)
+    :param row: The value row indexed by capacity
+    :param value: The item value
+    :param weight: The item weight
+    :return: The boolean take mask for capacities weight..len(row) - 1
+    """
+    if weight >= len(row):
+        return np.zeros(0, dtype=bool)
+    # The candidate row is materialized before the update, so every capacity sees the previous row
+    candidate = row[:len(row) - weight] + value
+    take = candidate > row[weight:]
+    np.maximum(row[weight:], candidate, out=row[weight:])
+    return take
+
+
+def dp_value_row(values, weights, capacity):
+    """
+        Compute the best value for every capacity using a single rolling row
+    :param values: The item values
+    :param weights: The item weights
+    :param capacity: The largest capacity
+    :return: The value row indexed by capacity
     """
-    lines = input_data.split('\n')
+    row = np.zeros(capacity + 1, dtype=np.int64)
+    for value, weight in zip(values, weights):
+        dp_update(row, value, weight)
+    return row
 
-    first_line = lines[0].split()
-    item_count = int(first_line[0])
 
-    items = list()
+def dp_bitpacked(values, weights, capacity):
+    """
+        Solve the knapsack with a rolling row and a bit-packed take matrix
+    :param values: The item values
+    :param weights: The item weights
+    :param capacity: The knapsack capacity
+    :return: The best value and the taken flags
+    """
+    row = np.zeros(capacity + 1, dtype=np.int64)
+    decisions = np.zeros((len(values), (capacity + 8) // 8), dtype=np.uint8)
+    bits = np.zeros(capacity + 1, dtype=bool)
+    for i, (value, weight) in enumerate(zip(values, weights)):
+        take = dp_update(row, value, weight)
+        bits[:] = False
+        bits[weight:weight + len(take)] = take
+        decisions[i] = np.packbits(bits)
 
-    for i in range(1, item_count + 1):
-        line = lines[i]
-        parts = line.split()
-        items.append((int(parts[0]), int(parts[1])))
+    # Backtrack through the decision bits to find which items are selected
+    taken = [0] * len(values)
+    active_capacity = capacity
+    for i in range(len(values) - 1, -1, -1):
+        if decisions[i, active_capacity >> 3] & (0x80 >> (active_capacity & 7)):
+            taken[i] = 1
+            active_capacity -= weights[i]
+    return int(row[capacity]), taken
 
-    # Create lists to store item weights and values
-    weights = [item[0] for item in items]
-    values = [item[1] for item in items]
 
-    # Create a bar chart
-    plt.figure(figsize=(10, 6))
-    plt.bar(range(len(weights)), values, color='blue', alpha=0.5, label='Value')
-    plt.bar(range(len(weights)), weights, color='green', alpha=0.5, label='Weight')
+def dp_hirschberg(values, weights, capacity, memory_budget):
+    """
+        Solve the knapsack by divide and conquer over the items (Hirschberg),
+        using O(capacity) memory per level and the bit-packed engine on subproblems that fit
+    :param values: The item values
+    :param weights: The item weights
+    :param capacity: The knapsack capacity
+    :param memory_budget: The memory budget (in bytes) of the bit-packed subproblems
+    :return: The best value and the taken flags
+    """
+    taken = [0] * len(values)
+    stack = [(0, len(values), capacity)]
+    while stack:
+        start, end, active_capacity = stack.pop()
+        if end - start == 0:
+            continue
+        if bitpacked_memory(end - start, active_capacity) <= memory_budget or end - start == 1:
+            _, sub_taken = dp_bitpacked(values[start:end], weights[start:end], active_capacity)
+            taken[start:end] = sub_taken
+            continue
 
-    # Highlight the items selected in the knapsack
-    for i in range(len(taken)):
-        if taken[i] == 1:
-            plt.annotate('X', (i, values[i]), ha='center', va='bottom', color='red', fontsize=12)
+        # Split the items in halves and find the best split of the capacity between them
+        middle = (start + end) // 2
+        forward = dp_value_row(values[start:middle], weights[start:middle], active_capacity)
+        backward = dp_value_row(values[middle:end], weights[middle:end], active_capacity)
+        split = int(np.argmax(forward + backward[::-1]))
+        stack.append((start, middle, split))
+        stack.append((middle, end, active_capacity - split))
 
-    plt.xlabel('Item')
-    plt.ylabel('Value / Weight')
-    plt.title('Knapsack Visualization')
-    plt.xticks(range(len(weights)), [f'Item {i + 1}' for i in range(len(weights))], rotation=90)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
+    value = sum(values[i] for i in range(len(values)) if taken[i])
+    return value, taken
 
 
-def solve_it(input_data):
+def bitpacked_memory(item_count, capacity):
     """
-        Solve the knapsack problem
-    :param input_data: The input data
-    :return: The formatted solution
+        Estimate the memory (in bytes) of the bit-packed engine
+    :param item_count: The number of items
+    :param capacity: The knapsack capacity
+    :return: The estimated memory
+    """
+    return item_count * ((capacity + 8) // 8) + 3 * 8 * (capacity + 1)
+
+
+def dynamic_programming(items, capacity, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+        Solve the knapsack with the memory-bounded dynamic programming engine
+    :param items: The items
+    :param capacity: The knapsack capacity
+    :param memory_budget: The memory budget (in bytes); the bit-packed take matrix is used
+                          when it fits, otherwise the Hirschberg reconstruction
+    :return: The best value and the taken flags (indexed by item index)
+    """
+    # Items heavier than the knapsack can never be taken
+    candidates = [item for item in items if item.weight <= capacity]
+    values = [item.value for item in candidates]
+    weights = [item.weight for item in candidates]
+
+    if bitpacked_memory(len(candidates), capacity) <= memory_budget:
+        value, candidate_taken = dp_bitpacked(values, weights, capacity)
+    else:
+        value, candidate_taken = dp_hirschberg(values, weights, capacity, memory_budget)
+
+    taken = [0] * len(items)
+    for item, flag in zip(candidates, candidate_taken):
+        taken[item.index] = flag
+    return value, taken
+
+
+def proportional(values, weights):
+    """
+        Whether the item values are proportional to the weights, which makes the knapsack a subset-sum
+        problem: every filling of the same weight has the same value
+    """
+    reference = next((i for i, weight in enumerate(weights) if weight), None)
+    if reference is None:
+        return False
+    return all(value * weights[reference] == weight * values[reference] for value, weight in zip(values, weights))
+
+
+def subset_sum_memory(item_count, capacity):
+    """
+        Estimate the memory (in bytes) of the subset-sum engine
+    :param item_count: The number of items
+    :param capacity: The knapsack capacity
+    :return: The estimated memory
+    """
+    stride = max(1, math.isqrt(item_count))
+    return (-(-item_count // stride) + stride + 2) * ((capacity + 8) // 8)
+
+
+def subset_sum(items, capacity):
+    """
+        Solve a knapsack whose values are proportional to the weights: the best value fills the most
+        capacity, so the DP only tracks which total weights are reachable, as the bits of one integer.
+        The Dantzig bound equals the capacity on such instances, so branch and bound cannot prune them
+    :param items: The items
+    :param capacity: The knapsack capacity
+    :return: The best value and the taken flags (indexed by item index)
     """
+    candidates = [item for item in items if item.weight <= capacity]
+    weights = [item.weight for item in candidates]
+    mask = (1 << (capacity + 1)) - 1
 
-    lines = input_data.split('\n')
+    # Keep the reachable set before every stride-th item, the others are recomputed while backtracking
+    stride = max(1, math.isqrt(len(candidates)))
+    checkpoints = list()
+    reachable = 1
+    for i, weight in enumerate(weights):
+        if i % stride == 0:
+            checkpoints.append(reachable)
+        reachable = (reachable | (reachable << weight)) & mask
 
-    first_line = lines[0].split()
-    item_count = int(first_line[0])
-    total_capacity = int(first_line[1])
+    # An item is taken when the remaining weight cannot be reached without it
+    remaining = reachable.bit_length() - 1
+    taken = [0] * len(items)
+    for block in range(len(checkpoints) - 1, -1, -1):
+        start, end = block * stride, min((block + 1) * stride, len(candidates))
+        rows = [checkpoints[block]]
+        for weight in weights[start:end - 1]:
+            rows.append((rows[-1] | (rows[-1] << weight)) & mask)
+        for i in range(end - 1, start - 1, -1):
+            if not rows[i - start] >> remaining & 1:
+                taken[candidates[i].index] = 1
+                remaining -= weights[i]
+    return sum(item.value for item in candidates if taken[item.index]), taken
 
-    items = list()
 
-    for i in range(1, item_count + 1):
-        line = lines[i]
-        parts = line.split()
-        items.append(Item(i - 1, int(parts[0]), int(parts[1])))
+class CapacityQueries:
+    """
+        One dynamic programming pass over an item set up to the largest capacity of interest, answering
+        the best value of every smaller capacity from its final row. The row and the bit-packed take
+        decisions of every item are kept, so that adding items only costs their own rows and the taken
+        items of any capacity can be rebuilt on request.
+    """
+    def __init__(self, capacity, values=(), weights=(), memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        :param capacity: The largest capacity queried
+        :param values: The item values
+        :param weights: The item weights
+        :param memory_budget: The memory budget (in bytes) of the take decisions; beyond it they are no
+                              longer stored and selections are rebuilt with the Hirschberg engine
+        """
+        self.capacity = capacity
+        self.memory_budget = memory_budget
+        self.values = list()
+        self.weights = list()
+        self.row = np.zeros(capacity + 1, dtype=np.int64)
+        self.decisions = list()
+        self.bits = np.zeros(capacity + 1, dtype=bool)
+        self.add_items(values, weights)
+
+    def add_items(self, values, weights):
+        """
+            Apply new items to the stored row
+        :param values: The item values
+        :param weights: The item weights
+        """
+        for value, weight in zip(values, weights):
+            value, weight = int(value), int(weight)
+            take = dp_update(self.row, value, weight)
+            self.values.append(value)
+            self.weights.append(weight)
+            if self.decisions is None:
+                continue
+            if bitpacked_memory(len(self.values), self.capacity) > self.memory_budget:
+                self.decisions = None
+                continue
+            self.bits[:] = False
+            self.bits[weight:weight + len(take)] = take
+            self.decisions.append(np.packbits(self.bits))
+
+    def value(self, capacity):
+        """
+            The best value of a capacity
+        """
+        if not 0 <= capacity <= self.capacity:
+            raise ValueError(f'Capacity {capacity} outside the table (0 to {self.capacity})')
+        return int(self.row[capacity])
+
+    def selection(self, capacity):
+        """
+            Rebuild the taken items of a capacity
+        :return: The taken flags, indexed like the items
+        """
+        if not 0 <= capacity <= self.capacity:
+            raise ValueError(f'Capacity {capacity} outside the table (0 to {self.capacity})')
+        if self.decisions is None:
+            items = [Item(i, value, weight) for i, (value, weight) in enumerate(zip(self.values, self.weights))]
+            return dynamic_programming(items, capacity, self.memory_budget)[1]
+        taken = [0] * len(self.values)
+        for i in range(len(self.values) - 1, -1, -1):
+            if self.decisions[i][capacity >> 3] & (0x80 >> (capacity & 7)):
+                taken[i] = 1
+                capacity -= self.weights[i]
+        return taken
+
+
+def solve_capacities(input_data, capacities, selections=False, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+        Solve the knapsack of one item set for many capacities with a single dynamic programming pass
+    :param input_data: The input data, or the instance loaded by instances.load_instance (its own capacity
+                       is ignored)
+    :param capacities: The capacities
+    :param selections: Whether to rebuild the taken items of every capacity
+    :param memory_budget: The memory budget (in bytes) of the take decisions
+    :return: The best value of every capacity, and its taken flags if selections are requested
+    """
+    instance = as_instance(input_data, 'knapsack')
+    queries = CapacityQueries(max(capacities, default=0), instance['values'].tolist(), instance['weights'].tolist(),
+                              memory_budget if selections else 0)
+    if not selections:
+        return [queries.value(capacity) for capacity in capacities]
+    return [(queries.value(capacity), queries.selection(capacity)) for capacity in capacities]
 
-    # Initialize a table to store the maximum value that can be achieved
-    # using items up to a certain index with a certain capacity
-    table = [[0] * (total_capacity + 1) for _ in range(item_count + 1)]
 
-    # Fill the table using dynamic programming
-    for i in range(1, item_count + 1):
-        for active_capacity in range(1, total_capacity + 1):
-            if items[i - 1].weight <= active_capacity:
-                table[i][active_capacity] = max(table[i - 1][active_capacity],
-                                                table[i - 1][active_capacity - items[i - 1].weight] + items[
-                                                    i - 1].value)
-            else:
-                table[i][active_capacity] = table[i - 1][active_capacity]
+def branch_and_bound(items, capacity, time_limit=BRANCH_AND_BOUND_TIME_SECONDS, on_solution=None, initial=None):
+    """
+        Solve the knapsack with depth-first branch and bound over the items sorted by value density,
+        pruning with the fractional (Dantzig) linear relaxation bound
+    :param items: The items
+    :param capacity: The knapsack capacity
+    :param time_limit: The time limit (in seconds)
+    :param on_solution: The callback receiving the value of every new incumbent
+    :param initial: The taken flags of a known solution, the first incumbent if it beats the greedy one
+    :return: The best value, the taken flags (indexed by item index) and whether optimality was proven
+    """
+    # Sort the items by value density, heavier items than the knapsack can never be taken
+    order = sorted((item for item in items if item.weight <= capacity),
+                   key=lambda item: item.value / item.weight if item.weight else float('inf'), reverse=True)
+    values = [item.value for item in order]
+    weights = [item.weight for item in order]
+    item_count = len(order)
+
+    # Prefix sums give the greedy fill (and so the bound) of any suffix in O(log n)
+    value_sums = [0] * (item_count + 1)
+    weight_sums = [0] * (item_count + 1)
+    for i in range(item_count):
+        value_sums[i + 1] = value_sums[i] + values[i]
+        weight_sums[i + 1] = weight_sums[i] + weights[i]
 
-    # Backtrack to find which items are selected
-    value = table[item_count][total_capacity]
-    taken = [0] * item_count
-    active_capacity = total_capacity
-    for i in range(item_count, 0, -1):
-        if value <= 0:
+    # The greedy solution is the first incumbent
+    best_value = 0
+    best_taken = list()
+    room = capacity
+    for i in range(item_count):
+        if weights[i] <= room:
+            room -= weights[i]
+            best_value += values[i]
+            best_taken.append(i)
+    if initial is not None:
+        # A better known solution prunes more of the tree from the start
+        positions = [j for j, item in enumerate(order) if initial[item.index]]
+        initial_value = sum(values[j] for j in positions)
+        if initial_value > best_value:
+            best_value, best_taken = initial_value, positions
+    if on_solution:
+        on_solution(best_value)
+
+    deadline = time.time() + time_limit
+    optimal = 1
+    nodes = 0
+    taken = list()
+    value = 0
+    room = capacity
+    i = 0
+    while True:
+        nodes += 1
+        if nodes & 1023 == 0 and expired(deadline):
+            optimal = 0
             break
-        if value == table[i - 1][active_capacity]:
+
+        # Find the break item: items i..split-1 all fit, item split does not
+        split = bisect_right(weight_sums, weight_sums[i] + room) - 1
+        bound = value + value_sums[split] - value_sums[i]
+        if split < item_count:
+            bound += (room - weight_sums[split] + weight_sums[i]) * values[split] // weights[split]
+
+        if bound > best_value:
+            # Forward move: take every item up to the break item, then branch on leaving it out
+            taken.extend(range(i, split))
+            value += value_sums[split] - value_sums[i]
+            room -= weight_sums[split] - weight_sums[i]
+            i = split + 1
+            if split < item_count and i < item_count:
+                continue
+            if value > best_value:
+                best_value = value
+                best_taken = list(taken)
+                if on_solution:
+                    on_solution(best_value)
+
+        # Backtrack: leave out the last taken item and explore the items after it
+        if not taken:
+            break
+        j = taken.pop()
+        value -= values[j]
+        room += weights[j]
+        i = j + 1
+
+    result = [0] * len(items)
+    for j in best_taken:
+        result[order[j].index] = 1
+    return best_value, result, optimal
+
+
+def best_known(instance, solutions):
+    """
+        Pick the best of several known solutions, e.g. the caller's and the cached one
+    :param instance: The instance
+    :param solutions: The taken flags of every known solution, None for none
+    :return: The feasible taken flags of highest value, None if no solution is feasible
+    """
+    best, best_value = None, -1
+    for taken in solutions:
+        if taken is None:
+            continue
+        flags = np.asarray(taken, dtype=bool)
+        if len(flags) != len(instance['weights']) or int(instance['weights'][flags].sum()) > instance['capacity']:
             continue
-        else:
-            taken[items[i - 1].index] = 1
-            value -= items[i - 1].value
-            active_capacity -= items[i - 1].weight
+        value = int(instance['values'][flags].sum())
+        if value > best_value:
+            best, best_value = taken, value
+    return best
+
+
+def solve(input_data, method='auto', memory_budget=DEFAULT_MEMORY_BUDGET, time_limit=BRANCH_AND_BOUND_TIME_SECONDS,
+          on_solution=None, instrumentation=None, cache=None, initial=None):
+    """
+        Solve the knapsack problem
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param method: The solver, 'dp', 'subset', 'bnb' or 'auto' to pick by the number of DP cells and
+                   whether the values are proportional to the weights
+    :param memory_budget: The memory budget (in bytes) of the dynamic programming engines
+    :param time_limit: The time limit (in seconds) of the branch and bound search
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param cache: The solution cache answering repeated solves and warm-starting the branch and bound
+    :param initial: The taken flags of a known solution to start the branch and bound from, ignored if
+                    it does not fit in the knapsack
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'knapsack')
+    item_count = len(instance['values'])
+    total_capacity = instance['capacity']
+    if method == 'auto':
+        method = 'dp' if item_count * total_capacity <= DP_CELL_LIMIT else 'bnb'
+        # Proportional values defeat the bound of the branch and bound, but the reachable weights fit in a bitset
+        if (method == 'bnb' and subset_sum_memory(item_count, total_capacity) <= memory_budget
+                and proportional(instance['values'].tolist(), instance['weights'].tolist())):
+            method = 'subset'
+    if cache is not None:
+        config = {'method': method, 'memory_budget': memory_budget}
+        return cached_solve(cache, 'knapsack', instance, config, time_limit, on_solution, lambda cached: solve(
+            instance, method, memory_budget, time_limit, on_solution, instrumentation,
+            initial=best_known(instance, (initial, cached))), maximize=True)
+    on_solution = improving(instrumentation.solution_callback(on_solution), maximize=True)
+
+    with instrumentation.phase('build'):
+        items = list()
+        for i, (value, weight) in enumerate(zip(instance['values'].tolist(), instance['weights'].tolist())):
+            items.append(Item(i, value, weight))
+
+    if method == 'dp':
+        # Run the memory-bounded dynamic programming engine, which also reconstructs the taken items
+        with instrumentation.phase('solve'):
+            value, taken = dynamic_programming(items, total_capacity, memory_budget)
+        optimal = 1
+        if on_solution:
+            on_solution(value)
+    elif method == 'subset':
+        # Run the subset-sum engine, which tracks the reachable weights only
+        with instrumentation.phase('solve'):
+            value, taken = subset_sum(items, total_capacity)
+        optimal = 1
+        if on_solution:
+            on_solution(value)
+    elif method == 'bnb':
+        # Run the branch and bound search, its cost scales with the items instead of the capacity
+        with instrumentation.phase('solve'):
+            value, taken, optimal = branch_and_bound(items, total_capacity, time_limit, on_solution,
+                                                     best_known(instance, (initial,)))
+    else:
+        raise ValueError(f'Unknown knapsack method: {method}')
 
     # Prepare the solution in the specified output format
-    output_data = str(table[item_count][total_capacity]) + ' ' + str(0) + '\n'
-    output_data += ' '.join(map(str, taken))
+    with instrumentation.phase('output'):
+        output_data = str(value) + ' ' + str(optimal) + '\n'
+        output_data += ' '.join(map(str, taken))
 
-    # Visualize the knapsack
-    visualize_knapsack(input_data, taken)
+    return SolveResult('knapsack', value, optimal, taken, output_data, instance, instrumentation.statistics())
 
-    return output_data
+
+def solve_it(input_data, method='auto', memory_budget=DEFAULT_MEMORY_BUDGET,
+             time_limit=BRANCH_AND_BOUND_TIME_SECONDS):
+    """
+        Solve the knapsack problem
+    :param input_data: The input data
+    :param method: The solver, 'dp', 'subset', 'bnb' or 'auto' to pick by the number of DP cells and
+                   whether the values are proportional to the weights
+    :param memory_budget: The memory budget (in bytes) of the dynamic programming engines
+    :param time_limit: The time limit (in seconds) of the branch and bound search
+    :return: The formatted solution
+    """
+    return solve(input_data, method, memory_budget, time_limit).output
 
 
 if __name__ == '__main__':
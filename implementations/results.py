@@ -0,0 +1,82 @@
+from instrumentation import Instrumentation
+from routing_backend import unscaled_cost
+
+
+class SolveResult:
+    """
+        The outcome of a solver: the objective, whether it is proven optimal, the solution in the problem's
+        own form, its formatted output, the instance data needed to render it and solver statistics
+    """
+    def __init__(self, problem, objective, optimal, solution, output, instance=None, statistics=None):
+        # The problem name, 'knapsack', 'coloring', 'tsp', 'vrp' or 'facility'
+        self.problem = problem
+        self.objective = objective
+        self.optimal = optimal
+        # None if no solution was found
+        self.solution = solution
+        self.output = output
+        self.instance = instance or dict()
+        # Solver specific figures, such as timings or a lower bound
+        self.statistics = statistics or dict()
+
+    @property
+    def found(self):
+        return self.solution is not None
+
+
+def no_solution(problem, instance=None, statistics=None):
+    """
+        The result of a solver that found no solution within its time limit
+    """
+    return SolveResult(problem, None, 0, None, 'No solution found within the time limit.', instance, statistics)
+
+
+def improving(on_solution, maximize=False):
+    """
+        Wrap a solution callback so that it only receives objectives better than every earlier one
+    :param on_solution: The callback taking the objective, or None
+    :param maximize: Whether larger objectives are better
+    :return: The wrapped callback, or None
+    """
+    if on_solution is None:
+        return None
+    best = list()
+
+    def report(objective):
+        if not best or (objective > best[0] if maximize else objective < best[0]):
+            best[:] = [objective]
+            on_solution(objective)
+    return report
+
+
+def format_routes(total_distance, routes):
+    """
+        Format the routes of the VRP
+    :param total_distance: The total distance traveled by all vehicles
+    :param routes: The route of every vehicle
+    :return: The formatted solution
+    """
+    output_data = "{:.2f} {}\n".format(total_distance, 0)
+    for route in routes:
+        output_data += " ".join(map(str, route)) + "\n"
+    return output_data
+
+
+def routes_result(points, routes, instrumentation=None):
+    """
+        Build the solve result of the VRP routes
+    :param points: The customer coordinates
+    :param routes: The route of every vehicle, None if no solution was found
+    :param instrumentation: The instrumentation timing the output phase and providing the statistics
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    instance = {'points': points}
+    if routes is None:
+        return no_solution('vrp', instance, instrumentation.statistics())
+
+    # Calculate the exact total distance traveled by all vehicles
+    total_distance = unscaled_cost(points, routes)
+    with instrumentation.phase('output'):
+        output_data = format_routes(total_distance, routes)
+    return SolveResult('vrp', total_distance, 0, routes, output_data, instance, instrumentation.statistics())
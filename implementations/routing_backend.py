@@ -0,0 +1,108 @@
+import numpy as np
+
+from distances import distance_matrix, route_length
+from stopping import expired
+
+# Distances are multiplied by this factor and rounded, since the routing solver works with integer costs
+DEFAULT_PRECISION = 100
+
+
+def integer_distance_matrix(points, precision=DEFAULT_PRECISION):
+    """
+        Build the scaled integer distance matrix of a point set
+    :param points: The coordinates
+    :param precision: The scale factor applied before rounding
+    :return: The (n, n) int64 distance matrix
+    """
+    return distance_matrix(points, dtype=np.int64, scale=precision, layout='dense')
+
+
+def register_distance_matrix(routing, matrix):
+    """
+        Register the integer distance matrix as the arc cost of every vehicle, so that arc
+        evaluations stay inside the native routing solver instead of calling back into Python
+    :param routing: The routing model
+    :param matrix: The integer distance matrix, indexed by node
+    :return: The transit evaluator index
+    """
+    transit_index = routing.RegisterTransitMatrix(matrix.to_dense().tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_index)
+    return transit_index
+
+
+def register_demands(routing, demands):
+    """
+        Register the node demands as a native unary transit vector
+    :param routing: The routing model
+    :param demands: The demand of every node
+    :return: The transit evaluator index
+    """
+    return routing.RegisterUnaryTransitVector([int(demand) for demand in demands])
+
+
+def extract_routes(solution, manager, routing, vehicle_count, include_end=True):
+    """
+        Extract the node sequence of every vehicle
+    :param solution: The routing solution, None to read the current solution inside a search callback
+    :param manager: The routing index manager
+    :param routing: The routing model
+    :param vehicle_count: The number of vehicles
+    :param include_end: Whether each route ends with its end node (the depot)
+    :return: The routes
+    """
+    routes = list()
+    for vehicle_id in range(vehicle_count):
+        index = routing.Start(vehicle_id)
+        route = list()
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            next_var = routing.NextVar(index)
+            index = next_var.Value() if solution is None else solution.Value(next_var)
+        if include_end:
+            route.append(manager.IndexToNode(index))
+        routes.append(route)
+    return routes
+
+
+def unscaled_cost(points, routes, closed=False):
+    """
+        Compute the exact float cost of routes, free of the integer rounding used during the search
+    :param points: The coordinates
+    :param routes: The routes
+    :param closed: Whether each route returns to its first node
+    :return: The total route length
+    """
+    return sum(route_length(points, route, closed) for route in routes)
+
+
+def cancel_when_stopped(routing):
+    """
+        Cancel a routing search at its next solution once the shared stop time passes, the search then
+        returns its best solution; it holds the GIL, so it cannot be interrupted from another thread
+    :param routing: The routing model
+    """
+    def cancel():
+        if expired():
+            routing.CancelSearch()
+    routing.AddAtSolutionCallback(cancel)
+
+
+def solve_from_routes(routing, manager, search_parameters, routes=None, depot=0):
+    """
+        Solve a routing model, starting from known routes instead of a first solution strategy if given
+    :param routing: The routing model
+    :param manager: The routing index manager
+    :param search_parameters: The search parameters
+    :param routes: The node sequence of every vehicle (depot visits are ignored), None for none
+    :param depot: The depot node
+    :return: The solution, or None if no solution was found
+    """
+    cancel_when_stopped(routing)
+    if routes is not None:
+        routing.CloseModelWithParameters(search_parameters)
+        indices = [[manager.NodeToIndex(node) for node in route if node != depot] for route in routes]
+        initial = routing.ReadAssignmentFromRoutes(indices, True)
+        # Routes that do not fit the model (e.g. another fleet size) fall back to a first solution
+        if initial is not None:
+            return routing.SolveFromAssignmentWithParameters(initial, search_parameters)
+    return routing.SolveWithParameters(search_parameters)
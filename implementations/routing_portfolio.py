@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import queue
+import time
+
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+
+from routing_backend import cancel_when_stopped, extract_routes
+from stopping import WATCH_SECONDS, expired
+
+FirstSolutionStrategy = routing_enums_pb2.FirstSolutionStrategy
+LocalSearchMetaheuristic = routing_enums_pb2.LocalSearchMetaheuristic
+
+# Search configurations of the workers, assigned in order and repeated with new seeds
+PORTFOLIO = [
+    (FirstSolutionStrategy.PATH_CHEAPEST_ARC, LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH),
+    (FirstSolutionStrategy.CHRISTOFIDES, LocalSearchMetaheuristic.TABU_SEARCH),
+    (FirstSolutionStrategy.SAVINGS, LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH),
+    (FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION, LocalSearchMetaheuristic.SIMULATED_ANNEALING),
+    (FirstSolutionStrategy.LOCAL_CHEAPEST_INSERTION, LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH),
+    (FirstSolutionStrategy.GLOBAL_CHEAPEST_ARC, LocalSearchMetaheuristic.TABU_SEARCH),
+    (FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC, LocalSearchMetaheuristic.GENERIC_TABU_SEARCH),
+    (FirstSolutionStrategy.FIRST_UNBOUND_MIN_VALUE, LocalSearchMetaheuristic.SIMULATED_ANNEALING),
+]
+
+# Largest int64 value, the shared best cost before any solution is found
+NO_COST = 2 ** 63 - 1
+
+
+def portfolio_worker(build_model, model_arguments, strategy, metaheuristic, seed, deadline, include_end,
+                     best_cost, solutions):
+    """
+        Run one routing search of the portfolio, publishing every solution that improves on the best
+        cost shared by all workers
+    :param build_model: The function building (data, manager, routing) from the model arguments
+    :param model_arguments: The model arguments
+    :param strategy: The first solution strategy
+    :param metaheuristic: The local search metaheuristic
+    :param seed: The random seed of the constraint solver
+    :param deadline: The wall-clock deadline
+    :param include_end: Whether each route ends with its end node
+    :param best_cost: The shared best (integer) cost
+    :param solutions: The queue receiving (cost, routes) of improving solutions, and None when done
+    """
+    data, manager, routing = build_model(*model_arguments)
+    routing.solver().ReSeed(seed)
+
+    def publish(cost, solution=None):
+        with best_cost.get_lock():
+            if cost >= best_cost.value:
+                return
+            best_cost.value = cost
+        solutions.put((cost, extract_routes(solution, manager, routing, data['num_vehicles'], include_end)))
+
+    # Every solution found during the search is offered, the shared best filters out the others
+    routing.AddAtSolutionCallback(lambda: publish(routing.CostVar().Value()))
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = strategy
+    search_parameters.local_search_metaheuristic = metaheuristic
+    search_parameters.time_limit.FromMilliseconds(max(1, int((deadline - time.time()) * 1000)))
+
+    cancel_when_stopped(routing)
+    solution = routing.SolveWithParameters(search_parameters)
+    if solution:
+        publish(solution.ObjectiveValue(), solution)
+    solutions.put(None)
+
+
+def portfolio_search(build_model, model_arguments, time_limit, workers=None, include_end=True, on_solution=None):
+    """
+        Run a portfolio of routing searches in parallel processes, each with its own first solution
+        strategy, metaheuristic and seed, and return the best solution when the time budget expires
+    :param build_model: The function building (data, manager, routing) from the model arguments
+    :param model_arguments: The model arguments
+    :param time_limit: The wall-clock budget (in seconds)
+    :param workers: The number of worker processes, None for the number of cores
+    :param include_end: Whether each route ends with its end node
+    :param on_solution: The callback receiving the (integer) cost and the routes of every improving solution
+    :return: The best routes, or None if no solution was found
+    """
+    workers = workers or os.cpu_count()
+    deadline = time.time() + time_limit
+    best_cost = multiprocessing.Value('q', NO_COST)
+    solutions = multiprocessing.Queue()
+
+    processes = list()
+    for worker in range(workers):
+        strategy, metaheuristic = PORTFOLIO[worker % len(PORTFOLIO)]
+        process = multiprocessing.Process(
+            target=portfolio_worker,
+            args=(build_model, model_arguments, strategy, metaheuristic, worker + 1, deadline, include_end,
+                  best_cost, solutions),
+            daemon=True)
+        process.start()
+        processes.append(process)
+
+    best = None
+    finished = 0
+    while finished < workers and not expired(deadline):
+        try:
+            # Wake up regularly, the workers end early when the shared stop time passes
+            message = solutions.get(timeout=max(0, min(deadline - time.time(), WATCH_SECONDS)))
+        except queue.Empty:
+            continue
+        if message is None:
+            finished += 1
+        elif best is None or message[0] < best[0]:
+            best = message
+            if on_solution:
+                on_solution(*message)
+
+    # Take the solutions already sent, then stop the workers that are still searching
+    while True:
+        try:
+            message = solutions.get_nowait()
+        except queue.Empty:
+            break
+        if message is not None and (best is None or message[0] < best[0]):
+            best = message
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    return None if best is None else best[1]
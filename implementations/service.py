@@ -0,0 +1,593 @@
+import argparse
+import asyncio
+import importlib
+import inspect
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import stat
+import sys
+import time
+
+from collections import deque
+from batch import GRACE_SECONDS, SOLVER_BACKENDS, SOLVER_MODULES, kill_group, pool_size
+from instances import instance_kind, load_instance
+from solution_cache import SolutionCache
+from stopping import share
+
+# Solver modules a job may ask for, by problem; the first one is the default
+ENGINES = {
+    'knapsack': ('knapsack',),
+    'coloring': ('graph_coloring', 'graph_coloring_tabu'),
+    'tsp': ('tsp', 'tsp_partition'),
+    'vrp': ('vrp', 'vrp_alns', 'vrp_decomposition'),
+    'facility': ('facility',),
+}
+
+# Engines whose solve takes a number of worker processes, they get the job's slots
+PARALLEL_ENGINES = {'graph_coloring', 'tsp', 'tsp_partition', 'vrp', 'vrp_decomposition'}
+
+# Modules the fork server imports once, so that every worker forked from it starts with the default
+# solvers and the backends they import on first use already loaded
+DEFAULT_PRELOAD = tuple(SOLVER_MODULES.values()) + tuple(sorted({module for modules in SOLVER_BACKENDS.values()
+                                                                 for module in modules}))
+
+# Keyword arguments of solve set by the service itself
+RESERVED_OPTIONS = {'input_data', 'time_limit', 'on_solution', 'instrumentation', 'cache', 'initial'}
+
+# Time budget (in seconds) of a job that does not give one
+DEFAULT_TIME_LIMIT = 60
+
+# Jobs waiting beyond this number are refused
+MAX_QUEUE = 1000
+
+# Interval (in seconds) at which a running job checks for cancellation and deadline changes
+POLL_SECONDS = 0.2
+
+# Number of recent jobs the latency figures are computed over
+LATENCY_WINDOW = 1000
+
+
+def plain(value):
+    """
+        Convert NumPy scalars to Python numbers for JSON
+    """
+    return value.item() if hasattr(value, 'item') else value
+
+
+def serve_jobs(connection, stop_time, solution_cache=None):
+    """
+        The loop of a worker process: solve the jobs received on the connection, sending every improving
+        objective as it is found and the result at the end. The solver modules stay imported between jobs.
+    :param connection: The pipe to the service
+    :param stop_time: The shared time at which the running solve stops early and returns its best solution
+    :param solution_cache: The solution cache directory, None for none
+    """
+    # Lead a process group, so that killing the worker also stops the processes its solves started
+    os.setsid()
+    cache = solution_cache and SolutionCache(solution_cache)
+    share(stop_time)
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        start = time.time()
+
+        def on_solution(objective):
+            connection.send({'event': 'solution', 'job': job['job'], 'objective': plain(objective),
+                             'elapsed': time.time() - start})
+
+        try:
+            solver = importlib.import_module(job['module'])
+            options = dict(job['options'])
+            if cache and 'cache' in inspect.signature(solver.solve).parameters:
+                options['cache'] = cache
+            input_data = job['input'] if job['path'] is None else load_instance(job['path'], job['problem'])
+            result = solver.solve(input_data, time_limit=job['time_limit'], on_solution=on_solution, **options)
+            message = {'status': 'solved' if result.found else 'no_solution', 'objective': plain(result.objective),
+                       'optimal': int(result.optimal), 'output': result.output,
+                       'cached': result.statistics.get('cached', False)}
+        except Exception as error:
+            message = {'status': 'error', 'error': f'{type(error).__name__}: {error}'}
+        message.update(event='result', job=job['job'])
+        connection.send(message)
+
+
+class Worker:
+    """
+        A worker process kept warm between jobs, and the queue of the messages it sends
+    """
+    def __init__(self, context, solution_cache=None):
+        """
+        :param context: The multiprocessing context starting the process
+        :param solution_cache: The solution cache directory, None for none
+        """
+        self.connection, child = context.Pipe()
+        # Moved earlier to make the running solve return its best solution before its time limit
+        self.stop_time = context.RawValue('d', math.inf)
+        self.process = context.Process(target=serve_jobs, args=(child, self.stop_time, solution_cache))
+        self.process.start()
+        child.close()
+        self.messages = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.connection.fileno(), self.receive)
+
+    def receive(self):
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError):
+            # The process exited or was killed
+            self.loop.remove_reader(self.connection.fileno())
+            message = None
+        self.messages.put_nowait(message)
+
+    def send(self, job):
+        self.stop_time.value = math.inf
+        self.connection.send(job)
+
+    def stop_at(self, stop_time):
+        """
+            Make the running solve stop at the given time and return its best solution
+        """
+        self.stop_time.value = stop_time
+
+    def stop(self):
+        """
+            Kill the process and the processes its job started, e.g. to cancel the job
+        """
+        self.loop.remove_reader(self.connection.fileno())
+        kill_group(self.process)
+        self.process.join()
+        self.connection.close()
+
+    def close(self):
+        """
+            Let the process finish its loop and exit
+        """
+        self.loop.remove_reader(self.connection.fileno())
+        self.connection.send(None)
+        self.process.join()
+        self.connection.close()
+
+
+class Job:
+    """
+        A solve request and its progress
+    """
+    def __init__(self, job_id, problem, module, input_data, path, time_limit, options, slots):
+        self.id = job_id
+        self.problem = problem
+        self.module = module
+        self.input_data = input_data
+        self.path = path
+        self.time_limit = time_limit
+        self.options = options
+        # The share of the global concurrency limit the job takes while it runs
+        self.slots = slots
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # The time at which a running job is killed, moved earlier when its budget is shortened
+        self.deadline = None
+        self.shortened = False
+        # The worker process running the job
+        self.worker = None
+        # Set to the final status when the job must stop before its result arrives
+        self.stop_reason = None
+        self.best = None
+        self.first_solution = None
+        self.watchers = set()
+        self.done = asyncio.Event()
+
+    def request(self):
+        """
+            The message sent to the worker process
+        """
+        return {'job': self.id, 'problem': self.problem, 'module': self.module, 'input': self.input_data,
+                'path': self.path, 'time_limit': self.time_limit, 'options': self.options}
+
+    def summary(self):
+        return {'job': self.id, 'problem': self.problem, 'engine': self.module, 'status': self.status,
+                'time_limit': self.time_limit, 'best': self.best, 'submitted': self.submitted,
+                'started': self.started, 'finished': self.finished}
+
+
+def send(writer, message):
+    """
+        Write a JSON line to a client, dropping it if the client is gone
+    """
+    if not writer.is_closing():
+        writer.write((json.dumps(message) + '\n').encode())
+
+
+def summarize(values):
+    """
+        The count, mean, median, 95th percentile and maximum of latencies
+    """
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {'count': len(ordered), 'mean': sum(ordered) / len(ordered), 'p50': ordered[len(ordered) // 2],
+            'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 'max': ordered[-1]}
+
+
+class SolverService:
+    """
+        Run solve jobs for every problem on a bounded pool of warm worker processes. Jobs wait in a first
+        in, first out queue until enough slots of the global concurrency limit are free; a job takes one
+        slot, or as many as the worker processes it asks for. Every improving objective is streamed to the
+        clients watching the job, and a job can be cancelled or its time budget shortened while it runs.
+    """
+    def __init__(self, capacity=None, max_queue=MAX_QUEUE, grace=GRACE_SECONDS, solution_cache=None,
+                 preload=DEFAULT_PRELOAD):
+        """
+        :param capacity: The global concurrency limit (slots), None to fit the cores and the available memory
+        :param max_queue: The largest number of waiting jobs
+        :param grace: The extra time (in seconds) a job gets after its budget before it is killed
+        :param solution_cache: The solution cache directory shared by the workers, None for none
+        :param preload: The modules imported once by the fork server the workers are forked from
+        """
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(list(preload))
+        self.capacity = pool_size(capacity)
+        self.max_queue = max_queue
+        self.grace = grace
+        self.solution_cache = solution_cache
+        self.queue = deque()
+        self.jobs = dict()
+        self.running = set()
+        self.used = 0
+        self.idle = list()
+        self.ids = itertools.count(1)
+        self.wakeup = asyncio.Event()
+        self.finished = dict()
+        self.latencies = {name: deque(maxlen=LATENCY_WINDOW) for name in ('queue_wait', 'first_solution', 'wall_time')}
+
+    def submit(self, request, watcher=None):
+        """
+            Queue a job
+        :param request: The submit request: 'problem' and 'input' (the instance text) or 'path', and
+                        optionally 'engine', 'time_limit', 'workers' and 'options' (keyword arguments of solve)
+        :param watcher: The client writer receiving the job events
+        :return: The job
+        """
+        path = request.get('path')
+        problem = request.get('problem') or (path and instance_kind(path))
+        if problem not in ENGINES:
+            raise ValueError(f'Unknown problem: {problem}')
+        if path is None and not isinstance(request.get('input'), str):
+            raise ValueError('A job needs the instance text (input) or file (path)')
+        module = request.get('engine') or ENGINES[problem][0]
+        if module not in ENGINES[problem]:
+            raise ValueError(f'Unknown engine for {problem}: {module}')
+        options = dict(request.get('options') or {})
+        reserved = RESERVED_OPTIONS.union(['workers']).intersection(options)
+        if reserved:
+            raise ValueError(f'Options set by the service: {", ".join(sorted(reserved))}')
+        if len(self.queue) >= self.max_queue:
+            raise ValueError('The queue is full')
+        slots = max(1, min(self.capacity, int(request.get('workers') or 1)))
+        if module in PARALLEL_ENGINES:
+            options['workers'] = slots
+        else:
+            slots = 1
+        time_limit = float(request.get('time_limit') or DEFAULT_TIME_LIMIT)
+        job = Job(str(next(self.ids)), problem, module, request.get('input'), path, time_limit, options, slots)
+        if watcher is not None:
+            job.watchers.add(watcher)
+        self.jobs[job.id] = job
+        self.queue.append(job)
+        self.wakeup.set()
+        return job
+
+    def job(self, job_id):
+        if job_id not in self.jobs:
+            raise ValueError(f'Unknown job: {job_id}')
+        return self.jobs[job_id]
+
+    def cancel(self, job_id):
+        """
+            Cancel a job, dropping it from the queue or killing its worker
+        """
+        job = self.job(job_id)
+        if job.status == 'queued':
+            self.queue.remove(job)
+            self.finish(job, {'status': 'cancelled'})
+        elif job.status == 'running':
+            job.stop_reason = 'cancelled'
+
+    def shorten(self, job_id, time_limit):
+        """
+            Lower the time budget of a job. A queued job simply gets the shorter budget; a running one is
+            asked to stop when the budget runs out and return its best solution, and is only killed if it
+            is still running after the grace period.
+        """
+        job = self.job(job_id)
+        if job.status == 'queued':
+            job.time_limit = min(job.time_limit, time_limit)
+        elif job.status == 'running' and job.started + time_limit + self.grace < job.deadline:
+            job.worker.stop_at(job.started + time_limit)
+            job.deadline = job.started + time_limit + self.grace
+            job.shortened = True
+
+    def prewarm(self, count=None):
+        """
+            Start idle workers ahead of the first jobs
+        :param count: The number of idle workers, None for the concurrency limit
+        """
+        count = self.capacity if count is None else min(count, self.capacity)
+        while len(self.idle) < count:
+            self.idle.append(Worker(self.context, self.solution_cache))
+
+    def broadcast(self, job, message):
+        for writer in list(job.watchers):
+            send(writer, message)
+
+    def finish(self, job, result):
+        job.status = result['status']
+        job.finished = time.time()
+        job.input_data = None
+        self.finished[job.status] = self.finished.get(job.status, 0) + 1
+        if job.started is not None:
+            self.latencies['queue_wait'].append(job.started - job.submitted)
+            self.latencies['wall_time'].append(job.finished - job.started)
+        if job.first_solution is not None:
+            self.latencies['first_solution'].append(job.first_solution)
+        message = {'event': 'done', 'objective': job.best, 'optimal': 0, 'output': None}
+        message.update(result)
+        message.update(job=job.id, status=job.status,
+                       queue_wait=None if job.started is None else job.started - job.submitted,
+                       wall_time=None if job.started is None else job.finished - job.started)
+        self.broadcast(job, message)
+        job.watchers.clear()
+        job.done.set()
+
+    def metrics(self):
+        """
+            The queue depth, the running jobs, the slot usage, the finished jobs by status and the latencies
+            (seconds from submission to start, from start to the first solution and from start to the end)
+        """
+        return {'queue_depth': len(self.queue), 'running': len(self.running), 'capacity': self.capacity,
+                'slots_used': self.used, 'workers': len(self.idle) + len(self.running),
+                'finished': dict(self.finished),
+                'latency': {name: summarize(values) for name, values in self.latencies.items()}}
+
+    async def dispatch(self):
+        """
+            Start the queued jobs, first in first out, as slots free up
+        """
+        while True:
+            while self.queue and self.queue[0].slots <= self.capacity - self.used:
+                job = self.queue.popleft()
+                self.used += job.slots
+                self.running.add(job)
+                asyncio.create_task(self.run(job))
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    async def run(self, job):
+        worker = None
+        while worker is None and self.idle:
+            worker = self.idle.pop()
+            if not worker.process.is_alive():
+                # The process died while idle (e.g. killed from outside), start another one
+                worker.stop()
+                worker = None
+        worker = worker or Worker(self.context, self.solution_cache)
+        job.status = 'running'
+        job.started = time.time()
+        job.deadline = job.started + job.time_limit + self.grace
+        self.broadcast(job, {'event': 'started', 'job': job.id, 'queue_wait': job.started - job.submitted})
+        job.worker = worker
+        result = None
+        try:
+            worker.send(job.request())
+        except OSError:
+            # The process died since it was checked
+            worker.stop()
+            worker = None
+            result = {'status': 'crashed'}
+        while result is None:
+            if job.stop_reason is None and time.time() >= job.deadline:
+                job.stop_reason = 'stopped' if job.shortened else 'timeout'
+            if job.stop_reason is not None:
+                worker.stop()
+                worker = None
+                result = {'status': job.stop_reason}
+                break
+            try:
+                message = await asyncio.wait_for(worker.messages.get(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                continue
+            if message is None:
+                worker.stop()
+                worker = None
+                result = {'status': 'crashed'}
+            elif message['event'] == 'solution':
+                job.best = message['objective']
+                if job.first_solution is None:
+                    job.first_solution = message['elapsed']
+                self.broadcast(job, message)
+            else:
+                result = message
+                result.pop('event')
+        if worker is not None:
+            self.idle.append(worker)
+        job.worker = None
+        self.running.discard(job)
+        self.used -= job.slots
+        self.finish(job, result)
+        self.wakeup.set()
+
+    async def handle(self, reader, writer):
+        """
+            Serve one client: read JSON requests, one per line, and write JSON events, one per line. The
+            requests are 'submit', 'cancel', 'shorten' (with 'job' and 'time_limit'), 'watch', 'status'
+            and 'metrics'; a request 'id' is echoed in its reply.
+        :return: The jobs the client submitted
+        """
+        submitted = list()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            request = None
+            reply = {'event': 'ok'}
+            try:
+                request = json.loads(line)
+                operation = request.get('op')
+                if operation == 'submit':
+                    job = self.submit(request, writer)
+                    submitted.append(job)
+                    reply = {'event': 'accepted', 'job': job.id, 'queue_depth': len(self.queue)}
+                elif operation == 'cancel':
+                    self.cancel(str(request['job']))
+                elif operation == 'shorten':
+                    self.shorten(str(request['job']), float(request['time_limit']))
+                elif operation == 'watch':
+                    job = self.job(str(request['job']))
+                    if not job.done.is_set():
+                        job.watchers.add(writer)
+                    reply = dict(job.summary(), event='status')
+                elif operation == 'status':
+                    reply = dict(self.job(str(request['job'])).summary(), event='status')
+                elif operation == 'metrics':
+                    reply = dict(self.metrics(), event='metrics')
+                else:
+                    raise ValueError(f'Unknown operation: {operation}')
+            except (ValueError, KeyError, TypeError) as error:
+                reply = {'event': 'error', 'error': f'{type(error).__name__}: {error}'}
+            if isinstance(request, dict) and 'id' in request:
+                reply['id'] = request['id']
+            send(writer, reply)
+            await writer.drain()
+        return submitted
+
+    async def close(self):
+        for job in list(self.running):
+            job.stop_reason = 'cancelled'
+        while self.running:
+            await asyncio.sleep(POLL_SECONDS)
+        for worker in self.idle:
+            worker.close()
+        self.idle.clear()
+
+
+def watchable(stream):
+    """
+        Whether the event loop can watch a standard stream: a pipe, a socket or a terminal, but not a
+        regular file it was redirected to
+    """
+    mode = os.fstat(stream.fileno()).st_mode
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)
+
+
+class FileWriter:
+    """
+        A client writer over a regular file, e.g. standard output redirected to it: writes to a file do not
+        block for long, so every line is written and flushed at once
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def is_closing(self):
+        return self.stream.closed
+
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    async def drain(self):
+        pass
+
+
+async def serve_stdio(service):
+    """
+        Serve the requests read from standard input until it closes, then wait for the submitted jobs
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    if watchable(sys.stdin):
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    else:
+        # A regular file holds every request already
+        reader.feed_data(sys.stdin.buffer.read())
+        reader.feed_eof()
+    if watchable(sys.stdout):
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    else:
+        writer = FileWriter(sys.stdout.buffer)
+    for job in await service.handle(reader, writer):
+        await job.done.wait()
+    await writer.drain()
+
+
+async def serve_tcp(service, host, port):
+    """
+        Serve every client connecting to the address until interrupted
+    """
+    async def client(reader, writer):
+        try:
+            await service.handle(reader, writer)
+        except (ConnectionError, asyncio.CancelledError):
+            # The client went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve(capacity=None, max_queue=MAX_QUEUE, grace=GRACE_SECONDS, solution_cache=None, host='127.0.0.1',
+                port=None, preload=DEFAULT_PRELOAD, prewarm=None):
+    """
+        Run the solver service on standard input and output, or on a local TCP port
+    """
+    service = SolverService(capacity, max_queue, grace, solution_cache, preload)
+    service.prewarm(prewarm)
+    dispatcher = asyncio.create_task(service.dispatch())
+    try:
+        if port is None:
+            await serve_stdio(service)
+        else:
+            await serve_tcp(service, host, port)
+    finally:
+        dispatcher.cancel()
+        await service.close()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Serve solve jobs over a JSON Lines protocol, on standard input '
+                                                 'and output or on a local TCP port')
+    parser.add_argument('--port', type=int, default=None, help='Local TCP port (default: standard input and output)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address the TCP server listens on')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Global concurrency limit (default: fit the cores and the available memory)')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help='Largest number of waiting jobs')
+    parser.add_argument('--grace', type=float, default=GRACE_SECONDS,
+                        help='Extra time (in seconds) before an overrunning job is killed')
+    parser.add_argument('--solution-cache', default=None,
+                        help='Directory of the solution cache shared by the workers (default: no cache)')
+    parser.add_argument('--preload', nargs='*', default=list(DEFAULT_PRELOAD),
+                        help='Modules imported once and shared by every worker (default: the default solvers and '
+                             'their backends)')
+    parser.add_argument('--prewarm', type=int, default=None,
+                        help='Workers started before the first job (default: the concurrency limit)')
+    options = parser.parse_args(arguments)
+    asyncio.run(serve(options.workers, options.max_queue, options.grace, options.solution_cache, options.host,
+                      options.port, options.preload, options.prewarm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from results import SolveResult
+
+# Directory of the cached solutions
+DEFAULT_CACHE_DIRECTORY = '.solution_cache'
+
+# Total size (in bytes) of the cached solutions, the least recently used ones are evicted beyond it
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def instance_digest(instance):
+    """
+        Hash an instance by its parsed arrays and sizes, so that the same instance read from text with
+        different whitespace or memory-mapped from a sidecar has the same digest
+    :param instance: The instance arrays and sizes
+    :return: The hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    for name in sorted(instance):
+        value = instance[name]
+        digest.update(name.encode())
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            digest.update(f'{value.dtype.str}{value.shape}'.encode())
+            digest.update(value.data)
+        else:
+            digest.update(json.dumps(value).encode())
+    return digest.hexdigest()
+
+
+def better(objective, reference, maximize=False):
+    return objective > reference if maximize else objective < reference
+
+
+class SolutionCache:
+    """
+        An on-disk store of the best solution found for every instance and solver configuration, keyed
+        by content so that renamed or re-read instances still hit. Entries remember the largest time
+        budget spent on them: a solve with no larger budget returns the cached result at once, a solve
+        with a larger budget starts from the cached solution.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: The directory of the cached solutions
+        :param max_bytes: The total size (in bytes) kept before evicting the least recently used entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, problem, instance, config):
+        """
+            The key of an instance solved with a solver configuration
+        :param problem: The problem name
+        :param instance: The instance arrays and sizes
+        :param config: The solver settings that change the search, without the time budget
+        :return: The hexadecimal key
+        """
+        digest = hashlib.sha256()
+        digest.update(problem.encode())
+        digest.update(instance_digest(instance).encode())
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """
+            The cached entry of a key, marked as recently used
+        :return: The entry, or None if the key is not cached
+        """
+        path = self.path(key)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, result, time_limit, maximize=False):
+        """
+            Store a solve result, keeping the cached solution if it is better
+        :param key: The key
+        :param result: The solve result
+        :param time_limit: The time budget (in seconds) the result was solved with
+        :param maximize: Whether larger objectives are better
+        """
+        entry = self.get(key)
+        if entry is not None:
+            time_limit = max(time_limit, entry['time_limit'])
+        if result.found and (entry is None or better(result.objective, entry['objective'], maximize)):
+            entry = {'problem': result.problem, 'objective': result.objective, 'optimal': result.optimal,
+                     'solution': result.solution, 'output': result.output}
+        elif entry is None:
+            return
+        entry['time_limit'] = time_limit
+        entry['optimal'] = max(entry['optimal'], result.optimal)
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path(key) + '.tmp'
+        with open(temporary, 'w') as entry_file:
+            # NumPy integers in the solutions are written as plain integers
+            json.dump(entry, entry_file, default=int)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+            Remove the least recently used entries until the cache fits its size
+        """
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                status = os.stat(os.path.join(self.directory, name))
+                entries.append((status.st_mtime, status.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    @staticmethod
+    def covers(entry, time_limit):
+        """
+            Whether a cached entry answers a solve, because it is optimal or was solved with at least
+            the same budget
+        """
+        return entry is not None and (entry['optimal'] or entry['time_limit'] >= time_limit)
+
+    @staticmethod
+    def result(entry, instance=None):
+        """
+            The solve result of a cached entry
+        """
+        return SolveResult(entry['problem'], entry['objective'], entry['optimal'], entry['solution'],
+                           entry['output'], instance, {'cached': True})
+
+
+def cached_solve(cache, problem, instance, config, time_limit, on_solution, solve, maximize=False):
+    """
+        Answer a solve from the cache when it covers the time budget, otherwise solve from the cached
+        solution (if any) and store the result
+    :param cache: The solution cache
+    :param problem: The problem name
+    :param instance: The instance arrays and sizes
+    :param config: The solver settings that change the search, without the time budget
+    :param time_limit: The time budget (in seconds)
+    :param on_solution: The callback receiving the cached objective, or None
+    :param solve: The function solving the instance from an initial solution (None for none)
+    :param maximize: Whether larger objectives are better
+    :return: The solve result
+    """
+    key = cache.key(problem, instance, config)
+    entry = cache.get(key)
+    if cache.covers(entry, time_limit):
+        if on_solution:
+            on_solution(entry['objective'])
+        return cache.result(entry, instance)
+    result = solve(entry and entry['solution'])
+    cache.put(key, result, time_limit, maximize)
+    return result
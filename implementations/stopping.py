@@ -0,0 +1,58 @@
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Interval (in seconds) at which a watched search checks the shared stop time
+WATCH_SECONDS = 0.1
+
+# The wall-clock time at which the solves of this process stop early and return their best solution (a
+# multiprocessing Value shared with the solver service), None when solves only stop at their own time
+# limits. The processes forked by a solve inherit it.
+shared_stop = None
+
+
+def share(stop_time):
+    """
+        Let another process stop the solves of this one early
+    :param stop_time: The shared stop time, a multiprocessing Value of type 'd' (infinity for no stop)
+    """
+    global shared_stop
+    shared_stop = stop_time
+
+
+def expired(deadline=math.inf):
+    """
+        Whether a search must stop, because its own deadline or the shared stop time has passed
+    :param deadline: The wall-clock deadline of the search
+    """
+    now = time.time()
+    return now > deadline or (shared_stop is not None and now > shared_stop.value)
+
+
+@contextmanager
+def watch(stop):
+    """
+        Call stop (e.g. the StopSearch of a CP-SAT solver) from a background thread once the shared stop
+        time passes, for the native searches that release the GIL while they run
+    :param stop: The function interrupting the search, which then returns its best solution
+    """
+    if shared_stop is None:
+        yield
+        return
+    finished = threading.Event()
+
+    def poll():
+        while not finished.wait(WATCH_SECONDS):
+            if expired():
+                stop()
+                return
+
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        finished.set()
+        thread.join()
@@ -0,0 +1,297 @@
+import math
+
+# Tours with more cities than this use the two-level list representation
+TWO_LEVEL_THRESHOLD = 10000
+
+
+class Tour:
+    """
+        A closed tour over a set of cities supporting next/prev/between/reverse, 2-opt and Or-opt moves
+        and incremental length tracking. A VRP vehicle route is the closed tour starting at the depot.
+        Subclasses provide the representation: next, prev, sequence and reverse_path.
+    """
+    def __init__(self, distance=None):
+        # The distance function, if given the tour length is kept up to date by every move
+        self.distance = distance
+        self.length = None
+        # Reversals applied since the journal was started, so that they can be rolled back
+        self.journal = None
+        self.journal_length = None
+
+    def compute_length(self):
+        cities = self.cities()
+        return sum(self.distance(cities[i - 1], cities[i]) for i in range(len(cities)))
+
+    def between(self, a, b, c):
+        """
+            Whether b lies on the path from a to c (in tour order)
+        """
+        key_a, key_b, key_c = self.sequence(a), self.sequence(b), self.sequence(c)
+        if key_a <= key_c:
+            return key_a <= key_b <= key_c
+        return key_b >= key_a or key_b <= key_c
+
+    def reverse(self, first, last):
+        """
+            Reverse the path from first to last (in tour order); the representation may reverse
+            the complementary path instead, which gives the same cycle
+        """
+        if self.journal is not None:
+            self.journal.append((self.prev(first), first, last))
+        self.reverse_path(first, last)
+
+    def start_journal(self):
+        self.journal = list()
+        self.journal_length = self.length
+
+    def commit(self):
+        self.journal = None
+
+    def rollback(self):
+        """
+            Undo every reversal recorded since the journal was started and stop journaling
+        """
+        for before, first, last in reversed(self.journal):
+            # The reversed cities read last..first after before, or first..last if the representation
+            # reversed the complement and so flipped the direction of the tour
+            if self.next(before) == last:
+                self.reverse_path(last, first)
+            elif before != last:
+                self.reverse_path(first, last)
+        self.journal = None
+        self.length = self.journal_length
+
+    def two_opt_delta(self, a, b, c, d):
+        """
+            The length change of replacing the edges (a, b) and (c, d) with (a, c) and (b, d)
+        """
+        return self.distance(a, c) + self.distance(b, d) - self.distance(a, b) - self.distance(c, d)
+
+    def two_opt_move(self, a, b, c, d):
+        """
+            Replace the edges (a, b) and (c, d) with (a, c) and (b, d), where b follows a and d follows c
+            in either tour direction
+        """
+        if self.length is not None:
+            self.length += self.two_opt_delta(a, b, c, d)
+        if self.next(a) == b:
+            self.reverse(b, c)
+        else:
+            self.reverse(c, b)
+
+    def or_opt_move(self, p, first, last, n, u, w, keep):
+        """
+            Move the segment first..last (between p and n) between the cities u and w, where w follows u
+            in the same direction as first follows p, as a sequence of 2-opt moves
+        :param keep: Whether the result reads u first..last w (otherwise u last..first w)
+        """
+        self.two_opt_move(p, first, u, w)
+        self.two_opt_move(p, u, n, last)
+        if keep:
+            self.two_opt_move(u, last, first, w)
+
+    def cities(self, start=None):
+        """
+            The cities in tour order, beginning at start (e.g. the depot of a vehicle route)
+        """
+        city = self.first() if start is None else start
+        cities = [city]
+        for _ in range(self.size - 1):
+            city = self.next(city)
+            cities.append(city)
+        return cities
+
+    def track_length(self, distance):
+        self.distance = distance
+        self.length = self.compute_length()
+
+
+def city_index(cities):
+    """
+        Build an empty per-city table, a list for dense city ids and a dict otherwise
+    """
+    if cities and min(cities) >= 0 and max(cities) < 2 * len(cities):
+        return [0] * (max(cities) + 1)
+    return dict()
+
+
+class ArrayTour(Tour):
+    """
+        A tour stored as a city array plus the position of every city; reversals cost O(n)
+    """
+    def __init__(self, order, distance=None):
+        super().__init__(distance)
+        self.order = list(order)
+        self.size = len(self.order)
+        self.position = city_index(self.order)
+        for i, city in enumerate(self.order):
+            self.position[city] = i
+        if distance is not None:
+            self.length = self.compute_length()
+
+    def first(self):
+        return self.order[0]
+
+    def next(self, city):
+        return self.order[(self.position[city] + 1) % self.size]
+
+    def prev(self, city):
+        return self.order[self.position[city] - 1]
+
+    def sequence(self, city):
+        return self.position[city]
+
+    def reverse_path(self, first, last):
+        order, position, size = self.order, self.position, self.size
+        i, j = position[first], position[last]
+        length = (j - i) % size + 1
+        if 2 * length > size:
+            i, j = (j + 1) % size, (i - 1) % size
+            length = size - length
+        for _ in range(length // 2):
+            order[i], order[j] = order[j], order[i]
+            position[order[i]] = i
+            position[order[j]] = j
+            i = i + 1 if i + 1 < size else 0
+            j = j - 1 if j > 0 else size - 1
+
+    def cities(self, start=None):
+        if start is None:
+            return list(self.order)
+        i = self.position[start]
+        return self.order[i:] + self.order[:i]
+
+
+class Segment:
+    """
+        A block of consecutive cities of a two-level tour, read backwards when reversed
+    """
+    def __init__(self, cities, reversed, rank):
+        self.cities = cities
+        self.reversed = reversed
+        self.rank = rank
+
+
+class TwoLevelTour(Tour):
+    """
+        A tour stored as about sqrt(n) segments, each with a reversal bit. Reversing a path splits
+        at most two segments and flips the segments in between, so moves cost O(sqrt(n)) amortized
+    """
+    def __init__(self, order, distance=None, segment_size=None):
+        super().__init__(distance)
+        self.size = len(order)
+        self.segment_size = segment_size or max(8, int(math.sqrt(self.size)))
+        self.segment = city_index(list(order))
+        self.index = city_index(list(order))
+        self.build(list(order))
+        if distance is not None:
+            self.length = self.compute_length()
+
+    def build(self, order):
+        """
+            Split the tour into balanced segments
+        """
+        self.segments = list()
+        for start in range(0, len(order), self.segment_size):
+            self.segments.append(Segment(order[start:start + self.segment_size], False, len(self.segments)))
+        for segment in self.segments:
+            self.reindex(segment)
+
+    def reindex(self, segment):
+        for i, city in enumerate(segment.cities):
+            self.segment[city] = segment
+            self.index[city] = i
+
+    def first(self):
+        segment = self.segments[0]
+        return segment.cities[-1] if segment.reversed else segment.cities[0]
+
+    def boundary(self, rank, at_start):
+        # The first (or last) city, in tour order, of the segment with the given rank
+        segment = self.segments[rank % len(self.segments)]
+        return segment.cities[0 if at_start != segment.reversed else -1]
+
+    def next(self, city):
+        segment = self.segment[city]
+        i = self.index[city] + (-1 if segment.reversed else 1)
+        if 0 <= i < len(segment.cities):
+            return segment.cities[i]
+        return self.boundary(segment.rank + 1, True)
+
+    def prev(self, city):
+        segment = self.segment[city]
+        i = self.index[city] + (1 if segment.reversed else -1)
+        if 0 <= i < len(segment.cities):
+            return segment.cities[i]
+        return self.boundary(segment.rank - 1, False)
+
+    def oriented_index(self, city):
+        segment = self.segment[city]
+        i = self.index[city]
+        return len(segment.cities) - 1 - i if segment.reversed else i
+
+    def sequence(self, city):
+        return self.segment[city].rank, self.oriented_index(city)
+
+    def split_before(self, city):
+        """
+            Split the segment of city so that city starts a segment
+        """
+        segment = self.segment[city]
+        k = self.oriented_index(city)
+        if k == 0:
+            return
+        i = self.index[city]
+        # The raw list is read backwards when reversed, so the leading part holds the higher indices
+        if segment.reversed:
+            leading, trailing = segment.cities[i + 1:], segment.cities[:i + 1]
+        else:
+            leading, trailing = segment.cities[:i], segment.cities[i:]
+        segment.cities = leading
+        created = Segment(trailing, segment.reversed, segment.rank + 1)
+        self.segments.insert(segment.rank + 1, created)
+        for rank in range(segment.rank + 2, len(self.segments)):
+            self.segments[rank].rank = rank
+        self.reindex(segment)
+        self.reindex(created)
+
+    def split_after(self, city):
+        following = self.next(city)
+        if self.segment[following] is self.segment[city]:
+            self.split_before(following)
+
+    def reverse_path(self, first, last):
+        self.split_before(first)
+        self.split_after(last)
+        start, end = self.segment[first].rank, self.segment[last].rank
+        if start > end:
+            # The path wraps around the segment list, so rotate the list to start with the path; reversing
+            # the complement instead would give the same cycle but flip the direction of the tour
+            self.segments = self.segments[start:] + self.segments[:start]
+            for rank, segment in enumerate(self.segments):
+                segment.rank = rank
+            start, end = 0, end + len(self.segments) - start
+        flipped = self.segments[start:end + 1]
+        flipped.reverse()
+        self.segments[start:end + 1] = flipped
+        for rank in range(start, end + 1):
+            segment = self.segments[rank]
+            segment.rank = rank
+            segment.reversed = not segment.reversed
+
+        # Splits leave ever more, ever smaller segments, so rebalance once there are too many
+        if len(self.segments) > 4 * math.sqrt(self.size) + 8:
+            self.build(self.cities())
+
+
+def make_tour(order, distance=None, two_level_threshold=TWO_LEVEL_THRESHOLD):
+    """
+        Build the tour representation suited to the number of cities
+    :param order: The cities in tour order
+    :param distance: The distance function, if given the tour length is tracked incrementally
+    :param two_level_threshold: The number of cities above which the two-level list is used
+    :return: The tour
+    """
+    if len(order) > two_level_threshold:
+        return TwoLevelTour(order, distance)
+    return ArrayTour(order, distance)
@@ -1,35 +1,19 @@
-import matplotlib.pyplot as plt
+import tsp_local_search
 
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
+from distances import route_length
+from instances import as_instance
+from instrumentation import Instrumentation
+from routing_backend import DEFAULT_PRECISION, integer_distance_matrix, register_distance_matrix, solve_from_routes
+from results import SolveResult, improving, no_solution
+from solution_cache import cached_solve
 
 MAX_TIME_SECONDS = 7200
 
-def visualize_tsp_solution(locations, route):
-    """
-        Visualize the graph coloring solution
-    :param locations: The input locations
-    :param route: The selected route
-    """
-    # Extract coordinates of locations
-    x = [city[0] for city in locations]
-    y = [city[1] for city in locations]
-
-    # Plot locations
-    plt.scatter(x, y, color='blue')
-
-    # Plot connections between locations in the route
-    for i in range(len(route) - 1):
-        city1 = route[i]
-        city2 = route[i + 1]
-        plt.plot([locations[city1][0], locations[city2][0]], [locations[city1][1], locations[city2][1]], color='red')
-
-    # Set plot title
-    plt.title('TSP Solution Visualization')
-
-    # Show plot
-    plt.show()
+# Instances with more cities than this are solved with the native candidate-list local search
+LARGE_INSTANCE_NODES = 2000
 
+# Time budget (in seconds) of the native local search
+LOCAL_SEARCH_TIME_SECONDS = 300
 
 def extract_route_from_solution(solution, manager, routing):
     """
@@ -47,37 +31,38 @@ def extract_route_from_solution(solution, manager, routing):
     return route
 
 
-def create_data_model(input_data):
+def read_points(input_data):
+    """
+        Read the city coordinates
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :return: The (n, 2) city coordinate array
+    """
+    return as_instance(input_data, 'tsp')['points']
+
+
+def create_data_model(input_data, precision=DEFAULT_PRECISION):
     """
         Extract the route from the solution
     :param input_data: The input data
+    :param precision: The scale factor of the integer distances
     """
-    lines = input_data.split('\n')
-    node_count = int(lines[0])
-
     data = dict()
-    data['points'] = list()
-    for i in range(1, node_count + 1):
-        line = lines[i]
-        parts = line.split()
-        data['points'].append((float(parts[0]), float(parts[1])))
-
-    data['distance_matrix'] = [
-        [0] * node_count for _ in range(node_count)]
-    for from_node in range(node_count):
-        for to_node in range(node_count):
-            x1 = data['points'][from_node][0]
-            y1 = data['points'][from_node][1]
-            x2 = data['points'][to_node][0]
-            y2 = data['points'][to_node][1]
-            data['distance_matrix'][from_node][to_node] = ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
+    data['points'] = read_points(input_data)
+    data['distance_matrix'] = integer_distance_matrix(data['points'], precision)
     data['num_vehicles'] = 1
     data['depot'] = 0
     return data
 
 
-def solve_it(input_data):
-    data = create_data_model(tsp_input)
+def build_routing_model(input_data, precision=DEFAULT_PRECISION):
+    """
+        Build the routing model of the TSP
+    :param input_data: The input data
+    :param precision: The scale factor of the integer distances
+    :return: The data model, the routing index manager and the routing model
+    """
+    from ortools.constraint_solver import pywrapcp
+    data = create_data_model(input_data, precision)
 
     # Create the routing index manager.
     manager = pywrapcp.RoutingIndexManager(
@@ -86,17 +71,30 @@ def solve_it(input_data):
     # Create Routing Model.
     routing = pywrapcp.RoutingModel(manager)
 
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        # Returns the distance between the two nodes.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
+    # Register the integer distance matrix as the cost of each arc.
+    register_distance_matrix(routing, data['distance_matrix'])
+    return data, manager, routing
 
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
 
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+def routing_search(input_data, time_limit, precision=DEFAULT_PRECISION, on_solution=None, instrumentation=None,
+                   initial=None):
+    """
+        Solve the TSP with the OR-Tools routing solver
+    :param input_data: The input data
+    :param time_limit: The time limit (in seconds)
+    :param precision: The scale factor of the integer distances
+    :param on_solution: The callback receiving the (unscaled) cost of every solution of the search
+    :param instrumentation: The instrumentation timing the build, solve and extract phases
+    :param initial: A known route to start the search from instead of the Christofides tour
+    :return: The route, or None if no solution was found
+    """
+    from ortools.constraint_solver import pywrapcp
+    from ortools.constraint_solver import routing_enums_pb2
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('build'):
+        data, manager, routing = build_routing_model(input_data, precision)
+    if on_solution:
+        routing.AddAtSolutionCallback(lambda: on_solution(routing.CostVar().Value() / precision))
 
     # Set First Solution Strategy
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
@@ -107,22 +105,89 @@ def solve_it(input_data):
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.TABU_SEARCH)
 
-    search_parameters.time_limit.seconds = MAX_TIME_SECONDS
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
 
     # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
-    route = extract_route_from_solution(solution, manager, routing)
-    total_distance = 0
-    for i in range(len(route) - 1):
-        total_distance += data['distance_matrix'][route[i]][route[i + 1]]
-
-    if solution:
-        # Format the solution
+    with instrumentation.phase('solve'):
+        solution = solve_from_routes(routing, manager, search_parameters, initial and [initial])
+    if not solution:
+        return None
+    with instrumentation.phase('extract'):
+        return extract_route_from_solution(solution, manager, routing)
+
+
+def solve(input_data, method='auto', time_limit=None, precision=DEFAULT_PRECISION, workers=1, on_solution=None,
+          instrumentation=None, cache=None, initial=None):
+    """
+        Solve the TSP
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param method: The solver, 'routing' (OR-Tools), 'local_search' (native candidate-list local search)
+                   or 'auto' to pick by the number of cities
+    :param time_limit: The time limit (in seconds), None for the default of the method
+    :param precision: The scale factor of the integer distances of the routing solver
+    :param workers: The number of parallel routing searches, each with its own strategy (None for all cores)
+    :param on_solution: The callback receiving the objective of every improving solution (the routing
+                        solver reports its integer cost divided by the precision)
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param cache: The solution cache answering repeated solves and warm-starting the search
+    :param initial: A known tour to start the search from (the parallel portfolio ignores it)
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+
+    # Parse once, the routing model builders accept the parsed instance
+    with instrumentation.phase('parse'):
+        input_data = as_instance(input_data, 'tsp')
+        points = read_points(input_data)
+    if method == 'auto':
+        method = 'local_search' if len(points) > LARGE_INSTANCE_NODES else 'routing'
+    if time_limit is None:
+        time_limit = LOCAL_SEARCH_TIME_SECONDS if method == 'local_search' else MAX_TIME_SECONDS
+    if cache is not None:
+        config = {'method': method, 'precision': precision, 'workers': workers}
+        return cached_solve(cache, 'tsp', input_data, config, time_limit, on_solution, lambda initial: solve(
+            input_data, method, time_limit, precision, workers, on_solution, instrumentation, initial=initial))
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+
+    if method == 'routing' and workers == 1:
+        route = routing_search(input_data, time_limit, precision, on_solution, instrumentation, initial)
+    elif method == 'routing':
+        from routing_portfolio import portfolio_search
+        # The workers build their own models, so the whole portfolio counts as the solve phase
+        with instrumentation.phase('solve'):
+            routes = portfolio_search(build_routing_model, (input_data, precision), time_limit, workers,
+                                      include_end=False, on_solution=lambda cost, _: on_solution(cost / precision))
+        route = None if routes is None else routes[0]
+    elif method == 'local_search':
+        with instrumentation.phase('solve'):
+            route = tsp_local_search.solve(points, time_limit, initial=initial or 'greedy', on_solution=on_solution)
+    else:
+        raise ValueError(f'Unknown TSP method: {method}')
+
+    instance = {'points': points}
+    if route is None:
+        return no_solution('tsp', instance, instrumentation.statistics())
+
+    total_distance = route_length(points, route)
+
+    # Format the solution
+    with instrumentation.phase('output'):
         formatted_solution = "{:.2f} {}\n".format(total_distance, 0)
         formatted_solution += ' '.join(map(str, route))
+    return SolveResult('tsp', total_distance, 0, route, formatted_solution, instance, instrumentation.statistics())
+
 
-        visualize_tsp_solution(data['points'], route)
-        return formatted_solution
+def solve_it(input_data, method='auto', time_limit=None, precision=DEFAULT_PRECISION, workers=1):
+    """
+        Solve the TSP
+    :param input_data: The input data
+    :param method: The solver, 'routing', 'local_search' or 'auto' to pick by the number of cities
+    :param time_limit: The time limit (in seconds), None for the default of the method
+    :param precision: The scale factor of the integer distances of the routing solver
+    :param workers: The number of parallel routing searches (None for all cores)
+    :return: The formatted solution
+    """
+    return solve(input_data, method, time_limit, precision, workers).output
 
 
 if __name__ == '__main__':
@@ -0,0 +1,348 @@
+import math
+import random
+import time
+import numpy as np
+
+from collections import deque
+from stopping import expired
+from tour import make_tour
+
+# Number of nearest neighbors kept as move candidates for every city
+CANDIDATE_COUNT = 8
+
+# Longest segment moved by Or-opt
+MAX_SEGMENT_LENGTH = 3
+
+# Smallest improvement accepted by the local search
+EPSILON = 1e-9
+
+# Span (in tour positions) of the double-bridge kicks applied once the local search converges
+KICK_WINDOW = 50
+
+
+def nearest_neighbors(points, k=CANDIDATE_COUNT):
+    """
+        Build the k-nearest-neighbor candidate graph with a KD-tree
+    :param points: The (n, 2) coordinate array
+    :param k: The number of neighbors of every city
+    :return: The (n, k) neighbor array, sorted by increasing distance
+    """
+    from scipy.spatial import cKDTree
+    k = min(k, len(points) - 1)
+    _, neighbors = cKDTree(points).query(points, k=k + 1)
+    # The nearest point of every city is the city itself
+    return neighbors[:, 1:].astype(np.int32)
+
+
+def hilbert_index(points, order=16):
+    """
+        Compute the position of every point along a Hilbert space-filling curve
+    :param points: The (n, 2) coordinate array
+    :param order: The number of bits per coordinate of the curve grid
+    :return: The curve index of every point
+    """
+    side = 1 << order
+    low = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - low).max()), 1e-12)
+    x = ((points[:, 0] - low[0]) / extent * (side - 1)).astype(np.int64)
+    y = ((points[:, 1] - low[1]) / extent * (side - 1)).astype(np.int64)
+    index = np.zeros(len(points), dtype=np.int64)
+    s = side >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x[flip] = side - 1 - x[flip]
+        y[flip] = side - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s >>= 1
+    return index
+
+
+def space_filling_curve_tour(points):
+    """
+        Build a tour visiting the cities in Hilbert curve order
+    :param points: The (n, 2) coordinate array
+    :return: The tour
+    """
+    return np.argsort(hilbert_index(points), kind='stable').tolist()
+
+
+def greedy_tour(points, neighbors):
+    """
+        Build a tour with the greedy edge heuristic over the candidate graph,
+        joining the resulting fragments in Hilbert curve order
+    :param points: The (n, 2) coordinate array
+    :param neighbors: The candidate neighbor array
+    :return: The tour
+    """
+    node_count = len(points)
+    if node_count < 3:
+        return list(range(node_count))
+
+    # Candidate edges sorted by length
+    sources = np.repeat(np.arange(node_count), neighbors.shape[1])
+    targets = neighbors.ravel()
+    keep = sources < targets
+    sources, targets = sources[keep], targets[keep]
+    lengths = np.hypot(*(points[sources] - points[targets]).T)
+    order = np.argsort(lengths, kind='stable')
+
+    degree = [0] * node_count
+    parent = list(range(node_count))
+    adjacency = [list() for _ in range(node_count)]
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for u, v in zip(sources[order].tolist(), targets[order].tolist()):
+        if degree[u] < 2 and degree[v] < 2:
+            root_u, root_v = find(u), find(v)
+            if root_u != root_v:
+                parent[root_u] = root_v
+                degree[u] += 1
+                degree[v] += 1
+                adjacency[u].append(v)
+                adjacency[v].append(u)
+
+    # Walk every fragment (a path or a single city) from one of its endpoints
+    fragments = list()
+    visited = [False] * node_count
+    for start in range(node_count):
+        if visited[start] or degree[start] == 2:
+            continue
+        fragment = [start]
+        visited[start] = True
+        previous, current = -1, start
+        while True:
+            following = [node for node in adjacency[current] if node != previous]
+            if not following:
+                break
+            previous, current = current, following[0]
+            fragment.append(current)
+            visited[current] = True
+        fragments.append(fragment)
+
+    # Join the fragments in curve order, orienting each to start next to the previous end
+    curve = hilbert_index(points)
+    fragments.sort(key=lambda fragment: min(curve[fragment[0]], curve[fragment[-1]]))
+    tour = list(fragments[0])
+    for fragment in fragments[1:]:
+        last = points[tour[-1]]
+        if np.hypot(*(points[fragment[-1]] - last)) < np.hypot(*(points[fragment[0]] - last)):
+            fragment.reverse()
+        tour.extend(fragment)
+    return tour
+
+
+def local_search(tour, xs, ys, neighbors, deadline, cities=None):
+    """
+        Improve a tour with 2-opt and Or-opt over the candidate lists, driven by don't-look bits
+    :param tour: The tour
+    :param xs: The x coordinates
+    :param ys: The y coordinates
+    :param neighbors: The candidate neighbor lists
+    :param deadline: The wall-clock deadline
+    :param cities: The initially active cities, None for all of them
+    :return: The total length reduction
+    """
+    def dist(a, b):
+        return math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    # Only the active cities are examined; a city is re-activated when one of its tour edges changes
+    queue = deque(tour.cities() if cities is None else cities)
+    active = [False] * tour.size
+    for city in queue:
+        active[city] = True
+    checks = 0
+    total_gain = 0.0
+
+    def activate(*cities):
+        for city in cities:
+            if not active[city]:
+                active[city] = True
+                queue.append(city)
+
+    while queue:
+        checks += 1
+        if checks & 255 == 0 and expired(deadline):
+            break
+        a = queue.popleft()
+        active[a] = False
+        improved = False
+
+        for forward in (True, False):
+            succ = tour.next if forward else tour.prev
+            pred = tour.prev if forward else tour.next
+
+            # 2-opt: replace (a, succ a) and (c, succ c) with (a, c) and (succ a, succ c)
+            b = succ(a)
+            d_ab = dist(a, b)
+            for c in neighbors[a]:
+                d_ac = dist(a, c)
+                if d_ac >= d_ab:
+                    break
+                d = succ(c)
+                if c == b or d == a:
+                    continue
+                gain = d_ab + dist(c, d) - d_ac - dist(b, d)
+                if gain > EPSILON:
+                    total_gain += gain
+                    tour.two_opt_move(a, b, c, d)
+                    activate(a, b, c, d)
+                    improved = True
+                    break
+            if improved:
+                break
+
+            # Or-opt: move the segment a..s (up to MAX_SEGMENT_LENGTH cities) next to a neighbor of a
+            p = pred(a)
+            s = a
+            for _ in range(min(MAX_SEGMENT_LENGTH, tour.size - 3)):
+                n = succ(s)
+                if n == p:
+                    break
+                removal_gain = dist(p, a) + dist(s, n) - dist(p, n)
+                if removal_gain <= EPSILON:
+                    s = n
+                    continue
+                segment = set()
+                city = a
+                while True:
+                    segment.add(city)
+                    if city == s:
+                        break
+                    city = succ(city)
+
+                for c in neighbors[a]:
+                    d_ac = dist(a, c)
+                    if d_ac >= removal_gain:
+                        break
+                    if c in segment:
+                        continue
+                    # Insert between c and its successor (c a..s e) or its predecessor (e s..a c)
+                    for e, keep in ((succ(c), True), (pred(c), False)):
+                        if e in segment or (e if keep else c) == p:
+                            continue
+                        gain = removal_gain + dist(c, e) - d_ac - dist(s, e)
+                        if gain > EPSILON:
+                            total_gain += gain
+                            if keep:
+                                tour.or_opt_move(p, a, s, n, c, e, True)
+                            else:
+                                tour.or_opt_move(p, a, s, n, e, c, False)
+                            activate(p, a, s, n, c, e)
+                            improved = True
+                            break
+                    if improved:
+                        break
+                if improved:
+                    break
+                s = n
+            if improved:
+                break
+
+        if improved:
+            activate(a)
+    return total_gain
+
+
+def double_bridge_kick(tour, xs, ys, rng, window=KICK_WINDOW):
+    """
+        Perturb the tour with a double-bridge move inside a short window of positions,
+        swapping the two adjacent segments B and C of x B C y
+    :param tour: The tour
+    :param xs: The x coordinates
+    :param ys: The y coordinates
+    :param rng: The random generator
+    :param window: The span of the kick in tour positions
+    :return: The length increase and the cities whose edges changed
+    """
+    def dist(a, b):
+        return math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    # Walk the window from a random city
+    cities = [rng.randrange(tour.size)]
+    for _ in range(window):
+        cities.append(tour.next(cities[-1]))
+    first, second, third = sorted(rng.sample(range(1, window + 1), 3))
+    x, b1, b2 = cities[first - 1], cities[first], cities[second - 1]
+    c1, c2, y = cities[second], cities[third - 1], cities[third]
+
+    delta = (dist(x, c1) + dist(c2, b1) + dist(b2, y)) - (dist(x, b1) + dist(b2, c1) + dist(c2, y))
+    # x B C y -> x C' B' y -> x C B y, every reversal stays inside the window
+    tour.reverse(b1, c2)
+    tour.reverse(c2, c1)
+    tour.reverse(b2, b1)
+    return delta, (x, b1, b2, c1, c2, y)
+
+
+def tour_length(points, order):
+    """
+        Compute the length of a closed tour
+    :param points: The (n, 2) coordinate array
+    :param order: The tour
+    :return: The tour length
+    """
+    path = points[np.asarray(order)]
+    return float(np.hypot(*(path - np.roll(path, -1, axis=0)).T).sum())
+
+
+def solve(points, time_limit, k=CANDIDATE_COUNT, initial='greedy', seed=0, on_solution=None):
+    """
+        Solve a large TSP instance with candidate-list local search in O(n * k) memory; once the
+        local search converges the remaining time is spent on double-bridge kicks that are kept
+        only if the tour improves
+    :param points: The (n, 2) coordinate array
+    :param time_limit: The time budget (in seconds)
+    :param k: The number of candidate neighbors of every city
+    :param initial: The initial tour, 'greedy', 'curve' (Hilbert space-filling curve) or a known tour
+    :param seed: The random seed of the kicks
+    :param on_solution: The callback receiving the length of every improved tour
+    :return: The tour
+    """
+    deadline = time.time() + time_limit
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 5:
+        return list(range(len(points)))
+
+    neighbors = nearest_neighbors(points, k)
+    if initial == 'greedy':
+        order = greedy_tour(points, neighbors)
+    elif initial == 'curve':
+        order = space_filling_curve_tour(points)
+    elif not isinstance(initial, str):
+        order = list(initial)
+    else:
+        raise ValueError(f'Unknown initial tour: {initial}')
+
+    tour = make_tour(order)
+    xs, ys, neighbors = points[:, 0].tolist(), points[:, 1].tolist(), neighbors.tolist()
+    length = tour_length(points, order) if on_solution else 0
+    if on_solution:
+        on_solution(length)
+    length -= local_search(tour, xs, ys, neighbors, deadline)
+    if on_solution:
+        on_solution(length)
+
+    # The kicks must stay far shorter than the tour so that no reversal wraps around it
+    window = min(KICK_WINDOW, tour.size // 4)
+    rng = random.Random(seed)
+    while window >= 3 and not expired(deadline):
+        tour.start_journal()
+        delta, cities = double_bridge_kick(tour, xs, ys, rng, window)
+        gain = local_search(tour, xs, ys, neighbors, deadline, cities)
+        if gain - delta > EPSILON:
+            tour.commit()
+            length -= gain - delta
+            if on_solution:
+                on_solution(length)
+        else:
+            tour.rollback()
+    return tour.cities()
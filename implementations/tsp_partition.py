@@ -0,0 +1,149 @@
+import math
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from distances import route_length
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import SolveResult, improving
+from routing_backend import DEFAULT_PRECISION
+from tsp import routing_search
+from tsp_local_search import hilbert_index, space_filling_curve_tour, solve as local_search_solve
+
+# Largest number of cities of a cell, each cell is a routing problem of at most a thousand cities
+CELL_NODES = 1000
+
+# Routing search time (in seconds) of every cell when no overall time limit is given
+CELL_TIME_SECONDS = 2
+
+# Share of the time spent improving the joined tour, mostly across the cell borders
+SEAM_SHARE = 0.2
+
+
+def bisect(points, cities, cell_nodes=CELL_NODES):
+    """
+        Split the cities into balanced cells by recursive bisection (Karp): every split cuts the
+        longer side of the bounding box at the median
+    :param points: The (n, 2) coordinate array
+    :param cities: The cities to split
+    :param cell_nodes: The largest number of cities of a cell
+    :return: The cities of every cell
+    """
+    if len(cities) <= cell_nodes:
+        return [cities]
+    axis = int(np.ptp(points[cities], axis=0).argmax())
+    order = cities[np.argsort(points[cities, axis], kind='stable')]
+    half = len(order) // 2
+    return bisect(points, order[:half], cell_nodes) + bisect(points, order[half:], cell_nodes)
+
+
+def solve_cell(points, time_limit, precision):
+    """
+        Solve the sub-tour of one cell in a worker process
+    :return: The sub-tour, in cell city indices
+    """
+    if len(points) > 3:
+        route = routing_search({'points': points}, time_limit, precision)
+        if route is not None:
+            return route
+    # The search found nothing in its budget, the curve order is a fair sub-tour
+    return space_filling_curve_tour(points)
+
+
+def open_cycle(points, cycle, previous, following):
+    """
+        Turn a closed sub-tour into a path by removing the edge that makes the cheapest connection
+        from the previous cell's end to the following cell
+    :param points: The (n, 2) coordinate array
+    :param cycle: The sub-tour, in city indices
+    :param previous: The coordinates the path is entered from
+    :param following: The coordinates the path heads to
+    :return: The path
+    """
+    cycle = np.asarray(cycle)
+    heads = points[cycle]
+    tails = np.roll(heads, -1, axis=0)
+    removed = np.hypot(*(heads - tails).T)
+    # Removing the edge from the j-th to the next city, the path runs forward from the next city
+    # to the j-th one, or backward from the j-th city to the next one
+    forward = np.hypot(*(tails - previous).T) + np.hypot(*(heads - following).T) - removed
+    backward = np.hypot(*(heads - previous).T) + np.hypot(*(tails - following).T) - removed
+    if forward.min() <= backward.min():
+        j = int(forward.argmin())
+        return np.roll(cycle, -(j + 1))
+    j = int(backward.argmin())
+    return np.roll(cycle, -(j + 1))[::-1]
+
+
+def stitch(points, cells, cycles):
+    """
+        Join the sub-tours of the cells, visited in Hilbert curve order of their centroids, into one tour
+    :param points: The (n, 2) coordinate array
+    :param cells: The cities of every cell
+    :param cycles: The sub-tour of every cell, in city indices
+    :return: The tour
+    """
+    centroids = np.array([points[cell].mean(axis=0) for cell in cells])
+    order = np.argsort(hilbert_index(centroids), kind='stable').tolist()
+    previous = centroids[order[-1]]
+    paths = list()
+    for position, cell in enumerate(order):
+        following = centroids[order[(position + 1) % len(order)]]
+        path = open_cycle(points, cycles[cell], previous, following)
+        paths.append(path)
+        previous = points[path[-1]]
+    return np.concatenate(paths).tolist()
+
+
+def solve(input_data, time_limit=None, precision=DEFAULT_PRECISION, workers=None, cell_nodes=CELL_NODES,
+          on_solution=None, instrumentation=None):
+    """
+        Solve a very large TSP by partition and stitch: split the plane into balanced cells, solve the
+        sub-tour of every cell with the routing solver in a process pool, join the sub-tours into one
+        tour and improve it with the candidate-list local search
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param time_limit: The time limit (in seconds), None to give every cell CELL_TIME_SECONDS so that
+                       the wall time falls with the number of workers
+    :param precision: The scale factor of the integer distances
+    :param workers: The number of worker processes, None for the number of cores
+    :param cell_nodes: The largest number of cities of a cell
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    workers = workers or os.cpu_count()
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'tsp')
+    points = np.asarray(instance['points'], dtype=np.float64)
+
+    with instrumentation.phase('build'):
+        cells = bisect(points, np.arange(len(points)), cell_nodes)
+
+    # Cells beyond the pool size wait for a free worker, so every wave gets its share of the budget
+    waves = math.ceil(len(cells) / workers)
+    cell_time = CELL_TIME_SECONDS if time_limit is None else time_limit * (1 - SEAM_SHARE) / waves
+    with instrumentation.phase('solve'):
+        with ProcessPoolExecutor(max_workers=min(workers, len(cells))) as pool:
+            futures = [pool.submit(solve_cell, points[cell], cell_time, precision) for cell in cells]
+            cycles = [cell[future.result()] for cell, future in zip(cells, futures)]
+
+    # The improvement takes its share of the time actually spent, so the wall time keeps falling with
+    # the number of workers when no time limit is given
+    seam_time = (time_limit - instrumentation.elapsed() if time_limit is not None
+                 else instrumentation.elapsed() * SEAM_SHARE / (1 - SEAM_SHARE))
+    with instrumentation.phase('repair'):
+        route = stitch(points, cells, cycles)
+        on_solution(route_length(points, route))
+        # The local search repairs the joins and whatever the short cell searches left, then kicks
+        route = local_search_solve(points, max(seam_time, 0), initial=route, on_solution=on_solution)
+
+    with instrumentation.phase('output'):
+        total_distance = route_length(points, route)
+        output_data = "{:.2f} {}\n".format(total_distance, 0)
+        output_data += ' '.join(map(str, route))
+    statistics = instrumentation.statistics()
+    statistics['cells'] = len(cells)
+    return SolveResult('tsp', total_distance, 0, route, output_data, {'points': points}, statistics)
@@ -0,0 +1,210 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+# Largest number of points drawn, larger instances are drawn from an evenly spaced subsample
+MAX_DRAWN_POINTS = 5000
+
+# Largest number of graph edges or assignment lines drawn
+MAX_DRAWN_EDGES = 5000
+
+# Largest number of knapsack items drawn as individual bars
+MAX_DRAWN_ITEMS = 200
+
+# Graphs with more nodes than this are laid out on a circle grouped by color instead of a spring layout
+SPRING_LAYOUT_NODES = 300
+
+
+def subsample(count, limit):
+    """
+        Evenly spaced indices of at most limit elements out of count
+    """
+    if count <= limit:
+        return np.arange(count)
+    return np.linspace(0, count - 1, limit).astype(np.int64)
+
+
+def draw_knapsack(ax, instance, solution):
+    """
+        Draw the item values and weights as bars, marking the taken items
+    :param ax: The matplotlib axes
+    :param instance: The 'values' and 'weights' of the items
+    :param solution: The taken flag of every item
+    """
+    values, weights = np.asarray(instance['values']), np.asarray(instance['weights'])
+    shown = subsample(len(values), MAX_DRAWN_ITEMS)
+    taken = np.asarray(solution)[shown] == 1
+    positions = np.arange(len(shown))
+    ax.bar(positions, values[shown], color='blue', alpha=0.5, label='Value')
+    ax.bar(positions, weights[shown], color='green', alpha=0.5, label='Weight')
+    ax.scatter(positions[taken], values[shown][taken], color='red', marker='x', label='Taken')
+    ax.set_xlabel('Item' if len(shown) == len(values) else f'Item ({len(shown)} of {len(values)} shown)')
+    ax.set_ylabel('Value / Weight')
+    ax.set_title('Knapsack Visualization')
+    if len(shown) <= 50:
+        ax.set_xticks(positions)
+        ax.set_xticklabels([f'Item {i + 1}' for i in shown], rotation=90)
+    ax.legend()
+
+
+def graph_layout(node_count, edges, coloring):
+    """
+        Place the nodes with a spring layout for small graphs, and on a circle grouped by color otherwise
+    :return: The (n, 2) node coordinates
+    """
+    if node_count <= SPRING_LAYOUT_NODES:
+        import networkx as nx
+        nx_graph = nx.Graph()
+        nx_graph.add_nodes_from(range(node_count))
+        nx_graph.add_edges_from(edges.tolist())
+        layout = nx.spring_layout(nx_graph, seed=0)
+        return np.array([layout[node] for node in range(node_count)])
+    order = np.argsort(coloring, kind='stable')
+    angles = np.empty(node_count)
+    angles[order] = np.linspace(0, 2 * np.pi, node_count, endpoint=False)
+    return np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+
+def draw_coloring(ax, instance, solution):
+    """
+        Draw the colored graph, with a subsample of the edges for large graphs
+    :param ax: The matplotlib axes
+    :param instance: The 'node_count' and the (e, 2) 'edges' of the graph
+    :param solution: The color of every node
+    """
+    from matplotlib.collections import LineCollection
+    coloring = np.asarray(solution)
+    edges = np.asarray(instance['edges'], dtype=np.int64).reshape(-1, 2)
+    positions = graph_layout(instance['node_count'], edges, coloring)
+    drawn = edges[subsample(len(edges), MAX_DRAWN_EDGES)]
+    ax.add_collection(LineCollection(positions[drawn], colors='gray', linewidths=0.5, alpha=0.5))
+    ax.scatter(positions[:, 0], positions[:, 1], c=coloring, cmap='rainbow', s=20 if len(coloring) > 100 else 80,
+               zorder=2)
+    if len(coloring) <= 100:
+        for node, (x, y) in enumerate(positions):
+            ax.annotate(str(node), (x, y), ha='center', va='center', fontsize=7, zorder=3)
+    ax.set_title(f'Graph Coloring Solution ({coloring.max() + 1} colors)')
+    ax.set_axis_off()
+
+
+def draw_tsp(ax, instance, solution):
+    """
+        Draw the tour as a single closed polyline
+    :param ax: The matplotlib axes
+    :param instance: The 'points' of the cities
+    :param solution: The tour
+    """
+    points = np.asarray(instance['points'], dtype=np.float64)
+    tour = np.append(np.asarray(solution), solution[0])
+    shown = subsample(len(points), MAX_DRAWN_POINTS)
+    ax.plot(points[tour, 0], points[tour, 1], color='red', linewidth=0.5 if len(points) > 1000 else 1)
+    ax.scatter(points[shown, 0], points[shown, 1], color='blue', s=2 if len(points) > 1000 else 10, zorder=2)
+    ax.set_title('TSP Solution Visualization')
+
+
+def draw_vrp(ax, instance, solution):
+    """
+        Draw every vehicle route
+    :param ax: The matplotlib axes
+    :param instance: The 'points' of the depot (first) and customers
+    :param solution: The route of every vehicle
+    """
+    points = np.asarray(instance['points'], dtype=np.float64)
+    shown = subsample(len(points), MAX_DRAWN_POINTS)
+    ax.scatter(points[shown, 0], points[shown, 1], color='blue', s=10, label='Locations')
+    ax.scatter(points[0, 0], points[0, 1], color='red', label='Depot', marker='s', s=100, zorder=3)
+    routes = [route for route in solution if len(route) > 2]
+    for i, route in enumerate(routes):
+        ax.plot(points[route, 0], points[route, 1], marker='o' if len(points) <= 500 else None,
+                label=f'Vehicle {i + 1}' if len(routes) <= 20 else None)
+    ax.set_title('Vehicle Routing Problem Solution')
+    ax.set_xlabel('X-coordinate')
+    ax.set_ylabel('Y-coordinate')
+    ax.legend()
+    ax.grid(True)
+
+
+def draw_facility(ax, instance, solution):
+    """
+        Draw the used and unused facilities and the customer assignment, with a subsample of the
+        customers for large instances
+    :param ax: The matplotlib axes
+    :param instance: The 'facility_points' and 'customer_points'
+    :param solution: The facility of every customer
+    """
+    from matplotlib.collections import LineCollection
+    facility_points = np.asarray(instance['facility_points'], dtype=np.float64)
+    customer_points = np.asarray(instance['customer_points'], dtype=np.float64)
+    assignment = np.asarray(solution)
+    used = np.zeros(len(facility_points), dtype=bool)
+    used[assignment] = True
+    shown = subsample(len(customer_points), MAX_DRAWN_EDGES)
+    lines = np.stack([customer_points[shown], facility_points[assignment[shown]]], axis=1)
+    ax.add_collection(LineCollection(lines, colors='black', linewidths=0.5))
+    ax.plot(facility_points[used, 0], facility_points[used, 1], 'gs', label='Utilized Facilities')
+    ax.plot(facility_points[~used, 0], facility_points[~used, 1], 'rs', label='Unutilized Facilities')
+    ax.plot(customer_points[shown, 0], customer_points[shown, 1], 'bo', markersize=3)
+    ax.set_xlabel('X-coordinate')
+    ax.set_ylabel('Y-coordinate')
+    ax.set_title('Facility Location Problem Solution')
+    ax.legend()
+    ax.grid(True)
+
+
+DRAW_FUNCTIONS = {
+    'knapsack': draw_knapsack,
+    'coloring': draw_coloring,
+    'tsp': draw_tsp,
+    'vrp': draw_vrp,
+    'facility': draw_facility,
+}
+
+
+def render(result, path):
+    """
+        Render a solve result to an image file. The figure is drawn without pyplot, so no window is
+        opened and rendering is safe outside the main thread
+    :param result: The solve result
+    :param path: The image file path, its extension selects the format
+    :return: The path, or None if the result has no solution to draw
+    """
+    if not result.found:
+        return None
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(10, 7))
+    FigureCanvasAgg(figure)
+    DRAW_FUNCTIONS[result.problem](figure.add_subplot(), result.instance, result.solution)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+class Renderer:
+    """
+        Render solve results in a background process, so that drawing never delays the solver. The
+        process is only started by the first submitted result
+    """
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.executor = None
+
+    def submit(self, result, path):
+        """
+            Queue a result for rendering
+        :return: The future of the written path
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor.submit(render, result, path)
+
+    def close(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
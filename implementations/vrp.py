@@ -1,8 +1,9 @@
-
-import matplotlib.pyplot as plt
-
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
+from instances import as_instance
+from instrumentation import Instrumentation
+from routing_backend import DEFAULT_PRECISION, extract_routes, integer_distance_matrix, register_demands, \
+    register_distance_matrix, solve_from_routes
+from results import improving, routes_result
+from solution_cache import cached_solve
 
 MAX_TIME_SECONDS = 7200
 
@@ -14,102 +15,101 @@ class Customer:
         self.y = y
 
 
-def visualize_routes(input_data, solution):
-    """
-        Visualize the graph coloring solution
-    :param input_data: The input data
-    :param solution: The selected solution
-    """
-    lines = input_data.split('\n')
-    parts = lines[0].split()
-    customer_count = int(parts[0])
-    locations = list()
-    for i in range(1, customer_count + 1):
-        line = lines[i]
-        parts = line.split()
-        locations.append((float(parts[1]), float(parts[2])))
-    depot = locations[0]
-
-    # Extract routes from the solution
-    routes = list()
-    for route_str in solution.split('\n'):
-        route = list(map(int, route_str.split()))
-        if len(route) > 2:
-            routes.append([locations[i] for i in route])
-
-    # Plot the routes
-    plt.figure(figsize=(10, 7))
-    plt.scatter(*zip(*locations), color='blue', label='Locations')
-    plt.scatter(*depot, color='red', label='Depot', marker='s', s=100)
-    for i, route in enumerate(routes):
-        route = list(zip(*route))
-        plt.plot(*route, marker='o', label=f'Vehicle {i+1}')
-    plt.title('Vehicle Routing Problem Solution')
-    plt.xlabel('X-coordinate')
-    plt.ylabel('Y-coordinate')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
-
-def create_data_model(locations, vehicle_capacity, vehicle_count):
+def create_data_model(locations, vehicle_capacity, vehicle_count, precision=DEFAULT_PRECISION):
     """
         Extract the route from the solution
     :param locations: The input locations
     :param vehicle_capacity: The vehicle capacity
     :param vehicle_count: The vehicle count
+    :param precision: The scale factor of the integer distances
     """
     data = dict()
-    data['distance_matrix'] = [
-        [
-            length(location1, location2) for location2 in locations
-        ] for location1 in locations
-    ]
+    data['points'] = [(location.x, location.y) for location in locations]
+    data['distance_matrix'] = integer_distance_matrix(data['points'], precision)
     data['num_vehicles'] = vehicle_count
     data['depot'] = 0
     data['demands'] = [location.demand for location in locations]
     data['vehicle_capacities'] = [vehicle_capacity] * vehicle_count
     return data
 
-def length(location1, location2):
-    return ((location1.x - location2.x) ** 2 + (location1.y - location2.y) ** 2) ** 0.5
-
-
-def solve_it(input_data):
+def read_customers(input_data):
+    """
+        Read the customers and the fleet
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :return: The customers, the vehicle capacity and the vehicle count
+    """
+    instance = as_instance(input_data, 'vrp')
+    customers = list()
+    for i, (demand, (x, y)) in enumerate(zip(instance['demands'].tolist(), instance['points'].tolist())):
+        customers.append(Customer(i, demand, x, y))
+    return customers, instance['capacity'], instance['vehicle_count']
 
-    lines = input_data.split('\n')
-    parts = lines[0].split()
-    customer_count = int(parts[0])
-    vehicle_count = int(parts[1])
-    vehicle_capacity = int(parts[2])
 
-    customers = list()
-    for i in range(1, customer_count + 1):
-        line = lines[i]
-        parts = line.split()
-        customers.append(Customer(i - 1, int(parts[0]), float(parts[1]), float(parts[2])))
-    data = create_data_model(customers, vehicle_capacity, vehicle_count)
+def build_routing_model(input_data, precision=DEFAULT_PRECISION):
+    """
+        Build the capacitated routing model of the VRP
+    :param input_data: The input data
+    :param precision: The scale factor of the integer distances
+    :return: The data model, the routing index manager and the routing model
+    """
+    from ortools.constraint_solver import pywrapcp
+    customers, vehicle_capacity, vehicle_count = read_customers(input_data)
+    data = create_data_model(customers, vehicle_capacity, vehicle_count, precision)
     manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']), data['num_vehicles'], data['depot'])
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    # Distances and demands are registered as native integer tables, not Python callbacks
+    register_distance_matrix(routing, data['distance_matrix'])
 
-    def demand_callback(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return data['demands'][from_node]
-
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+    demand_callback_index = register_demands(routing, data['demands'])
     routing.AddDimensionWithVehicleCapacity(
         demand_callback_index,
         0,  # null capacity slack
         data['vehicle_capacities'],  # vehicle maximum capacities
         True,  # start cumul to zero
         'Capacity')
+    return data, manager, routing
+
+
+def solve(input_data, precision=DEFAULT_PRECISION, time_limit=MAX_TIME_SECONDS, workers=1, on_solution=None,
+          instrumentation=None, cache=None, initial=None):
+    """
+        Solve the VRP
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param precision: The scale factor of the integer distances
+    :param time_limit: The time limit (in seconds)
+    :param workers: The number of parallel routing searches, each with its own strategy (None for all cores)
+    :param on_solution: The callback receiving the objective (the integer routing cost divided by the
+                        precision) of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :param cache: The solution cache answering repeated solves and warm-starting the search
+    :param initial: Known routes to start the search from (the parallel portfolio ignores them)
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+
+    # Parse once, the routing model builder accepts the parsed instance
+    with instrumentation.phase('parse'):
+        input_data = as_instance(input_data, 'vrp')
+    if cache is not None:
+        config = {'precision': precision, 'workers': workers}
+        return cached_solve(cache, 'vrp', input_data, config, time_limit, on_solution, lambda initial: solve(
+            input_data, precision, time_limit, workers, on_solution, instrumentation, initial=initial))
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+    if workers != 1:
+        from routing_portfolio import portfolio_search
+        customers, _, _ = read_customers(input_data)
+        # The workers build their own models, so the whole portfolio counts as the solve phase
+        with instrumentation.phase('solve'):
+            routes = portfolio_search(build_routing_model, (input_data, precision), time_limit, workers,
+                                      on_solution=lambda cost, _: on_solution(cost / precision))
+        return routes_result([(customer.x, customer.y) for customer in customers], routes, instrumentation)
+
+    from ortools.constraint_solver import pywrapcp
+    from ortools.constraint_solver import routing_enums_pb2
+    with instrumentation.phase('build'):
+        data, manager, routing = build_routing_model(input_data, precision)
+    routing.AddAtSolutionCallback(lambda: on_solution(routing.CostVar().Value() / precision))
 
     # Adjust solver parameters
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
@@ -117,42 +117,27 @@ def solve_it(input_data):
         routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    search_parameters.time_limit.seconds = MAX_TIME_SECONDS
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
 
     # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
-
-    if solution:
-        # Calculate the total distance traveled by all vehicles
-        total_distance = 0
-        for vehicle_id in range(data['num_vehicles']):
-            index = routing.Start(vehicle_id)
-            vehicle_route_distance = 0
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-                next_index = solution.Value(routing.NextVar(index))
-                vehicle_route_distance += distance_callback(index, next_index)
-                index = next_index
-            total_distance += vehicle_route_distance
-
-        output_data = "{:.2f} {}\n".format(total_distance, 0)
-        visualization_input = ''
-        for vehicle_id in range(data['num_vehicles']):
-            index = routing.Start(vehicle_id)
-            route = list()
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-                route.append(node_index)
-                index = solution.Value(routing.NextVar(index))
-            route.append(manager.IndexToNode(index))
-            output_data += " ".join(map(str, route)) + "\n"
-            visualization_input += " ".join(map(str, route)) + "\n"
-
-        visualize_routes(input_data, visualization_input)
-
-        return output_data
-    else:
-        return 'No solution found within the time limit.'
+    with instrumentation.phase('solve'):
+        solution = solve_from_routes(routing, manager, search_parameters, initial, data['depot'])
+
+    with instrumentation.phase('extract'):
+        routes = extract_routes(solution, manager, routing, data['num_vehicles']) if solution else None
+    return routes_result(data['points'], routes, instrumentation)
+
+
+def solve_it(input_data, precision=DEFAULT_PRECISION, time_limit=MAX_TIME_SECONDS, workers=1):
+    """
+        Solve the VRP
+    :param input_data: The input data
+    :param precision: The scale factor of the integer distances
+    :param time_limit: The time limit (in seconds)
+    :param workers: The number of parallel routing searches (None for all cores)
+    :return: The formatted solution
+    """
+    return solve(input_data, precision, time_limit, workers).output
 
 
 if __name__ == '__main__':
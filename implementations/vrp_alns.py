@@ -0,0 +1,424 @@
+import math
+import random
+import time
+import numpy as np
+
+from distances import distance_matrix
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import improving, routes_result
+from stopping import expired
+from tour import make_tour
+
+# Time budget (in seconds) of the search
+ALNS_TIME_SECONDS = 60
+
+# Number of customers removed by a destroy operator: at least DESTROY_MIN, at most DESTROY_SHARE of the
+# customers and DESTROY_MAX
+DESTROY_MIN = 4
+DESTROY_SHARE = 0.2
+DESTROY_MAX = 40
+
+# Operator scores of a new best solution, an improvement of the current one and an accepted worse one
+BEST_SCORE = 33
+IMPROVED_SCORE = 9
+ACCEPTED_SCORE = 13
+
+# Iterations between operator weight updates, and the share of the old weight replaced at every update
+SEGMENT_LENGTH = 100
+REACTION = 0.1
+
+# The starting temperature accepts a solution this much worse than the initial one half of the time,
+# and it cools down exponentially to this fraction of itself at the deadline
+START_WORSENING = 0.05
+FINAL_TEMPERATURE = 1e-3
+
+# Randomization of the worst and Shaw removals, higher values pick the top ranked customers more often
+WORST_RANDOMNESS = 3
+SHAW_RANDOMNESS = 6
+
+# Smallest improvement counted as better
+EPSILON = 1e-7
+
+
+class Problem:
+    """
+        A capacitated VRP instance with its dense distance matrix; node 0 is the depot
+    """
+    def __init__(self, instance):
+        self.points = np.asarray(instance['points'], dtype=np.float64)
+        self.demands = np.asarray(instance['demands'], dtype=np.float64)
+        self.capacity = instance['capacity']
+        self.vehicle_count = instance['vehicle_count']
+        self.node_count = len(self.points)
+        self.distances = distance_matrix(self.points, dtype=np.float64, layout='dense').to_dense()
+        # An unrouted customer costs more than any insertion, so that complete solutions always win
+        self.penalty = 2 * float(self.distances.max()) + 1
+        self.max_distance = max(float(self.distances.max()), EPSILON)
+        self.max_demand = max(float(self.demands.max()), EPSILON)
+
+
+class Solution:
+    """
+        Routes as customer arrays (without the depot) with their loads and costs in arrays, updated by
+        every removal and insertion in O(route length)
+    """
+    def __init__(self, problem, routes):
+        self.problem = problem
+        self.routes = [np.asarray(route, dtype=np.int64) for route in routes]
+        self.routes += [np.empty(0, dtype=np.int64) for _ in range(problem.vehicle_count - len(self.routes))]
+        self.loads = np.array([problem.demands[route].sum() for route in self.routes])
+        self.costs = np.array([self.route_cost(route) for route in self.routes])
+        self.route_of = np.full(problem.node_count, -1)
+        for vehicle, route in enumerate(self.routes):
+            self.route_of[route] = vehicle
+        self.unrouted = set(np.flatnonzero(self.route_of[1:] < 0) + 1)
+
+    def route_cost(self, route):
+        path = np.concatenate(([0], route, [0]))
+        return float(self.problem.distances[path[:-1], path[1:]].sum())
+
+    @property
+    def cost(self):
+        return float(self.costs.sum())
+
+    @property
+    def objective(self):
+        return self.cost + self.problem.penalty * len(self.unrouted)
+
+    def copy(self):
+        # Route arrays are replaced, never modified in place, so they can be shared
+        solution = Solution.__new__(Solution)
+        solution.problem = self.problem
+        solution.routes = list(self.routes)
+        solution.loads = self.loads.copy()
+        solution.costs = self.costs.copy()
+        solution.route_of = self.route_of.copy()
+        solution.unrouted = set(self.unrouted)
+        return solution
+
+    def remove(self, customers):
+        customers = np.asarray(customers, dtype=np.int64)
+        for vehicle in np.unique(self.route_of[customers]).tolist():
+            route = self.routes[vehicle]
+            self.routes[vehicle] = route[~np.isin(route, customers)]
+            self.loads[vehicle] = self.problem.demands[self.routes[vehicle]].sum()
+            self.costs[vehicle] = self.route_cost(self.routes[vehicle])
+        self.route_of[customers] = -1
+        self.unrouted.update(customers.tolist())
+
+    def insert(self, customer, vehicle, position, delta):
+        self.routes[vehicle] = np.insert(self.routes[vehicle], position, customer)
+        self.loads[vehicle] += self.problem.demands[customer]
+        self.costs[vehicle] += delta
+        self.route_of[customer] = vehicle
+        self.unrouted.discard(customer)
+
+    def insertion_costs(self, vehicle, customers):
+        """
+            The cheapest insertion of every customer into a route
+        :return: The cost increases and their positions
+        """
+        distances = self.problem.distances
+        path = np.concatenate(([0], self.routes[vehicle], [0]))
+        before, after = path[:-1], path[1:]
+        deltas = (distances[np.ix_(before, customers)] + distances[np.ix_(after, customers)]
+                  - distances[before, after][:, None])
+        positions = deltas.argmin(axis=0)
+        return deltas[positions, np.arange(len(customers))], positions
+
+    def removal_savings(self):
+        """
+            The distance saved by removing every routed customer on its own
+        :return: The customers and their savings
+        """
+        distances = self.problem.distances
+        customers, savings = list(), list()
+        for route in self.routes:
+            if len(route):
+                path = np.concatenate(([0], route, [0]))
+                customers.append(route)
+                savings.append(distances[path[:-2], path[1:-1]] + distances[path[1:-1], path[2:]]
+                               - distances[path[:-2], path[2:]])
+        if not customers:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(customers), np.concatenate(savings)
+
+    def improve_route(self, vehicle):
+        """
+            Apply improving 2-opt moves to a route, as the closed tour starting at the depot, until none is
+            left
+        """
+        route = self.routes[vehicle]
+        if len(route) < 3:
+            return
+        distances = self.problem.distances
+        tour = make_tour([0] + route.tolist(), lambda a, b: float(distances[a, b]))
+        while two_opt_pass(tour):
+            pass
+        self.routes[vehicle] = np.array(tour.cities(0)[1:], dtype=np.int64)
+        self.costs[vehicle] = tour.length
+
+    def output_routes(self):
+        return [[0] + route.tolist() + [0] for route in self.routes]
+
+
+def two_opt_pass(tour):
+    """
+        Apply the first improving 2-opt move of a tour
+    :return: Whether a move was applied
+    """
+    cities = tour.cities()
+    for i in range(len(cities) - 2):
+        a, b = cities[i], cities[i + 1]
+        for j in range(i + 2, len(cities) - (i == 0)):
+            c, d = cities[j], cities[(j + 1) % len(cities)]
+            if tour.two_opt_delta(a, b, c, d) < -EPSILON:
+                tour.two_opt_move(a, b, c, d)
+                return True
+    return False
+
+
+def savings_construction(problem):
+    """
+        Build routes with the Clarke-Wright parallel savings heuristic
+    :return: The routes, possibly more than the vehicles
+    """
+    distances = problem.distances
+    first, second = np.triu_indices(problem.node_count - 1, k=1)
+    first, second = first + 1, second + 1
+    savings = distances[0, first] + distances[0, second] - distances[first, second]
+    order = np.argsort(-savings, kind='stable')
+
+    routes = {customer: [customer] for customer in range(1, problem.node_count)}
+    route_of = list(range(problem.node_count))
+    loads = problem.demands.tolist()
+    for i, j, saving in zip(first[order].tolist(), second[order].tolist(), savings[order].tolist()):
+        if saving <= 0:
+            break
+        a, b = route_of[i], route_of[j]
+        if a == b or loads[a] + loads[b] > problem.capacity:
+            continue
+        head, tail = routes[a], routes[b]
+        # The customers must be at the ends of their routes to be joined
+        if head[-1] == i and tail[0] == j:
+            merged = head + tail
+        elif head[0] == i and tail[-1] == j:
+            merged = tail + head
+        elif head[-1] == i and tail[-1] == j:
+            merged = head + tail[::-1]
+        elif head[0] == i and tail[0] == j:
+            merged = head[::-1] + tail
+        else:
+            continue
+        routes[a] = merged
+        loads[a] += loads[b]
+        for customer in tail:
+            route_of[customer] = a
+        del routes[b]
+    return list(routes.values())
+
+
+def random_removal(solution, count, rng):
+    routed = np.flatnonzero(solution.route_of >= 0)
+    return rng.sample(routed.tolist(), min(count, len(routed)))
+
+
+def worst_removal(solution, count, rng):
+    """
+        Remove the customers saving the most distance, ranked with some randomization
+    """
+    customers, savings = solution.removal_savings()
+    ranked = customers[np.argsort(-savings, kind='stable')].tolist()
+    removed = list()
+    while ranked and len(removed) < count:
+        removed.append(ranked.pop(int(len(ranked) * rng.random() ** WORST_RANDOMNESS)))
+    return removed
+
+
+def shaw_removal(solution, count, rng):
+    """
+        Remove related customers (close, with similar demands, on the same route), starting from a
+        random one
+    """
+    problem = solution.problem
+    routed = np.flatnonzero(solution.route_of >= 0)
+    if not len(routed):
+        return list()
+    removed = [int(routed[rng.randrange(len(routed))])]
+    remaining = routed[routed != removed[0]]
+    while len(remaining) and len(removed) < count:
+        reference = removed[rng.randrange(len(removed))]
+        relatedness = (problem.distances[reference, remaining] / problem.max_distance
+                       + np.abs(problem.demands[remaining] - problem.demands[reference]) / problem.max_demand
+                       + (solution.route_of[remaining] != solution.route_of[reference]))
+        ranked = np.argsort(relatedness, kind='stable')
+        chosen = ranked[int(len(ranked) * rng.random() ** SHAW_RANDOMNESS)]
+        removed.append(int(remaining[chosen]))
+        remaining = np.delete(remaining, chosen)
+    return removed
+
+
+def insert_customers(solution, customers, rng, regret=False):
+    """
+        Insert customers where they are cheapest, greedily or by largest regret (the cost difference
+        between their best and second best route). The insertion costs of every customer into every
+        route are kept in a matrix and only the column of the changed route is updated after each
+        insertion. Customers no route has room for stay unrouted.
+    """
+    problem = solution.problem
+    pending = np.array(customers, dtype=np.int64)
+    rng.shuffle(pending)
+    vehicle_count = len(solution.routes)
+    costs = np.empty((len(pending), vehicle_count))
+    positions = np.empty((len(pending), vehicle_count), dtype=np.int64)
+    for vehicle in range(vehicle_count):
+        costs[:, vehicle], positions[:, vehicle] = solution.insertion_costs(vehicle, pending)
+    demands = problem.demands[pending]
+    alive = np.ones(len(pending), dtype=bool)
+    rows = np.arange(len(pending))
+    while alive.any():
+        feasible = (solution.loads[None, :] + demands[:, None] <= problem.capacity) & alive[:, None]
+        masked = np.where(feasible, costs, np.inf)
+        best_vehicle = masked.argmin(axis=1)
+        best = masked[rows, best_vehicle]
+        candidates = np.isfinite(best)
+        if not candidates.any():
+            break
+        if regret and vehicle_count > 1:
+            two_best = np.partition(masked, 1, axis=1)[:, :2]
+            # A customer with a single feasible route has an infinite regret and goes first
+            with np.errstate(invalid='ignore'):
+                regrets = two_best[:, 1] - two_best[:, 0]
+            chosen = int(np.where(candidates, regrets, -np.inf).argmax())
+        else:
+            chosen = int(np.where(candidates, best, np.inf).argmin())
+        vehicle = int(best_vehicle[chosen])
+        solution.insert(int(pending[chosen]), vehicle, int(positions[chosen, vehicle]), float(best[chosen]))
+        alive[chosen] = False
+        costs[:, vehicle], positions[:, vehicle] = solution.insertion_costs(vehicle, pending)
+
+
+def greedy_insertion(solution, customers, rng):
+    insert_customers(solution, customers, rng)
+
+
+def regret_insertion(solution, customers, rng):
+    insert_customers(solution, customers, rng, regret=True)
+
+
+DESTROY_OPERATORS = [random_removal, worst_removal, shaw_removal]
+REPAIR_OPERATORS = [greedy_insertion, regret_insertion]
+
+
+def initial_solution(problem, rng):
+    """
+        The savings routes, the largest ones on the fleet and the customers of the others inserted by
+        regret, every route improved by 2-opt
+    """
+    routes = sorted(savings_construction(problem), key=lambda route: -problem.demands[route].sum())
+    solution = Solution(problem, routes[:problem.vehicle_count])
+    if solution.unrouted:
+        regret_insertion(solution, sorted(solution.unrouted), rng)
+    for vehicle in range(problem.vehicle_count):
+        solution.improve_route(vehicle)
+    return solution
+
+
+def roulette(weights, rng):
+    return rng.choices(range(len(weights)), weights=weights)[0]
+
+
+def alns(problem, time_limit, seed=0, on_solution=None):
+    """
+        Improve the savings solution with adaptive large neighborhood search: every iteration destroys
+        part of the current solution and repairs it with operators drawn by their adaptive weights, and
+        the result is accepted by simulated annealing
+    :param problem: The problem
+    :param time_limit: The time budget (in seconds)
+    :param seed: The random seed
+    :param on_solution: The callback receiving the cost of every new best complete solution
+    :return: The best solution
+    """
+    start = time.time()
+    deadline = start + time_limit
+    rng = random.Random(seed)
+    current = initial_solution(problem, rng)
+    best = current.copy()
+    if on_solution and not best.unrouted:
+        on_solution(best.cost)
+
+    customer_count = problem.node_count - 1
+    smallest = min(DESTROY_MIN, customer_count)
+    largest = max(smallest, min(DESTROY_MAX, int(DESTROY_SHARE * customer_count)))
+    weights = [[1.0] * len(DESTROY_OPERATORS), [1.0] * len(REPAIR_OPERATORS)]
+    scores = [[0.0] * len(DESTROY_OPERATORS), [0.0] * len(REPAIR_OPERATORS)]
+    uses = [[0] * len(DESTROY_OPERATORS), [0] * len(REPAIR_OPERATORS)]
+    start_temperature = START_WORSENING * current.cost / math.log(2)
+    iteration = 0
+    while customer_count and not expired(deadline):
+        iteration += 1
+        destroy = roulette(weights[0], rng)
+        repair = roulette(weights[1], rng)
+        candidate = current.copy()
+        candidate.remove(DESTROY_OPERATORS[destroy](candidate, rng.randint(smallest, largest), rng))
+        REPAIR_OPERATORS[repair](candidate, sorted(candidate.unrouted), rng)
+        if candidate.objective < current.objective - EPSILON:
+            # Polish an improving candidate; route arrays are replaced when changed, so only the routes the
+            # operators touched are improved
+            for vehicle in range(problem.vehicle_count):
+                if candidate.routes[vehicle] is not current.routes[vehicle]:
+                    candidate.improve_route(vehicle)
+
+        score = 0
+        temperature = start_temperature * FINAL_TEMPERATURE ** ((time.time() - start) / time_limit)
+        if candidate.objective < best.objective - EPSILON:
+            best = candidate.copy()
+            current = candidate
+            score = BEST_SCORE
+            if on_solution and not best.unrouted:
+                on_solution(best.cost)
+        elif candidate.objective < current.objective - EPSILON:
+            current = candidate
+            score = IMPROVED_SCORE
+        elif rng.random() < math.exp(-(candidate.objective - current.objective) / max(temperature, EPSILON)):
+            current = candidate
+            score = ACCEPTED_SCORE
+        for kind, operator in ((0, destroy), (1, repair)):
+            scores[kind][operator] += score
+            uses[kind][operator] += 1
+
+        if iteration % SEGMENT_LENGTH == 0:
+            for kind in (0, 1):
+                for operator in range(len(weights[kind])):
+                    if uses[kind][operator]:
+                        weights[kind][operator] = ((1 - REACTION) * weights[kind][operator]
+                                                   + REACTION * scores[kind][operator] / uses[kind][operator])
+                    # Keep every operator in play
+                    weights[kind][operator] = max(weights[kind][operator], 0.1)
+                    scores[kind][operator] = 0.0
+                    uses[kind][operator] = 0
+    return best
+
+
+def solve(input_data, time_limit=ALNS_TIME_SECONDS, seed=0, on_solution=None, instrumentation=None):
+    """
+        Solve the VRP with the native savings and adaptive large neighborhood search engine
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param time_limit: The time limit (in seconds)
+    :param seed: The random seed
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'vrp')
+    with instrumentation.phase('build'):
+        problem = Problem(instance)
+    with instrumentation.phase('solve'):
+        best = alns(problem, time_limit - instrumentation.elapsed(), seed, on_solution)
+    # A solution leaving customers unrouted is not a solution of the instance
+    routes = None if best.unrouted else best.output_routes()
+    return routes_result(problem.points, routes, instrumentation)
@@ -0,0 +1,200 @@
+import math
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from instances import as_instance
+from instrumentation import Instrumentation
+from results import improving
+from routing_backend import DEFAULT_PRECISION, unscaled_cost
+from vrp import MAX_TIME_SECONDS, solve as routing_solve
+from vrp_incremental import IncrementalVRP
+
+# Vehicles per group, each group is a routing problem of a few dozen customers
+VEHICLES_PER_GROUP = 4
+
+# Share of the time budget spent improving the merged routes across group borders
+IMPROVEMENT_SHARE = 0.2
+
+# Iterations of the capacitated k-means clustering
+KMEANS_ITERATIONS = 20
+
+
+def sweep_order(points):
+    """
+        Order the customers by polar angle around the depot, starting after the widest angular gap so
+        that no group straddles a dense sector
+    :param points: The coordinates, the depot first
+    :return: The customer indices (without the depot) in sweep order
+    """
+    delta = points[1:] - points[0]
+    angles = np.arctan2(delta[:, 1], delta[:, 0])
+    order = np.argsort(angles, kind='stable')
+    sorted_angles = angles[order]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+    start = (int(gaps.argmax()) + 1) % len(order)
+    return np.roll(order, -start) + 1
+
+
+def allocate_vehicles(loads, capacity, vehicle_count):
+    """
+        Share the fleet among groups: every group gets the vehicles its demand needs, the spare ones go
+        to the most loaded groups
+    :param loads: The demand of every group
+    :param capacity: The vehicle capacity
+    :param vehicle_count: The fleet size
+    :return: The vehicles of every group, None if the groups need more vehicles than the fleet
+    """
+    vehicles = [max(1, math.ceil(load / capacity)) for load in loads]
+    spare = vehicle_count - sum(vehicles)
+    if spare < 0:
+        return None
+    for _ in range(spare):
+        group = max(range(len(loads)), key=lambda group: loads[group] / vehicles[group])
+        vehicles[group] += 1
+    return vehicles
+
+
+def sweep_groups(points, demands, capacity, group_count):
+    """
+        Cut the sweep order into groups of balanced demand
+    :param points: The coordinates, the depot first
+    :param demands: The demands, the depot first
+    :param capacity: The vehicle capacity
+    :param group_count: The number of groups
+    :return: The customers of every group
+    """
+    order = sweep_order(points)
+    cumulative = np.cumsum(demands[order])
+    targets = cumulative[-1] * np.arange(1, group_count) / group_count
+    cuts = np.searchsorted(cumulative, targets, side='right')
+    return [group for group in np.split(order, cuts) if len(group)]
+
+
+def kmeans_groups(points, demands, capacities, groups, iterations=KMEANS_ITERATIONS):
+    """
+        Refine groups with capacitated k-means: customers are assigned, closest pairs first, to the
+        nearest centroid whose group still has room, then the centroids move to their customers
+    :param points: The coordinates, the depot first
+    :param demands: The demands, the depot first
+    :param capacities: The capacity (vehicles times vehicle capacity) of every group
+    :param groups: The initial groups, e.g. from the sweep
+    :param iterations: The maximum number of iterations
+    :return: The customers of every group
+    """
+    customers = np.arange(1, len(points))
+    centroids = np.array([points[group].mean(axis=0) for group in groups])
+    labels = None
+    for _ in range(iterations):
+        distances = np.hypot(*(points[customers, None, :] - centroids[None, :, :]).transpose(2, 0, 1))
+        new_labels = np.full(len(customers), -1)
+        room = np.array(capacities, dtype=np.float64)
+        for flat in np.argsort(distances, axis=None, kind='stable').tolist():
+            customer, group = divmod(flat, len(centroids))
+            if new_labels[customer] < 0 and demands[customers[customer]] <= room[group]:
+                new_labels[customer] = group
+                room[group] -= demands[customers[customer]]
+        # Customers that fit nowhere join the group with the most room, the global repair fixes them
+        for customer in np.flatnonzero(new_labels < 0).tolist():
+            group = int(room.argmax())
+            new_labels[customer] = group
+            room[group] -= demands[customers[customer]]
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for group in range(len(centroids)):
+            members = customers[labels == group]
+            if len(members):
+                centroids[group] = points[members].mean(axis=0)
+    return [customers[labels == group] for group in range(len(centroids))]
+
+
+def partition(points, demands, capacity, vehicle_count, clustering='sweep'):
+    """
+        Split the customers into capacity-balanced groups, each with its share of the fleet
+    :param points: The coordinates, the depot first
+    :param demands: The demands, the depot first
+    :param capacity: The vehicle capacity
+    :param vehicle_count: The fleet size
+    :param clustering: 'sweep' or 'kmeans' (capacitated k-means started from the sweep groups)
+    :return: The customers and the vehicle count of every group
+    """
+    group_count = max(1, vehicle_count // VEHICLES_PER_GROUP)
+    while True:
+        groups = sweep_groups(points, demands, capacity, group_count)
+        vehicles = allocate_vehicles([demands[group].sum() for group in groups], capacity, vehicle_count)
+        if vehicles is not None or group_count == 1:
+            break
+        # Rounding every group up to whole vehicles needs more than the fleet, fewer groups waste less
+        group_count = max(1, group_count // 2)
+    if vehicles is None:
+        vehicles = [vehicle_count]
+    if clustering not in ('sweep', 'kmeans'):
+        raise ValueError(f'Unknown clustering: {clustering}')
+    if clustering == 'kmeans' and len(groups) > 1:
+        groups = kmeans_groups(points, demands, [count * capacity for count in vehicles], groups)
+    return groups, vehicles
+
+
+def solve_group(instance, precision, time_limit):
+    """
+        Solve the routing problem of one group in a worker process
+    :return: The routes of the group, in group node indices, or None if no solution was found
+    """
+    return routing_solve(instance, precision, time_limit).solution
+
+
+def solve(input_data, precision=DEFAULT_PRECISION, time_limit=MAX_TIME_SECONDS, workers=None, clustering='sweep',
+          on_solution=None, instrumentation=None):
+    """
+        Solve a large VRP cluster-first, route-second: split the customers into capacity-balanced
+        groups around the depot, solve every group as its own routing problem in a process pool, merge
+        the routes and improve them across the group borders with a short guided local search
+    :param input_data: The input data, or the instance loaded by instances.load_instance
+    :param precision: The scale factor of the integer distances
+    :param time_limit: The time limit (in seconds)
+    :param workers: The number of worker processes, None for the number of cores
+    :param clustering: 'sweep' or 'kmeans'
+    :param on_solution: The callback receiving the objective of every improving solution
+    :param instrumentation: The instrumentation recording the phase times and the anytime curve
+    :return: The solve result
+    """
+    instrumentation = instrumentation or Instrumentation()
+    workers = workers or os.cpu_count()
+    with instrumentation.phase('parse'):
+        instance = as_instance(input_data, 'vrp')
+    points = np.asarray(instance['points'], dtype=np.float64)
+    demands = np.asarray(instance['demands'], dtype=np.int64)
+    capacity = instance['capacity']
+
+    with instrumentation.phase('build'):
+        groups, vehicles = partition(points, demands, capacity, instance['vehicle_count'], clustering)
+
+    # Groups beyond the pool size wait for a free worker, so every wave gets its share of the budget
+    waves = math.ceil(len(groups) / workers)
+    group_time = time_limit * (1 - IMPROVEMENT_SHARE) / waves
+    with instrumentation.phase('solve'):
+        nodes = [np.concatenate([[0], group]) for group in groups]
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+            futures = [pool.submit(solve_group, {'vehicle_count': count, 'capacity': capacity,
+                                                 'demands': demands[group_nodes], 'points': points[group_nodes]},
+                                   precision, group_time)
+                       for group_nodes, count in zip(nodes, vehicles)]
+            routes = list()
+            complete = True
+            for group_nodes, count, future in zip(nodes, vehicles, futures):
+                group_routes = future.result()
+                if group_routes is None:
+                    # Its customers are left for the repair of the global improvement
+                    routes.extend([[0, 0]] * count)
+                    complete = False
+                else:
+                    routes.extend(group_nodes[route].tolist() for route in group_routes)
+
+    on_solution = improving(instrumentation.solution_callback(on_solution))
+    if complete:
+        on_solution(unscaled_cost(points, routes))
+    problem = IncrementalVRP(instance, precision, routes)
+    result = problem.reoptimize(time_limit * IMPROVEMENT_SHARE, on_solution, instrumentation)
+    result.statistics['groups'] = len(groups)
+    return result
@@ -0,0 +1,221 @@
+import numpy as np
+
+from distances import DenseDistances, pairwise_distances
+from instances import as_instance
+from instrumentation import Instrumentation
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from results import improving, routes_result
+from routing_backend import DEFAULT_PRECISION, extract_routes, integer_distance_matrix, register_demands, \
+    register_distance_matrix, solve_from_routes
+
+# Time budget (in seconds) of a re-optimization, short since it starts from the repaired routes
+REOPTIMIZE_TIME_SECONDS = 5
+
+# Time budget (in seconds) of the first solve, when there are no routes to start from
+INITIAL_TIME_SECONDS = 60
+
+
+class IncrementalVRP:
+    """
+        A VRP instance that changes during the day (customers added or cancelled, demands or fleet size
+        changed) and is re-optimized from its previous routes. Customers keep their instance index as id,
+        added customers get the next ids; the depot is customer 0. Each change only touches the
+        distance rows of the customers it adds, and the routes are repaired (cancelled stops removed,
+        overloaded routes relieved, unrouted customers inserted where they are cheapest) before guided
+        local search starts from them.
+    """
+    def __init__(self, input_data, precision=DEFAULT_PRECISION, routes=None):
+        """
+        :param input_data: The input data, or the instance loaded by instances.load_instance
+        :param precision: The scale factor of the integer distances
+        :param routes: The routes of an earlier solve (with or without the depot), None to solve from scratch
+        """
+        instance = as_instance(input_data, 'vrp')
+        self.precision = precision
+        self.capacity = instance['capacity']
+        self.vehicle_count = instance['vehicle_count']
+        self.size = len(instance['demands'])
+        self.points = np.array(instance['points'], dtype=np.float64)
+        self.demands = np.array(instance['demands'], dtype=np.int64)
+        self.active = np.ones(self.size, dtype=bool)
+        self.matrix = integer_distance_matrix(self.points, precision).to_dense()
+        self.routes = None
+        if routes is not None:
+            self.routes = [[customer for customer in route if customer != 0] for route in routes]
+            self.set_vehicle_count(self.vehicle_count)
+
+    def grow(self, count):
+        """
+            Make room for more customers, doubling the arrays so that additions are amortized
+        """
+        needed = self.size + count
+        if needed <= len(self.demands):
+            return
+        capacity = max(needed, 2 * len(self.demands))
+        points = np.zeros((capacity, 2))
+        points[:self.size] = self.points[:self.size]
+        demands = np.zeros(capacity, dtype=np.int64)
+        demands[:self.size] = self.demands[:self.size]
+        active = np.zeros(capacity, dtype=bool)
+        active[:self.size] = self.active[:self.size]
+        matrix = np.zeros((capacity, capacity), dtype=np.int64)
+        matrix[:self.size, :self.size] = self.matrix[:self.size, :self.size]
+        self.points, self.demands, self.active, self.matrix = points, demands, active, matrix
+
+    def add_customers(self, demands, points):
+        """
+            Add customers, computing only their distance rows and columns
+        :param demands: The demands of the new customers
+        :param points: The (k, 2) coordinates of the new customers
+        :return: The ids of the new customers
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        count = len(points)
+        self.grow(count)
+        ids = list(range(self.size, self.size + count))
+        self.points[ids] = points
+        self.demands[ids] = demands
+        self.active[ids] = True
+        self.size += count
+        rows = pairwise_distances(points, self.points[:self.size], dtype=np.int64, scale=self.precision)
+        self.matrix[ids, :self.size] = rows
+        self.matrix[:self.size, ids] = rows.T
+        return ids
+
+    def add_customer(self, demand, x, y):
+        return self.add_customers([demand], [(x, y)])[0]
+
+    def cancel_customer(self, customer):
+        """
+            Cancel a customer, its stop is removed at the next repair
+        """
+        if customer == 0:
+            raise ValueError('The depot cannot be cancelled')
+        self.active[customer] = False
+
+    def set_demand(self, customer, demand):
+        """
+            Change the demand of a customer, its route is relieved at the next repair if it overflows
+        """
+        self.demands[customer] = demand
+
+    def set_vehicle_count(self, vehicle_count):
+        """
+            Change the fleet size, the customers of removed vehicles are inserted into the others at the
+            next repair
+        """
+        if self.routes is not None:
+            self.routes = self.routes[:vehicle_count] + [[] for _ in range(vehicle_count - len(self.routes))]
+        self.vehicle_count = vehicle_count
+
+    def removal_savings(self, route):
+        """
+            The distance saved by removing every stop of a route
+        """
+        path = np.array([0] + route + [0])
+        return (self.matrix[path[:-2], path[1:-1]] + self.matrix[path[1:-1], path[2:]]
+                - self.matrix[path[:-2], path[2:]])
+
+    def insert(self, customer, loads):
+        """
+            Insert a customer at its cheapest position over the routes with room for its demand
+        :return: Whether a route had room
+        """
+        best = None
+        for vehicle, route in enumerate(self.routes):
+            if loads[vehicle] + self.demands[customer] > self.capacity:
+                continue
+            path = np.array([0] + route + [0])
+            deltas = (self.matrix[path[:-1], customer] + self.matrix[customer, path[1:]]
+                      - self.matrix[path[:-1], path[1:]])
+            position = int(deltas.argmin())
+            if best is None or deltas[position] < best[0]:
+                best = (deltas[position], vehicle, position)
+        if best is None:
+            return False
+        _, vehicle, position = best
+        self.routes[vehicle].insert(position, customer)
+        loads[vehicle] += self.demands[customer]
+        return True
+
+    def repair(self):
+        """
+            Make the previous routes feasible for the changed instance: drop the cancelled stops, remove
+            the stops saving the most distance from overloaded routes, then insert every unrouted
+            customer (added, removed from a route or left over by a smaller fleet) where it is cheapest,
+            largest demand first
+        :return: The customers no route had room for
+        """
+        routed = set()
+        for vehicle, route in enumerate(self.routes):
+            route = [customer for customer in route if self.active[customer]]
+            while route and self.demands[route].sum() > self.capacity:
+                route.pop(int(self.removal_savings(route).argmax()))
+            self.routes[vehicle] = route
+            routed.update(route)
+
+        pending = [customer for customer in np.flatnonzero(self.active[:self.size]).tolist()
+                   if customer != 0 and customer not in routed]
+        loads = [int(self.demands[route].sum()) for route in self.routes]
+        return [customer for customer in sorted(pending, key=lambda customer: -self.demands[customer])
+                if not self.insert(customer, loads)]
+
+    def build_model(self, nodes):
+        """
+            Build the routing model of the active customers from the stored distance rows
+        :param nodes: The customer id of every model node, the depot first
+        :return: The routing index manager and the routing model
+        """
+        manager = pywrapcp.RoutingIndexManager(len(nodes), self.vehicle_count, 0)
+        routing = pywrapcp.RoutingModel(manager)
+        register_distance_matrix(routing, DenseDistances(self.matrix[np.ix_(nodes, nodes)]))
+        routing.AddDimensionWithVehicleCapacity(register_demands(routing, self.demands[nodes]), 0,
+                                                [self.capacity] * self.vehicle_count, True, 'Capacity')
+        return manager, routing
+
+    def reoptimize(self, time_limit=None, on_solution=None, instrumentation=None):
+        """
+            Repair the previous routes and improve them with guided local search
+        :param time_limit: The time limit (in seconds), None for the default (short once there are routes)
+        :param on_solution: The callback receiving the objective of every improving solution
+        :param instrumentation: The instrumentation recording the phase times and the anytime curve
+        :return: The solve result, with routes of customer ids
+        """
+        instrumentation = instrumentation or Instrumentation()
+        on_solution = improving(instrumentation.solution_callback(on_solution))
+        if time_limit is None:
+            time_limit = INITIAL_TIME_SECONDS if self.routes is None else REOPTIMIZE_TIME_SECONDS
+
+        with instrumentation.phase('repair'):
+            unrouted = self.repair() if self.routes is not None else list()
+
+        with instrumentation.phase('build'):
+            nodes = np.flatnonzero(self.active[:self.size])
+            model_node = {customer: node for node, customer in enumerate(nodes.tolist())}
+            manager, routing = self.build_model(nodes)
+        routing.AddAtSolutionCallback(lambda: on_solution(routing.CostVar().Value() / self.precision))
+
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+        search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+        # Routes leaving customers unrouted cannot be read as an assignment, a first solution is built then
+        initial = None
+        if self.routes is not None and not unrouted:
+            initial = [[model_node[customer] for customer in route] for route in self.routes]
+        with instrumentation.phase('solve'):
+            solution = solve_from_routes(routing, manager, search_parameters, initial)
+
+        routes = None
+        if solution:
+            with instrumentation.phase('extract'):
+                routes = [[int(nodes[node]) for node in route]
+                          for route in extract_routes(solution, manager, routing, self.vehicle_count)]
+            self.routes = [route[1:-1] for route in routes]
+        result = routes_result(self.points[:self.size], routes, instrumentation)
+        result.statistics['unrouted_after_repair'] = len(unrouted)
+        return result
@@ -0,0 +1,57 @@
+import io
+import json
+import sys
+
+import batch
+
+KNAPSACK = '4 11\n8 4\n10 5\n15 8\n4 3\n'
+
+# Stand-in knapsack solvers, imported by the forked workers
+HANGING_SOLVER = 'import time\n\n\ndef solve(instance, **options):\n    time.sleep(60)\n'
+CRASHING_SOLVER = 'import os\n\n\ndef solve(instance, **options):\n    os._exit(3)\n'
+
+
+def write_instance(directory, name, data=KNAPSACK):
+    path = directory / name
+    path.write_text(data)
+    return str(path)
+
+
+def use_solver(monkeypatch, directory, name, source):
+    (directory / (name + '.py')).write_text(source)
+    monkeypatch.syspath_prepend(str(directory))
+    monkeypatch.setitem(batch.SOLVER_MODULES, 'knapsack', name)
+    sys.modules.pop(name, None)
+
+
+def test_streams_one_json_line_per_instance(tmp_path):
+    paths = [write_instance(tmp_path, 'ks_4_0'), write_instance(tmp_path, 'ks_4_1'),
+             write_instance(tmp_path, 'notes.txt')]
+    output = io.StringIO()
+    records = batch.run_batch(paths, time_limit=5, workers=2, cache=False, output=output)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert lines == records
+    by_instance = {record['instance']: record for record in records}
+    assert set(by_instance) == {'ks_4_0', 'ks_4_1', 'notes.txt'}
+    for name in ('ks_4_0', 'ks_4_1'):
+        assert (by_instance[name]['status'], by_instance[name]['objective']) == ('solved', 19)
+    # A file that is no instance is reported, it does not stop the batch
+    assert by_instance['notes.txt']['status'] == 'error'
+    assert 'Unknown instance format' in by_instance['notes.txt']['error']
+
+
+def test_overrunning_worker_times_out(tmp_path, monkeypatch):
+    use_solver(monkeypatch, tmp_path, 'hanging_solver', HANGING_SOLVER)
+    path = write_instance(tmp_path, 'ks_4_0')
+    records = batch.run_batch([path], time_limit=0.5, workers=1, grace=0.5, cache=False, output=io.StringIO())
+    assert len(records) == 1
+    assert (records[0]['status'], records[0]['objective'], records[0]['problem']) == ('timeout', None, 'knapsack')
+    assert records[0]['wall_time'] < 10
+
+
+def test_crashed_worker_is_reported(tmp_path, monkeypatch):
+    use_solver(monkeypatch, tmp_path, 'crashing_solver', CRASHING_SOLVER)
+    paths = [write_instance(tmp_path, 'ks_4_0'), write_instance(tmp_path, 'ks_4_1')]
+    records = batch.run_batch(paths, time_limit=5, workers=1, cache=False, output=io.StringIO())
+    assert [(record['instance'], record['status'], record['exit_code']) for record in records] == [
+        ('ks_4_0', 'crashed', 3), ('ks_4_1', 'crashed', 3)]
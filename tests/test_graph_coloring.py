@@ -0,0 +1,54 @@
+import random
+
+import numpy as np
+import pytest
+
+import graph_coloring
+import graph_coloring_tabu
+from instances import parse_coloring
+
+
+def graph_text(node_count, edges):
+    return f'{node_count} {len(edges)}\n' + '\n'.join(f'{a} {b}' for a, b in edges)
+
+
+def random_graph(node_count, density, seed, offset=0):
+    rng = random.Random(seed)
+    return [(offset + a, offset + b) for a in range(node_count) for b in range(a + 1, node_count)
+            if rng.random() < density]
+
+
+def check_coloring(input_data, result):
+    instance = parse_coloring(input_data)
+    colors = np.asarray(result.solution)
+    assert len(colors) == instance['node_count']
+    assert colors.min() >= 0
+    assert result.objective == colors.max() + 1
+    edges = instance['edges']
+    assert not (colors[edges[:, 0]] == colors[edges[:, 1]]).any()
+
+
+# Two dense components and a tail of nodes whose degree falls below the clique size, so the decomposed
+# engine peels nodes and colors several components
+DECOMPOSED = graph_text(63, random_graph(30, 0.5, 1) + random_graph(30, 0.5, 2, offset=30)
+                        + [(60, 0), (61, 60), (62, 61)])
+
+
+@pytest.mark.parametrize('input_data', [graph_text(40, random_graph(40, 0.3, 0)), DECOMPOSED])
+def test_cp_coloring_is_valid(input_data):
+    result = graph_coloring.solve(input_data, time_limit=5, workers=2)
+    check_coloring(input_data, result)
+
+
+def test_tabu_coloring_is_valid():
+    input_data = graph_text(80, random_graph(80, 0.4, 3))
+    result = graph_coloring_tabu.solve(input_data, time_limit=2)
+    check_coloring(input_data, result)
+
+
+def test_odd_cycle_needs_three_colors():
+    input_data = graph_text(5, [(i, (i + 1) % 5) for i in range(5)])
+    for solver in (graph_coloring, graph_coloring_tabu):
+        result = solver.solve(input_data, time_limit=5)
+        check_coloring(input_data, result)
+        assert result.objective == 3
@@ -0,0 +1,90 @@
+import itertools
+import random
+
+import pytest
+
+from knapsack import CapacityQueries, Item, branch_and_bound, dynamic_programming, solve, subset_sum
+
+
+def random_items(count, seed, proportional=False):
+    rng = random.Random(seed)
+    weights = [rng.randint(1, 30) for _ in range(count)]
+    values = list(weights) if proportional else [rng.randint(1, 50) for _ in range(count)]
+    return values, weights
+
+
+def brute_force(values, weights, capacity):
+    best = 0
+    for taken in itertools.product((0, 1), repeat=len(values)):
+        if sum(w for w, t in zip(weights, taken) if t) <= capacity:
+            best = max(best, sum(v for v, t in zip(values, taken) if t))
+    return best
+
+
+def check_selection(values, weights, capacity, value, taken):
+    assert sum(w for w, t in zip(weights, taken) if t) <= capacity
+    assert sum(v for v, t in zip(values, taken) if t) == value
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_engines_match_brute_force(seed):
+    values, weights = random_items(10, seed)
+    capacity = sum(weights) // 2
+    items = [Item(i, value, weight) for i, (value, weight) in enumerate(zip(values, weights))]
+    expected = brute_force(values, weights, capacity)
+
+    for memory_budget in (2 ** 30, 0):
+        # A zero budget forces the Hirschberg reconstruction
+        value, taken = dynamic_programming(items, capacity, memory_budget)
+        assert value == expected
+        check_selection(values, weights, capacity, value, taken)
+
+    value, taken, optimal = branch_and_bound(items, capacity, time_limit=10)
+    assert (value, optimal) == (expected, 1)
+    check_selection(values, weights, capacity, value, taken)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_subset_sum_matches_brute_force(seed):
+    values, weights = random_items(12, seed, proportional=True)
+    capacity = sum(weights) // 3
+    items = [Item(i, value, weight) for i, (value, weight) in enumerate(zip(values, weights))]
+    value, taken = subset_sum(items, capacity)
+    assert value == brute_force(values, weights, capacity)
+    check_selection(values, weights, capacity, value, taken)
+
+
+@pytest.mark.parametrize('memory_budget', [2 ** 30, 0])
+def test_capacity_queries_match_brute_force(memory_budget):
+    values, weights = random_items(9, 7)
+    queries = CapacityQueries(sum(weights), values[:5], weights[:5], memory_budget)
+    queries.add_items(values[5:], weights[5:])
+    for capacity in range(0, sum(weights) + 1, 7):
+        value = queries.value(capacity)
+        assert value == brute_force(values, weights, capacity)
+        check_selection(values, weights, capacity, value, queries.selection(capacity))
+    with pytest.raises(ValueError):
+        queries.value(sum(weights) + 1)
+
+
+def test_solve_reports_the_proven_optimum():
+    values, weights = random_items(10, 3)
+    capacity = sum(weights) // 2
+    input_data = f'{len(values)} {capacity}\n' + '\n'.join(f'{v} {w}' for v, w in zip(values, weights))
+    expected = brute_force(values, weights, capacity)
+    for method in ('dp', 'bnb', 'auto'):
+        result = solve(input_data, method)
+        assert (result.objective, result.optimal) == (expected, 1)
+        assert result.output.startswith(f'{expected} 1\n')
+
+
+def test_infeasible_initial_solution_is_ignored():
+    values, weights = random_items(10, 5)
+    capacity = sum(weights) // 2
+    input_data = f'{len(values)} {capacity}\n' + '\n'.join(f'{v} {w}' for v, w in zip(values, weights))
+    expected = brute_force(values, weights, capacity)
+    # Taking every item overflows the knapsack, and a selection of the wrong length is no solution
+    for initial in ([1] * len(values), [1]):
+        result = solve(input_data, 'bnb', initial=initial)
+        assert (result.objective, result.optimal) == (expected, 1)
+        check_selection(values, weights, capacity, result.objective, result.solution)
@@ -0,0 +1,40 @@
+from knapsack import solve
+from results import SolveResult
+from solution_cache import SolutionCache, cached_solve
+
+INPUT_DATA = '4 11\n8 4\n10 5\n15 8\n4 3\n'
+
+INSTANCE = {'capacity': 11}
+
+
+def test_repeated_solve_hits_the_cache(tmp_path):
+    cache = SolutionCache(str(tmp_path))
+    first = solve(INPUT_DATA, cache=cache)
+    assert not first.statistics.get('cached')
+    objectives = list()
+    second = solve(INPUT_DATA, cache=cache, on_solution=objectives.append)
+    assert second.statistics['cached']
+    assert (second.objective, second.optimal, second.solution) == (first.objective, 1, first.solution)
+    assert objectives == [first.objective]
+
+
+def test_larger_budget_misses_and_warm_starts(tmp_path):
+    cache = SolutionCache(str(tmp_path))
+    starts = list()
+
+    def solver(objective):
+        def run(initial):
+            starts.append(initial)
+            return SolveResult('tsp', objective, 0, [objective], str(objective))
+        return run
+
+    assert cached_solve(cache, 'tsp', INSTANCE, {}, 1, None, solver(10)).objective == 10
+    # Within the cached budget the entry answers, a larger budget solves again from the cached solution
+    assert cached_solve(cache, 'tsp', INSTANCE, {}, 1, None, solver(5)).objective == 10
+    assert cached_solve(cache, 'tsp', INSTANCE, {}, 2, None, solver(12)).objective == 12
+    assert starts == [None, [10]]
+    # The worse result did not replace the cached solution, but its budget is remembered
+    entry = cache.get(cache.key('tsp', INSTANCE, {}))
+    assert (entry['objective'], entry['time_limit']) == (10, 2)
+    # Another configuration is another entry
+    assert cached_solve(cache, 'tsp', INSTANCE, {'method': 'other'}, 1, None, solver(7)).objective == 7
@@ -0,0 +1,74 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+import tsp_local_search
+from tour import ArrayTour, TwoLevelTour
+from tsp_local_search import double_bridge_kick, tour_length
+
+
+def random_points(count, seed=0):
+    return np.random.default_rng(seed).uniform(0, 1000, size=(count, 2))
+
+
+def edges(cities):
+    return {frozenset((cities[i - 1], cities[i])) for i in range(len(cities))}
+
+
+@pytest.mark.parametrize('tour_class', [ArrayTour, TwoLevelTour])
+def test_kicks_keep_the_tour_and_its_length(tour_class):
+    points = random_points(300)
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    order = list(range(len(points)))
+    options = {'segment_size': 8} if tour_class is TwoLevelTour else {}
+    tour = tour_class(order, **options)
+    rng = random.Random(1)
+    length = tour_length(points, order)
+    for _ in range(200):
+        delta, _ = double_bridge_kick(tour, xs, ys, rng, 20)
+        length += delta
+        cities = tour.cities()
+        assert sorted(cities) == order
+        assert math.isclose(length, tour_length(points, cities))
+
+
+def test_two_level_tour_follows_the_array_tour():
+    order = list(range(200))
+    array, two_level = ArrayTour(order), TwoLevelTour(order, segment_size=8)
+    rng = random.Random(2)
+    for _ in range(300):
+        first = rng.randrange(len(order))
+        last = array.order[(array.position[first] + rng.randrange(1, 20)) % len(order)]
+        array.reverse(first, last)
+        two_level.reverse(first, last)
+        assert two_level.cities(0) == array.cities(0)
+
+
+@pytest.mark.parametrize('tour_class', [ArrayTour, TwoLevelTour])
+def test_rollback_restores_the_tour(tour_class):
+    points = random_points(120, seed=3)
+    distance = lambda a, b: math.dist(points[a], points[b])
+    tour = tour_class(list(range(len(points))), distance)
+    before, length = tour.cities(0), tour.length
+    rng = random.Random(3)
+    tour.start_journal()
+    for _ in range(50):
+        a, c = rng.sample(range(len(points)), 2)
+        b, d = tour.next(a), tour.next(c)
+        if len({a, b, c, d}) == 4:
+            tour.two_opt_move(a, b, c, d)
+    assert math.isclose(tour.length, tour.compute_length())
+    tour.rollback()
+    assert edges(tour.cities(0)) == edges(before)
+    assert tour.length == length
+
+
+def test_solve_reports_the_length_of_a_two_level_tour(monkeypatch):
+    points = random_points(400, seed=4)
+    monkeypatch.setattr(tsp_local_search, 'make_tour', lambda order: TwoLevelTour(order, segment_size=8))
+    lengths = list()
+    route = tsp_local_search.solve(points, 2, on_solution=lengths.append)
+    assert sorted(route) == list(range(len(points)))
+    assert math.isclose(lengths[-1], tour_length(points, route))